@@ -0,0 +1,36 @@
+"""
+Benchmark the passage file reader against the former python-engine read_csv path.
+
+    python benchmarks/bench_passages.py [n_passes ...]
+"""
+import os
+import sys
+import tempfile
+import timeit
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+from passages import read_passages, PASSAGE_COLUMNS
+from synthetic import write_passage_file
+
+
+def read_passages_legacy(filename):
+    passages = pd.read_csv(filename, comment='#', sep=r'\s+', engine='python', header=None)
+    passages.columns = PASSAGE_COLUMNS
+    passages['ID'] = passages['ID'].astype(str).str.zfill(5)
+    return passages
+
+
+def main(sizes):
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "passages.txt")
+            write_passage_file(path, n)
+            for name, func in [("legacy", read_passages_legacy), ("read_passages", read_passages)]:
+                best = min(timeit.repeat(lambda: func(path), number=1, repeat=3))
+                print(f"{n:>8} rows  {name:<14} {best * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [10_000, 100_000])
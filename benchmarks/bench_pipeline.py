@@ -0,0 +1,217 @@
+"""
+Benchmark the chat -> planner -> render pipeline offline, on synthetic data, and
+save the timings as JSON.
+
+    python benchmarks/bench_pipeline.py [--quick] [--output results.json]
+                                        [--baseline previous.json] [--tolerance 0.25]
+                                        [--chunks recorded_stream.jsonl]
+
+Each case is timed several times and its best and median times are saved. With
+--baseline, the cases more than `tolerance` slower than in the baseline are
+listed and the script exits with status 1.
+
+The recorded streams given with --chunks are JSONL files with one chunk per line,
+in the JSON format of ChatCompletionChunk (e.g. `chunk.model_dump_json()` of the
+chunks of a real response). Without it, a synthetic stream of tool calls is used.
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from openai.types.chat import ChatCompletionChunk
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+import lm_hackers
+import planner
+import prescreen
+import utils
+from passages import read_passages
+from synthetic import chat_session, tool_call_chunks, write_passage_file, write_tle_file
+from tle_catalog import TLECatalog
+
+# Number of passes of the passage files and objects of the TLE files. The largest
+# TLE file has the size of the planner's BULK catalog.
+SIZES = {
+    "passes": [1_000, 10_000, 100_000],
+    "objects": [1_000, 30_000],
+    "turns": [10, 50, 200],
+    "table_rows": [20, 1_000, 100_000],
+}
+QUICK_SIZES = {
+    "passes": [1_000, 10_000],
+    "objects": [1_000, 5_000],
+    "turns": [10, 50],
+    "table_rows": [20, 1_000],
+}
+
+
+def measure(func, setup=None, repeat=5):
+    """
+    Time `func` `repeat` times.
+
+    Args:
+        func: Function to time, called with the value returned by `setup`, if any
+        setup: Untimed function run before each call (e.g. to clear a cache)
+        repeat: Number of timed calls
+
+    Returns:
+        dict: Best and median time in milliseconds
+    """
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup is not None else None
+        start = time.perf_counter()
+        func(arg) if setup is not None else func()
+        times.append((time.perf_counter() - start) * 1000)
+    return {"best_ms": min(times), "median_ms": statistics.median(times), "repeat": repeat}
+
+
+def stream_tool_calls(chunks):
+    """Aggregate a stream with the function of the app's `stream_response`, without the session state."""
+    last_stream = {"finish_reason": None, "tool_calls": {}, "usage": None}
+    for _ in lm_hackers.aggregate_stream(chunks, last_stream):
+        pass
+    return lm_hackers.handle_stream_response_tool_calls(last_stream)
+
+
+def load_chunks(path):
+    with open(path, "r") as f:
+        return [ChatCompletionChunk.model_validate_json(line) for line in f if line.strip()]
+
+
+def bench_planner_outputs(tmp, sizes, record):
+    tle_files = {}
+    for n_objects in sizes["objects"]:
+        path = os.path.join(tmp, f"tle_{n_objects}.txt")
+        tle_files[n_objects] = (path, write_tle_file(path, n_objects))
+        record("read_tle_file (cold)", n_objects,
+               measure(lambda _: planner.read_tle_file(path), setup=TLECatalog._cache.clear))
+        record("read_tle_file (cached)", n_objects, measure(lambda: planner.read_tle_file(path)))
+
+    # Passages of the objects of the largest catalog, as in a BULK run
+    tle_path, ids = tle_files[max(tle_files)]
+    catalog = planner.read_tle_file(tle_path)
+    record("prescreen (8 h, 45 deg)", len(catalog),
+           measure(lambda: prescreen.prescreen(catalog, 2460550.0, 2460550.0 + 8 / 24, 45.0), repeat=3))
+    for n_passes in sizes["passes"]:
+        path = os.path.join(tmp, f"passages_{n_passes}.txt")
+        write_passage_file(path, n_passes, ids=ids)
+        repeat = 3 if n_passes >= 100_000 else 5
+        record("read_passages", n_passes, measure(lambda: read_passages(path), repeat=repeat))
+        passages = read_passages(path)
+        # Satrecs are cached per object by the catalog, so the cold case reloads it
+        record("plot_passages (cold catalog)", n_passes,
+               measure(lambda catalog: planner.plot_passages(passages, catalog),
+                       setup=lambda: TLECatalog(tle_path), repeat=repeat))
+        record("plot_passages", n_passes, measure(lambda: planner.plot_passages(passages, catalog), repeat=repeat))
+
+
+def bench_context(sizes, record):
+    for n_turns in sizes["turns"]:
+        messages = chat_session(n_turns)
+        # Serialized items are cached in the messages, so the cold case works on a copy
+        record("prepare_context_messages (cold)", n_turns,
+               measure(lambda msgs: lm_hackers.prepare_context_messages(msgs, max_tokens=100_000),
+                       setup=lambda: copy.deepcopy(messages)))
+        record("prepare_context_messages (cached)", n_turns,
+               measure(lambda: lm_hackers.prepare_context_messages(messages, max_tokens=100_000)))
+
+    for n_rows in sizes["table_rows"]:
+        table = chat_session(1, table_rows=n_rows)[2]["content"][2]
+        record("serialize_content (table)", n_rows, measure(lambda: utils.serialize_content(table, "text")))
+
+
+def bench_streams(chunk_files, record):
+    streams = {f"synthetic {n} calls": tool_call_chunks(n_calls=n) for n in (1, 4)}
+    streams = {name: [ChatCompletionChunk.model_validate(c) for c in chunks] for name, chunks in streams.items()}
+    for path in chunk_files:
+        streams[os.path.basename(path)] = load_chunks(path)
+
+    for name, chunks in streams.items():
+        record(f"aggregate_stream ({name})", len(chunks),
+               measure(lambda: stream_tool_calls(chunks), repeat=20))
+        # Content of the tool messages built from the recorded calls
+        arguments = "\n".join(tc["function"]["arguments"] for tc in stream_tool_calls(chunks))
+        record(f"serialize_content (code, {name})", len(arguments),
+               measure(lambda: utils.serialize_content(arguments * 50, "code"), repeat=20))
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(output, baseline_path, tolerance):
+    """List the cases more than `tolerance` slower than in the baseline."""
+    with open(baseline_path, "r") as f:
+        baseline = json.load(f)
+    if baseline["meta"]["quick"] != output["meta"]["quick"]:
+        # Cases of the same size don't use the same catalog in quick and full runs
+        raise SystemExit("The baseline was not run with the same sizes (--quick)")
+    baseline = {(r["name"], r["size"]): r for r in baseline["results"]}
+    results = output["results"]
+    regressions = []
+    for result in results:
+        previous = baseline.get((result["name"], result["size"]))
+        if previous is not None and result["best_ms"] > previous["best_ms"] * (1 + tolerance):
+            regressions.append((result, previous))
+    for result, previous in regressions:
+        print(f"REGRESSION {result['name']} [{result['size']}]: "
+              f"{previous['best_ms']:.2f} ms -> {result['best_ms']:.2f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="Smaller sizes, for a quick check")
+    parser.add_argument("--output", default="bench_pipeline.json", help="JSON file of the results")
+    parser.add_argument("--baseline", help="JSON results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown over the baseline")
+    parser.add_argument("--chunks", nargs="*", default=[], help="Recorded chunk streams (JSONL)")
+    args = parser.parse_args()
+
+    sizes = QUICK_SIZES if args.quick else SIZES
+    results = []
+
+    def record(name, size, timing):
+        results.append({"name": name, "size": size, **timing})
+        print(f"{name:<60} {size:>8}  {timing['best_ms']:10.3f} ms")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_planner_outputs(tmp, sizes, record)
+    bench_context(sizes, record)
+    bench_streams(args.chunks, record)
+
+    output = {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "quick": args.quick,
+            # Token counts are estimated when the tokenizer is not available
+            "tokenizer": bool(lm_hackers._encoding),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if args.baseline and compare(output, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Benchmark the startup of the chatbot script: the first run in a new process (cold)
+and the reruns Streamlit makes on every interaction (warm).
+
+    OBS_PLANNER_ROOT=/path/to/obs_planner python benchmarks/bench_startup.py [n_reruns]
+
+The app runs in mock mode, without database setup or weave tracing. If
+OBS_PLANNER_ROOT is not set, a minimal default configuration is written to a
+temporary planner root, as the planner itself is not imported until it runs.
+"""
+import os
+import sys
+import tempfile
+import time
+
+import yaml
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+MINIMAL_CONFIG = {
+    "General": {"TLEFile": "LEO", "OutPath": ""},
+    "Criteria": {"TimeStart": "Now", "SearchTime": "08;00", "NameCriteria": ""},
+    "User": {"Username": "llm", "UserUniqueId": "bench", "UserProject": "bench"},
+}
+
+
+def main(n_reruns):
+    os.environ.update({"IS_MOCK": "True", "IS_DEVELOPMENT": "False",
+                       "WEAVE_DISABLED": "true", "WEAVE_PROJECT_NAME": "bench"})
+    if not os.getenv("OBS_PLANNER_ROOT"):
+        root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(root, "configs"))
+        with open(os.path.join(root, "configs", "config_default.yaml"), "w") as f:
+            yaml.safe_dump(MINIMAL_CONFIG, f)
+        os.environ["OBS_PLANNER_ROOT"] = root
+    os.chdir(REPO_ROOT) # the app reads its prompts relative to the repo root
+
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(os.path.join(REPO_ROOT, "src", "app.py"), default_timeout=120)
+    start = time.perf_counter()
+    app.run()
+    cold = time.perf_counter() - start
+    if app.exception:
+        raise RuntimeError(app.exception[0].message)
+
+    warm = []
+    for _ in range(n_reruns):
+        start = time.perf_counter()
+        app.run()
+        warm.append(time.perf_counter() - start)
+
+    warm.sort()
+    print(f"cold run        {cold * 1000:8.1f} ms")
+    print(f"warm rerun p50  {warm[len(warm) // 2] * 1000:8.1f} ms")
+    print(f"warm rerun max  {warm[-1] * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
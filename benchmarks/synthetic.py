@@ -0,0 +1,158 @@
+"""Synthetic SatellitePredictor outputs, chat sessions and LLM streams for benchmarking."""
+import json
+
+import numpy as np
+import pandas as pd
+
+# Mean motion (rev/day) range and inclination range (deg) of each orbit class
+ORBITS = {
+    "LEO": ((14.0, 16.0), (0.0, 100.0)),
+    "MEO": ((1.8, 2.2), (50.0, 65.0)),
+    "GEO": ((0.99, 1.01), (0.0, 15.0)),
+}
+
+# Share of each orbit class in a catalog like the planner's BULK file
+BULK_MIX = {"LEO": 0.85, "MEO": 0.05, "GEO": 0.10}
+
+PASSAGE_HEADER = ("#" + "".join(f"{c:>20}" for c in [
+    "ID", "name", "epoch", "t0 [MJD]", "az0 [deg]", "el0 [deg]", "t1 [MJD]", "az1 [deg]",
+    "el1 [deg]", "t2 [MJD]", "az2 [deg]", "el2 [deg]", "exposures", "filter", "exp_time",
+    "delay_after", "bin"]))
+
+
+def write_passage_file(path, n_passes, seed=0, jd_start=2460550.0, ids=None):
+    """
+    Write a passage file with `n_passes` rows in the SatellitePredictor format.
+
+    Args:
+        path: Output path
+        n_passes: Number of passages
+        seed: Random seed
+        jd_start: Julian Date of the first passage
+        ids: NORAD IDs to draw the passages from (e.g. those of a TLE file written
+            by `write_tle_file`). Defaults to any ID.
+    """
+    rng = np.random.default_rng(seed)
+    pool = np.arange(1, 99999) if ids is None else np.asarray(ids)
+    ids = rng.choice(pool, size=n_passes, replace=n_passes > len(pool))
+    t0 = jd_start + np.sort(rng.uniform(0, 1, n_passes))
+    t1 = t0 + rng.uniform(0, 0.005, n_passes)
+    t2 = t1 + rng.uniform(0, 0.005, n_passes)
+    az = rng.uniform(0, 360, (n_passes, 3))
+    el = rng.uniform(10, 90, (n_passes, 3))
+    epoch = t0 - rng.uniform(0, 2, n_passes)
+    with open(path, "w") as f:
+        f.write(PASSAGE_HEADER + "\n")
+        for i in range(n_passes):
+            f.write(f"{ids[i]:>18} {'SAT_' + str(ids[i]):>20} {epoch[i]:>19.8f} "
+                    f"{t0[i]:>19.8f} {az[i, 0]:>19.12f} {el[i, 0]:>19.12f} "
+                    f"{t1[i]:>19.8f} {az[i, 1]:>19.12f} {el[i, 1]:>19.12f} "
+                    f"{t2[i]:>19.8f} {az[i, 2]:>19.12f} {el[i, 2]:>19.12f} "
+                    f"{1:>23}  [gprime,rprime,iprime]           [1.0,1.0,1.0]"
+                    f"           [1.0,1.0,1.0]                 [1,1,1]\n")
+
+
+def tle_checksum(line):
+    """Modulo 10 checksum of a TLE line: the sum of its digits, with 1 for each minus sign."""
+    return sum(int(c) if c.isdigit() else c == "-" for c in line) % 10
+
+
+def write_tle_file(path, n_objects, seed=0, mix=None, epoch="24240.50000000"):
+    """
+    Write a TLE file with `n_objects` valid three-line elements.
+
+    Args:
+        path: Output path
+        n_objects: Number of objects (at most 99998, the 5-digit NORAD IDs)
+        seed: Random seed
+        mix: Share of each orbit class of ORBITS (defaults to BULK_MIX)
+        epoch: Epoch of the elements (YYDDD.DDDDDDDD)
+
+    Returns:
+        numpy.ndarray: NORAD IDs of the objects, in file order
+    """
+    rng = np.random.default_rng(seed)
+    mix = mix or BULK_MIX
+    ids = np.sort(rng.choice(np.arange(1, 99999), size=n_objects, replace=False))
+    orbits = rng.choice(list(mix), size=n_objects, p=np.array(list(mix.values())) / sum(mix.values()))
+    with open(path, "w") as f:
+        for i, (norad_id, orbit) in enumerate(zip(ids, orbits)):
+            (mm_min, mm_max), (inc_min, inc_max) = ORBITS[orbit]
+            line1 = f"1 {norad_id:05d}U 24001A   {epoch} -.00000068  00000-0  00000-0 0  999"
+            line2 = (f"2 {norad_id:05d} {rng.uniform(inc_min, inc_max):8.4f} {rng.uniform(0, 360):8.4f} "
+                     f"{rng.integers(0, 20000):07d} {rng.uniform(0, 360):8.4f} {rng.uniform(0, 360):8.4f} "
+                     f"{rng.uniform(mm_min, mm_max):11.8f}{rng.integers(0, 99999):5d}")
+            f.write(f"{i:04d} SAT_{norad_id}\n"
+                    f"{line1}{tle_checksum(line1)}\n"
+                    f"{line2}{tle_checksum(line2)}\n")
+    return ids
+
+
+def chat_session(n_turns, table_rows=200, seed=0):
+    """
+    Build the messages of a chat session as kept in the session state.
+
+    Each turn has a user prompt, an assistant tool call, the tool message (text,
+    configuration and a table of passages) and the assistant answer.
+
+    Args:
+        n_turns: Number of user turns
+        table_rows: Rows of the table of each tool message
+        seed: Random seed
+
+    Returns:
+        List[dict]: The messages
+    """
+    rng = np.random.default_rng(seed)
+    messages = []
+    for turn in range(n_turns):
+        table = pd.DataFrame({
+            "ID": [f"{i:05d}" for i in rng.integers(1, 99999, table_rows)],
+            "name": [f"SAT_{i}" for i in range(table_rows)],
+            "t0 [JD]": 2460550.0 + rng.uniform(0, 1, table_rows),
+            "az0 [deg]": rng.uniform(0, 360, table_rows),
+            "el0 [deg]": rng.uniform(10, 90, table_rows),
+        })
+        arguments = json.dumps({"config_parameters": ["TLEFile:GEO", f"NameCriteria:SAT_{turn}"]})
+        messages += [
+            {"role": "user", "content": f"Which SAT_{turn} satellites are visible tonight?"},
+            {"role": "assistant", "content": "",
+             "tool_calls": [{"id": f"call_{turn}", "type": "function",
+                             "function": {"name": "run_observation_planner", "arguments": arguments}}]},
+            {"role": "tool", "tool_call_id": f"call_{turn}", "type": ["text", "code", "text"],
+             "content": ["Parameters to update:", "TLEFile: GEO\nNameCriteria: SAT\n", table]},
+            {"role": "assistant", "content": f"{table_rows} passages were found. " * 20},
+        ]
+    return messages
+
+
+def tool_call_chunks(n_calls=2, argument_chars=400, chunk_chars=4):
+    """
+    Build the chunks of a streamed response with tool calls, as sent by the API.
+
+    The arguments of each call are split in pieces of `chunk_chars` characters,
+    about the size of the pieces streamed by the OpenAI API.
+
+    Args:
+        n_calls: Number of tool calls of the response
+        argument_chars: Length of the JSON arguments of each call
+        chunk_chars: Characters of the arguments sent in each chunk
+
+    Returns:
+        List[dict]: The chunks, in the JSON format of ChatCompletionChunk
+    """
+    def chunk(delta, finish_reason=None):
+        return {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o",
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+    chunks = [chunk({"role": "assistant", "content": None})]
+    for index in range(n_calls):
+        query = "SELECT * FROM observations WHERE designation = %s " * (argument_chars // 50 + 1)
+        arguments = json.dumps({"query": query[:argument_chars], "params": [f"SAT_{index}"]})
+        chunks.append(chunk({"tool_calls": [{"index": index, "id": f"call_{index}", "type": "function",
+                                             "function": {"name": "query_obs_db", "arguments": ""}}]}))
+        for start in range(0, len(arguments), chunk_chars):
+            piece = arguments[start:start + chunk_chars]
+            chunks.append(chunk({"tool_calls": [{"index": index, "function": {"arguments": piece}}]}))
+    chunks.append(chunk({}, finish_reason="tool_calls"))
+    return chunks
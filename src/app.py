@@ -1,5 +1,12 @@
 import sys
 import os
+import copy
+import shutil
+import importlib
+import uuid
+import threading
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
 import openai
 import streamlit as st
 import time
@@ -11,15 +18,24 @@ import logging
 import pandas as pd
 from pathlib import Path
 import json
-from lm_hackers import askgpt, handle_stream_response_tool_calls, prepare_context_messages
+from lm_hackers import (askgpt, aggregate_stream, handle_stream_response_tool_calls, load_tokenizer,
+                        prepare_context_messages, usage_metrics, volatile_context)
+from passages import PassageTail, PlannerOutput, DISPLAY_COLUMNS
+from planner_cache import CacheEntry, PlannerCache
+import intents
+import prescreen
+import tracing
 import random
-from sqlalchemy import create_engine # for development
-from db import Base
+import tempfile
+from artifact_store import ArtifactStore
+import chat_store
+from chat_store import ConversationStore
+from db import (Base, QueryCache, create_db_engine, is_read_statement, 
+                passages_to_observations, stream_query, upsert_observations)
 from utils import display_and_save
 from utils import display_messages # for development
 from streamlit.runtime.scriptrunner import get_script_run_ctx
-from datetime import datetime
-import weave
+from datetime import datetime, timezone
 
 # General config
 IS_DEV = os.getenv("IS_DEVELOPMENT", "True").lower() == "true"
@@ -27,31 +43,52 @@ IS_MOCK = os.getenv("IS_MOCK", "False").lower() == "true"
 IS_DOCKER = os.getenv("IS_DOCKER", "False").lower() == "true"
 STORE_CHATS = os.getenv("STORE_CHATS", "True").lower() == "true"
 CONTEXT_WINDOW = int(os.getenv("CONTEXT_WINDOW", 4))
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", 16000)) # token budget of the conversation context
 # Get database connection parameters from environment variables or use defaults
 DB_HOST = os.environ.get('DB_HOST', 'localhost')
 DB_PORT = os.environ.get('DB_PORT', '5432')
 DB_USER = os.environ.get('DB_USER', 'postgres')
 DB_PASSWORD = os.environ.get('DB_PASSWORD', 'postgres')
-DB_NAME = os.environ.get('DB_NAME', 'your_database_name')
+DB_NAME = os.environ.get('DB_NAME', 'targets')
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5)) # connections shared by all sessions
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 5))
+DB_STATEMENT_TIMEOUT = float(os.getenv("DB_STATEMENT_TIMEOUT", 30)) # seconds
+QUERY_CHUNK_SIZE = int(os.getenv("QUERY_CHUNK_SIZE", 1000)) # rows fetched per round trip
+QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", 10000)) # rows shown per query
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", 30)) # seconds a query result is reused (0 to disable)
+OBS_PREP_MINUTES = float(os.getenv("OBS_PREP_MINUTES", 5)) # telescope preparation before a scheduled passage
 EXCLUDE_TYPES= ["plot"] # types of messages to exclude from context
-
-weave.init(os.getenv("WEAVE_PROJECT_NAME"))
+RENDER_RECENT_TURNS = int(os.getenv("RENDER_RECENT_TURNS", 2)) # turns whose tables and figures are shown expanded
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", os.path.join(tempfile.gettempdir(), "space4_artifacts")) # tables and figures of the sessions
+ARTIFACT_TTL = int(os.getenv("ARTIFACT_TTL", 24 * 3600)) # seconds the artifacts of an inactive session are kept
+ARTIFACT_CLEANUP_INTERVAL = int(os.getenv("ARTIFACT_CLEANUP_INTERVAL", 3600)) # seconds between two cleanups of the inactive sessions
+SESSION_MEMORY_MB = int(os.getenv("SESSION_MEMORY_MB", 64)) # artifacts kept in memory per session
+STREAM_PASSAGES = os.getenv("STREAM_PASSAGES", "True").lower() == "true" # show passages while the planner runs
+STREAM_REFRESH = float(os.getenv("STREAM_REFRESH", 2)) # seconds between partial result refreshes
+PLANNER_CACHE = os.getenv("PLANNER_CACHE", "True").lower() == "true" # reuse results of identical planner runs
+PLANNER_CACHE_TTL = int(os.getenv("PLANNER_CACHE_TTL", 3600)) # seconds
+PLANNER_CACHE_MAX_MB = int(os.getenv("PLANNER_CACHE_MAX_MB", 512))
+PLANNER_MAX_WORKERS = int(os.getenv("PLANNER_MAX_WORKERS", 2)) # concurrent planner runs across all sessions
+TOOL_MAX_WORKERS = int(os.getenv("TOOL_MAX_WORKERS", 8)) # concurrent database queries of tool calls across all sessions
+LOCAL_INTENTS = os.getenv("LOCAL_INTENTS", "True").lower() == "true" # start the planner without waiting for the LLM on routine requests
+PRESCREEN_TLE_FILE = os.getenv("PRESCREEN_TLE_FILE") # TLE catalogs saved by the planner, e.g. /data/SatTLEs/{TLEFile}.txt
+PRESCREEN_MAX_AGE = 24 * 3600 # seconds after which a saved catalog is too old to screen with
+PRESCREEN_MAX_IDS = 2000 # above this, the survivors are not given to the planner by ID
+TRACE_FILE = os.getenv("TRACE_FILE") # JSONL file the timing spans of each rerun are appended to
+LATENCY_TURNS = 20 # turns kept in the latency panel of development mode
+PERSIST_CHATS = os.getenv("PERSIST_CHATS", "False").lower() == "true" # save the conversations to the database, to restore them by ID
+CHAT_DB_USER = os.getenv("CHAT_DB_USER") # role owning the conversations, which the query tool's role (DB_USER) can't read
+CHAT_DB_PASSWORD = os.getenv("CHAT_DB_PASSWORD", "")
+CHAT_RETENTION_DAYS = float(os.getenv("CHAT_RETENTION_DAYS", 30)) # days a conversation is kept after its last update
+PERSIST_FLUSH_INTERVAL = float(os.getenv("PERSIST_FLUSH_INTERVAL", 1)) # seconds the writes of the conversations are batched
 
 ctx = get_script_run_ctx()
 project_root = Path(__file__).parent.parent.absolute()
 obs_planner_root = "/app/obs_planner" if IS_DOCKER else os.getenv("OBS_PLANNER_ROOT")
 satpred_output_dir = os.getenv("SAT_PREDICTOR_OUTPUT_DIR")
-current_datetime = datetime.now()
-current_date = current_datetime.strftime("%Y-%m-%d")
-current_time = current_datetime.strftime("%H:%M:%S")
-
-# Import observation planner
-sys.path.append(obs_planner_root)
-import src as obs_planner # src refers to the src folder in the observation planner
 
 # Set up OpenAI API credentials
 openai.api_key = os.getenv("OPENAI_API_KEY")
-client = openai.OpenAI()
 
 
 #########################################################
@@ -63,48 +100,467 @@ if "messages" not in st.session_state:
     st.session_state.messages = []
 
 
-def stream_response(compl, yield_in="content", sleep=0.01):
+@st.cache_resource
+def init_weave():
+    """Initialize weave tracing once per process (it is imported here, as it is slow to load)."""
+    import weave
+    weave.init(os.getenv("WEAVE_PROJECT_NAME"))
+
+
+@st.cache_resource
+def get_obs_planner():
+    """Import the observation planner on its first run (it pulls in astropy and skyfield)."""
+    sys.path.append(obs_planner_root)
+    return importlib.import_module("src") # src refers to the src folder in the observation planner
+
+
+@st.cache_resource
+def get_artifact_cleanup():
+    """Get the state of the artifact cleanup, shared by every session of the process."""
+    return {"lock": threading.Lock(), "next": 0.0}
+
+
+def cleanup_artifacts():
+    """
+    Remove the artifacts of the sessions inactive for ARTIFACT_TTL.
+
+    Called on every rerun, it runs at most once per ARTIFACT_CLEANUP_INTERVAL
+    across the sessions, and never concurrently.
+    """
+    cleanup = get_artifact_cleanup()
+    if time.monotonic() < cleanup["next"] or not cleanup["lock"].acquire(blocking=False):
+        return
+    try:
+        cleanup["next"] = time.monotonic() + ARTIFACT_CLEANUP_INTERVAL
+        ArtifactStore.cleanup(ARTIFACT_DIR, ARTIFACT_TTL)
+    finally:
+        cleanup["lock"].release()
+
+
+@st.cache_resource
+def init_db():
+    """
+    Create the missing database tables, once per process (development only).
+
+    Existing tables are not changed: they are migrated with `python src/db.py`.
+    """
+    Base.metadata.create_all(bind=get_db_engine(), checkfirst=True)
+
+
+@st.cache_resource
+def load_default_conf():
+    """
+    Load the default planner configuration and the user data of the chatbot.
+
+    The configuration is shared by all sessions and must not be modified (runs
+    work on copies of it).
+
+    Returns:
+        tuple: (default_conf, UserData)
+    """
+    default_conf_path = os.path.join(obs_planner_root, "configs", "config_default.yaml")
+    with open(default_conf_path, "r") as file:
+        default_conf = yaml.safe_load(file)
+
+    UserData = {
+            "organization" : default_conf['User']['UserUniqueId'], \
+            "username": "llm", \
+            "user_unique_id": default_conf['User']['UserUniqueId'], \
+            "user_project": default_conf['User']['UserProject']
+        }
+    default_conf['User']['Username'] = "llm"
+    return default_conf, UserData
+
+
+@st.cache_resource
+def load_prompts(username):
+    """
+    Load the call preset, system prompt, demonstrations and starters, once per process.
+
+    Returns:
+        tuple: (preset, system_prompt, demonstrations_context, starters)
+    """
+    # Load preset (default call configuration taken from the playground)
+    # https://platform.openai.com/playground/p/M4iHV1L0uG6MK5SwNMzfVi9E?mode=chat
+    with open("src/prompts/preset.json", "r") as file:
+        preset = json.load(file)
+        preset.pop('system', None) # the system prompt is taken separately
+        preset.pop('messages', []) # the messages are taken separately
+
+    # Read system prompt (instructions) from file. It must not contain values that change
+    # between calls (e.g. the current time, see volatile_context), so it can be cached
+    with open("src/prompts/instructions.md", "r") as file:
+        system_prompt = file.read()
+        system_prompt = system_prompt.replace("{{USERNAME}}", username)
+
+    # Read demonstrations (few shot prompts) and add them as messages. They are always sent
+    # in full, as part of the static prompt prefix
+    with open("src/prompts/demonstrations.json", "r") as file:
+        demonstrations = json.load(file)
+        demonstrations_context = prepare_context_messages(demonstrations)
+
+    with open("src/prompts/starters.md", "r") as file:
+        starters = file.readlines()
+        starters = [starter.strip() for starter in starters if not starter.startswith('#') and starter.strip()]
+
+    return preset, system_prompt, demonstrations_context, starters
+
+
+@st.cache_resource
+def get_planner_cache():
+    """Get the planner result cache shared by all sessions (None if disabled)."""
+    if not PLANNER_CACHE or IS_MOCK:
+        return None
+    cache_dir = os.getenv("PLANNER_CACHE_DIR", os.path.join(satpred_output_dir, ".planner_cache"))
+    return PlannerCache(cache_dir, ttl=PLANNER_CACHE_TTL, max_bytes=PLANNER_CACHE_MAX_MB * 1024**2)
+
+
+@st.cache_resource
+def get_db_engine():
+    """Get the database engine shared by all sessions, with a bounded connection pool."""
+    database_url = f'postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+    return create_db_engine(database_url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                            statement_timeout=DB_STATEMENT_TIMEOUT)
+
+
+@st.cache_resource
+def get_conversation_store():
+    """
+    Get the store of the conversations shared by all sessions, with its writer thread (None if disabled).
+
+    The conversations are written with their own role (CHAT_DB_USER). They are not
+    saved if the role of the query tool (DB_USER) could read them.
+    """
+    if not PERSIST_CHATS:
+        return None
+    if not CHAT_DB_USER or CHAT_DB_USER == DB_USER:
+        logging.warning("Conversations are not saved: CHAT_DB_USER must be set to a role other than DB_USER")
+        return None
+    database_url = f'postgresql+psycopg2://{CHAT_DB_USER}:{CHAT_DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+    engine = create_db_engine(database_url, pool_size=2, max_overflow=2, statement_timeout=DB_STATEMENT_TIMEOUT)
+    store = ConversationStore(engine, retention_days=CHAT_RETENTION_DAYS, flush_interval=PERSIST_FLUSH_INTERVAL)
+    try:
+        store.create_tables()
+        if not store.is_isolated_from(DB_USER):
+            logging.warning(f"Conversations are not saved: the role {DB_USER} can read the schema {chat_store.SCHEMA}")
+            return None
+    except Exception as e:
+        logging.warning(f"Conversations are not saved, the database can't be reached: {e}")
+        return None
+    store.start()
+    return store
+
+
+@st.cache_resource
+def get_query_cache():
+    """Get the query result cache shared by all sessions."""
+    return QueryCache(ttl=QUERY_CACHE_TTL)
+
+
+@st.cache_resource
+def get_planner_pool():
+    """Get the worker pool shared by all sessions, which bounds the number of concurrent planner runs."""
+    return ThreadPoolExecutor(max_workers=PLANNER_MAX_WORKERS, thread_name_prefix="planner")
+
+
+@st.cache_resource
+def get_tool_pool():
+    """Get the worker pool shared by all sessions, where the database queries of tool calls run concurrently."""
+    return ThreadPoolExecutor(max_workers=TOOL_MAX_WORKERS, thread_name_prefix="tool")
+
+
+def stream_response(compl, yield_in="content"):
     """
     Streams the response from an API completion object and yields content incrementally.
 
-    This function processes completion chunks, extracts specified content, and maintains
-    a history of the stream in the session state. It can also simulate a streaming delay.
+    This function processes completion chunks as they arrive, extracts specified content,
+    and aggregates the tool call deltas and the finish reason of the stream in the
+    session state (see lm_hackers.aggregate_stream).
 
     Args:
         compl: The chat completion object with the response of the model
         yield_in (str): The attribute to extract from each chunk's delta (default: "content")
-        sleep (float): Time in seconds to sleep between chunks for streaming effect (default: 0.01)
 
     Yields:
         str: Content extracted from each chunk based on the yield_in parameter
 
     Note:
-        - Stores the stream history in st.session_state["last_stream"]
-        - If sleep is truthy, adds a 0.01s delay between chunks
+        - Stores the aggregated stream in st.session_state["last_stream"], as a dict with
+          the "finish_reason", the "tool_calls" (by index) and the "usage" of the response
+    """
+    last_stream = {"finish_reason": None, "tool_calls": {}, "usage": None}
+    st.session_state["last_stream"] = last_stream
+    yield from aggregate_stream(compl, last_stream, yield_in)
+
+
+def record_usage(call_name):
+    """Logs the token usage (cached vs uncached prompt tokens) of the last streamed call and keeps it in the session."""
+    usage = st.session_state["last_stream"].get("usage")
+    if usage is None:
+        return
+    metrics = {"call": call_name, **usage_metrics(usage)}
+    st.session_state.setdefault("llm_usage", []).append(metrics)
+    logging.info(f"LLM usage: {metrics}")
+
+
+def planner_output_files(planner_conf):
     """
-    st.session_state["last_stream"] = []
-    for chunk in compl:
-        content = getattr(chunk.choices[0].delta, yield_in, "")
-        if content is not None:
-            yield content
-        st.session_state["last_stream"].append(chunk.choices[0])
-        if sleep: time.sleep(0.01)  # Simulate delay for streaming effect
+    Get the paths of the passage and TLE files written by the planner for a configuration.
 
+    Args:
+        planner_conf: The configuration given to the planner
 
-def run_observation_planner(config_parameters, st_status):
+    Returns:
+        tuple: (passages_file, tle_file)
+    """
+    if IS_MOCK:
+        passages_file = os.path.join(project_root, "mock_data", "2024_11_15__Passage_Galaxy.txt")
+        tle_file = os.path.join(project_root, "mock_data", "2024_11_15__TLE_Galaxy.txt")
+    else:
+        username = planner_conf['User']['Username']
+        date_utc_with_underscore = utils.format_date_for_filename(planner_conf['Criteria']['TimeStart'])
+        passages_file = os.path.join(satpred_output_dir, date_utc_with_underscore + "__Passage_" + username + '.txt')
+        tle_file = os.path.join(satpred_output_dir, date_utc_with_underscore + "__TLE_" + username + '.txt')
+    return passages_file, tle_file
+
+
+def session_run_dir():
+    """Get the directory of the planner files kept by the session, removed with its artifacts."""
+    run_dir = os.path.join(st.session_state.artifact_store.directory, "runs")
+    os.makedirs(run_dir, exist_ok=True)
+    return run_dir
+
+
+def pin_planner_results(results):
+    """
+    Copy the files of cached planner results to the session's directory.
+
+    Cache entries expire after PLANNER_CACHE_TTL, while the session may still
+    schedule their passages later (see schedule_passages). The files of runs that
+    were not cached are already kept by the session (see release_run_files).
+
+    Returns:
+        PlannerOutput: The session's copy (or the results, if not from the cache)
+    """
+    if not isinstance(results, CacheEntry):
+        return results
+    prefix = os.path.join(session_run_dir(), f"{uuid.uuid4().hex[:8]}_")
+    return PlannerOutput(shutil.copyfile(results.passages_file, prefix + os.path.basename(results.passages_file)),
+                         shutil.copyfile(results.tle_file, prefix + os.path.basename(results.tle_file)))
+
+
+def release_run_files(run, keep=False):
+    """
+    Remove the output files of a planner run from the planner's output directory.
+
+    The planner writes them to its shared output directory, under names unique to
+    the run. Files still needed (results that are not cached, for schedule_passages)
+    are moved to the session's directory, removed with its artifacts (see
+    cleanup_artifacts); the others are deleted.
+
+    Args:
+        run: PlannerOutput of the run
+        keep: If True, move the files instead of deleting them
+
+    Returns:
+        PlannerOutput: The moved files (None if deleted)
+    """
+    paths = (run.passages_file, run.tle_file)
+    if keep:
+        run_dir = session_run_dir()
+        return PlannerOutput(*(shutil.move(path, run_dir) if os.path.exists(path) else path for path in paths))
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return None
+
+
+def abandon_planner_run(run, output):
+    """
+    Cancel a planner run whose output will not be consumed, or release its files once it ends.
+
+    A run that has not started yet is cancelled. A running one can't be stopped, so
+    its files are only removed once it returns, as the planner is still writing them.
+
+    Args:
+        run: PlannerOutput of the run
+        output: FunctionOutput of the run (see start_planner_run)
+    """
+    if not output.cancel():
+        output.add_done_callback(lambda: release_run_files(run))
+
+
+def follow_passages(output, passages_file, tle_file):
+    """
+    Pass through the output of the planner while showing the passages found so far.
+
+    Every time the planner writes a line (or stays idle for a while), the new rows of
+    the passage file are read and the partial table is refreshed. The map is
+    refreshed at most every STREAM_REFRESH seconds. The partial results are removed
+    once the planner finishes, as the complete ones are displayed afterwards.
+
+    Args:
+        output: Generator with the output of the planner
+        passages_file: Path of the passage file being written by the planner
+        tle_file: Path of the TLE file being written by the planner
+
+    Yields:
+        str: The lines of the planner output
+    """
+    tail = PassageTail(passages_file)
+    table = st.empty()
+    plot = st.empty()
+    last_plot = 0
+    try:
+        for line in output:
+            yield line
+            try:
+                if tail.poll() is None:
+                    continue
+                table.dataframe(tail.passages[DISPLAY_COLUMNS])
+                if time.monotonic() - last_plot > STREAM_REFRESH and os.path.exists(tle_file):
+                    # A unique key, as the last partial map can be identical to the final one
+                    plot.plotly_chart(planner.plot_passages(tail.passages, planner.read_tle_file(tle_file)),
+                                      key=f"partial_plot_{uuid.uuid4().hex}")
+                    last_plot = time.monotonic()
+            except Exception as e:
+                logging.warning(f"Could not show partial passages: {e}")
+    finally:
+        table.empty()
+        plot.empty()
+
+
+def parse_config_parameters(config_args):
+    """Parse the "Name:Value" configuration parameters of a planner tool call into a dict."""
+    config_dict = {}
+    for param in config_args:
+        name, value = param.split(":", 1)
+        config_dict[name.strip()] = utils.try_convert_number(value.strip())
+    return config_dict
+
+
+def planner_config(config_parameters):
+    """Merge the configuration parameters of a call into a copy of the default configuration."""
+    # Each run works on its own copy, so concurrent sessions don't share criteria
+    planner_conf = copy.deepcopy(default_conf)
+    planner_conf["Criteria"].update(config_parameters)
+    return planner_conf
+
+
+def screen_planner_run(planner_conf):
+    """
+    Pre-screen the catalog of a planner run for the objects that may pass above the
+    elevation threshold (see prescreen).
+
+    Catalogs older than PRESCREEN_MAX_AGE are not used. Those not saved on the
+    current day at the site are not fresh: they only give approximate passes, as
+    they may miss newly catalogued objects.
+
+    Returns:
+        prescreen.Prescreen: The result, or None if the catalog is not available
+    """
+    if not PRESCREEN_TLE_FILE:
+        return None
+    criteria = planner_conf["Criteria"]
+    # Parameters of the LLM are merged into the criteria, which take precedence
+    tle_file = PRESCREEN_TLE_FILE.format(TLEFile=criteria.get("TLEFile", planner_conf["General"]["TLEFile"]))
+    try:
+        saved = os.path.getmtime(tle_file)
+        if time.time() - saved > PRESCREEN_MAX_AGE:
+            logging.info(f"Not pre-screening with {tle_file}, it is too old")
+            return None
+        site_tz = timezone(prescreen.SITE_UTC_OFFSET)
+        fresh = datetime.fromtimestamp(saved, site_tz).date() == datetime.now(site_tz).date()
+        with tracing.span("prescreen") as screen_span:
+            screen = prescreen.prescreen(planner.read_tle_file(tle_file), 
+                                         *prescreen.search_window(criteria),
+                                         prescreen.min_pass_elevation(criteria),
+                                         criteria.get("NameCriteria", ""))
+            screen.fresh = fresh
+            screen_span.set(candidates=screen.n_candidates, survivors=len(screen.ids), fresh=fresh)
+        # The saved catalog may not have the objects of the name criteria yet
+        return screen if screen.n_candidates > 0 else None
+    except Exception as e:
+        logging.warning(f"Could not pre-screen the planner run: {e}")
+        return None
+
+
+def start_planner_run(planner_conf):
+    """
+    Start a run of the planner in the planner pool.
+
+    The job pre-screens the catalog first: if the catalog is fresh, only the objects
+    that may pass above the elevation threshold are given to the planner, and the
+    planner is not run at all if there are none. The screen runs in the job, so
+    starting a run never waits.
+
+    Returns:
+        tuple: (results, output, screen), the PlannerOutput of the run, the iterator
+               over the lines it prints (it ends without any if the planner is not
+               run) and a Future of the pre-screen (its result is None if the
+               catalog is not available)
+    """
+    # The planner names its output files after the user, so a unique run username
+    # keeps concurrent runs from overwriting each other's files
+    run_conf = copy.deepcopy(planner_conf)
+    run_conf['User']['Username'] = f"{UserData['username']}_{uuid.uuid4().hex[:8]}"
+    results = PlannerOutput(*planner_output_files(run_conf))
+    # Resolved here, as the job runs without the script context
+    planner_main = get_obs_planner().main
+    screen = Future()
+    context = contextvars.copy_context() # for the span of the screen
+
+    def screened_run(config_dict, **kwargs):
+        try:
+            screen.set_result(context.run(screen_planner_run, planner_conf))
+        finally:
+            if not screen.done():
+                screen.set_result(None)
+        screened = screen.result()
+        if screened is not None and screened.fresh:
+            if not screened.ids:
+                return
+            if len(screened.ids) < min(screened.n_candidates, PRESCREEN_MAX_IDS + 1):
+                config_dict['Criteria']['NameCriteria'] = ";".join(str(int(norad_id)) for norad_id in screened.ids)
+        planner_main(config_dict=config_dict, **kwargs)
+
+    output = utils.stream_function_output(screened_run, 
+                                          idle_interval=STREAM_REFRESH if STREAM_PASSAGES else None,
+                                          executor=get_planner_pool(),
+                                          config_dict=run_conf, txt_to_json=False, fill_with_defaults=False)
+    return results, output, screen
+
+
+def show_approximate_passes(screen):
+    """Show the approximate passes of the pre-screen until the exact ones are ready (returns the placeholder)."""
+    placeholder = st.empty()
+    if screen is not None and len(screen.passes):
+        with placeholder.container():
+            st.caption("Approximate passes from the pre-screen, while the planner runs")
+            st.dataframe(screen.passes)
+    return placeholder
+
+
+@tracing.traced()
+def run_observation_planner(config_parameters, st_status, started=None):
     """
     Run the observation planner tool with the provided arguments.
     This function takes a list of arguments, passes them to the observation planner tool,
     and returns the output.
     Args:
-        *args: A list of arguments to pass to the observation planner tool
+        config_parameters: Criteria to update in the default configuration
+        st_status: Status container of the call
+        started: Run already started for this call (see start_planner_run), if any
     Returns:
-        Any: The output of the observation planner tool
+        tuple: (tool_error, planner_conf, results), where results gives access to the
+               passage and TLE files of the run (a PlannerOutput or a cache entry)
     """
     tool_error = False
-    # Show a status container while the model is thinking
-    planner_conf = default_conf
-    planner_conf["Criteria"].update(config_parameters)
+    results = None
+    planner_cache = get_planner_cache()
+    planner_conf = planner_config(config_parameters)
 
     try:
         display_and_save("Parameters to update:")
@@ -112,8 +568,47 @@ def run_observation_planner(config_parameters, st_status):
         display_and_save("Configuration")
         display_and_save(yaml.dump(planner_conf, sort_keys=False, default_flow_style=False), type="code")
 
-        if not IS_MOCK:
-            st.write_stream(utils.stream_function_output(obs_planner.main, config_dict=planner_conf, txt_to_json=False, fill_with_defaults=False))
+        if planner_cache is not None:
+            cache_key = planner_cache.key(planner_conf)
+            results = planner_cache.get(cache_key)
+
+        if started is None and results is not None:
+            display_and_save("Reusing the results of a previous run with the same configuration")
+        elif started is None and IS_MOCK:
+            results = PlannerOutput(*planner_output_files(planner_conf))
+        else:
+            results, output, screen = started if started is not None else start_planner_run(planner_conf)
+            screen = screen.result()
+            if screen is not None:
+                display_and_save(screen.summary())
+            if screen is not None and screen.fresh and not screen.ids:
+                for _ in output: # the job ends without running the planner
+                    pass
+                results = None
+                display_and_save("No object of the catalog rises high enough in the search window, "
+                                 "so the planner was not run")
+            else:
+                run, finished = results, False
+                try:
+                    approximate = show_approximate_passes(screen)
+                    lines = follow_passages(output, run.passages_file, run.tle_file) if STREAM_PASSAGES else output
+                    with tracing.span("planner_run", started_early=started is not None):
+                        st.write_stream(lines)
+                    finished = True
+                    approximate.empty()
+                    if planner_cache is not None:
+                        try:
+                            results = planner_cache.put(cache_key, run.passages_file, run.tle_file, 
+                                                        planner_conf=planner_conf)
+                        except Exception as e:
+                            logging.warning(f"Could not cache the planner results: {e}")
+                finally:
+                    if finished:
+                        kept = release_run_files(run, keep=results is run)
+                        results = kept or results
+                    else:
+                        # The run failed, or the script was stopped while the run goes on
+                        abandon_planner_run(run, output)
         lbl = "Observation planner completed"
         state = "complete"
     except Exception as e:
@@ -124,26 +619,83 @@ def run_observation_planner(config_parameters, st_status):
         tool_error = True
     st_status.update(label=lbl, state=state)
     st.session_state.messages[-1].update({"label": lbl, "state": state})
-    return tool_error, planner_conf
+    return tool_error, planner_conf, results
 
 
-def query_obs_db(psql, params=None):
+def fetch_query(engine, query_cache, psql, params=None, on_chunk=None):
+    """
+    Run a query against the observations database and return its rows.
+
+    Reads run in read-only transactions and their rows are fetched in chunks through
+    a server-side cursor, up to QUERY_MAX_ROWS rows. Their results are reused for
+    QUERY_CACHE_TTL seconds, until the next write. It may run in a worker thread, so
+    the engine and the cache are resolved by the caller, in the script thread.
+    Args:
+        engine: Database engine (get_db_engine)
+        query_cache: Query result cache (get_query_cache)
+        psql: SQL statement, with %s placeholders
+        params: List of parameters to bind to the statement
+        on_chunk: Called with the rows fetched so far after the first chunk, then at
+                  most every STREAM_REFRESH seconds (the rows are only concatenated then)
+    Returns:
+        pandas.DataFrame: The rows of the result, with attrs["truncated"] set to True
+                          if rows were left out by QUERY_MAX_ROWS
+    """
+    is_read = is_read_statement(psql) and QUERY_CACHE_TTL > 0
+    res, version = query_cache.get(psql, params) if is_read else (None, None)
+    if res is not None:
+        return res
+    chunks = []
+    last_refresh = None
+    try:
+        for chunk in stream_query(engine, psql, params, 
+                                  chunk_size=QUERY_CHUNK_SIZE, max_rows=QUERY_MAX_ROWS):
+            chunks.append(chunk)
+            if on_chunk is not None and (last_refresh is None or time.monotonic() - last_refresh > STREAM_REFRESH):
+                on_chunk(pd.concat(chunks, ignore_index=True))
+                last_refresh = time.monotonic()
+    finally:
+        if not is_read_statement(psql):
+            query_cache.invalidate()
+    res = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+    res.attrs["truncated"] = bool(chunks) and chunks[-1].attrs.get("truncated", False)
+    if is_read:
+        query_cache.put(psql, params, res, version)
+    return res
+
+
+@tracing.traced()
+def query_obs_db(psql, params=None, started=None):
+    """
+    Run a query of the LLM against the observations database, showing the rows as
+    they arrive (see fetch_query).
+    Args:
+        psql: SQL statement, with %s placeholders
+        params: List of parameters to bind to the statement
+        started: Future of the query already submitted for this call, if any
+    Returns:
+        bool: True if the query failed
+    """
     tool_error = False
     with st.status("Querying the database...", state="running") as status:
         try:
-            res = obs_planner.database.push_to_db(
-                credentials = db_credentials, 
-                psql = psql,
-                params = params)
             st.write(psql)
             st.write(params)
+            with tracing.span("fetch_query", started_early=started is not None) as fetch:
+                if started is not None:
+                    res = started.result()
+                else:
+                    table = st.empty()
+                    res = fetch_query(get_db_engine(), get_query_cache(), psql, params, on_chunk=table.dataframe)
+                    table.empty()
+                fetch.set(rows=len(res))
             display_and_save(res)
+            if res.attrs.get("truncated"):
+                display_and_save(f"Only the first {QUERY_MAX_ROWS} rows are shown")
             lbl = "Query completed"
             state = "complete"
         except Exception as e:
             logging.exception(e)
-            st.write(psql)
-            st.write(params)
             display_and_save(e)
             lbl = "Error querying the database"
             state = "error"
@@ -152,80 +704,297 @@ def query_obs_db(psql, params=None):
         st.session_state.messages[-1].update({"label": lbl, "state": state})
 
     return tool_error
+
+
+@tracing.traced()
+def schedule_passages(telescope, ids=None):
+    """
+    Store the passages of the last planner run of the session as observations.
+
+    All the passages are written in a single transaction, and the ones already
+    scheduled for the same telescope are updated.
+    Args:
+        telescope: Name of the telescope
+        ids: NORAD IDs of the satellites to schedule. If empty, all of them.
+    Returns:
+        bool: True if the passages could not be scheduled
+    """
+    tool_error = False
+    with st.status("Scheduling passages...", state="running") as status:
+        try:
+            results = st.session_state.get("planner_results")
+            if results is None:
+                raise ValueError("There are no passages to schedule. Run the observation planner first")
+            passages = results.passages()
+            if ids:
+                passages = passages[passages["ID"].isin([str(i).zfill(5) for i in ids])]
+            records = passages_to_observations(passages, planner.read_tle_file(results.tle_file),
+                                               telescope, UserData, prep_minutes=OBS_PREP_MINUTES)
+            try:
+                n = upsert_observations(get_db_engine(), records)
+            finally:
+                get_query_cache().invalidate()
+            display_and_save(f"{n} observations scheduled on {telescope}")
+            lbl = "Passages scheduled"
+            state = "complete"
+        except Exception as e:
+            logging.exception(e)
+            display_and_save(e)
+            lbl = "Error scheduling passages"
+            state = "error"
+            tool_error = True
+        status.update(label=lbl, state=state)
+        st.session_state.messages[-1].update({"label": lbl, "state": state})
+
+    return tool_error
     
 
-def handle_tool_call(function_name, arguments, tool_call_id):
-    args_dict = json.loads(arguments)
-    st.session_state.messages.append({"role": "tool", "tool_call_id": tool_call_id})
+def start_tool_call(function_name, args_dict):
+    """
+    Start the slow part of a tool call in the background, before the call is handled.
+
+    Database reads are submitted to the tool pool and planner runs (unless cached)
+    to the planner pool, so all the calls of a turn run at the same time. Writes run
+    when their call is handled, in the order of the calls.
+
+    Returns:
+        The started work, to give to handle_tool_call (None if nothing was started).
+        If the call is not handled, it must be given to cancel_tool_call
+    """
     match function_name.lower():
-        case "run_observation_planner":
-            with st.status("Running observation planner...", state="running") as status:
-                config_args = args_dict.get("config_parameters", [])
-                config_dict = {}
-                for param in config_args:
-                    name, value = param.split(":", 1)
-                    config_dict[name.strip()] = utils.try_convert_number(value.strip())
-                tool_error, planner_conf = run_observation_planner(config_dict, st_status=status)
-
-            # Showing passages
-            if not tool_error:
-                if IS_MOCK:
-                    passages_file = os.path.join(project_root, "mock_data", "2024_11_15__Passage_Galaxy.txt")
-                    tle_file = os.path.join(project_root, "mock_data", "2024_11_15__TLE_Galaxy.txt")
-                else:
-                    date_utc_with_underscore = utils.format_date_for_filename(planner_conf['Criteria']['TimeStart'])
-                    passages_file = os.path.join(satpred_output_dir, date_utc_with_underscore + "__Passage_" + UserData['username'] + '.txt')
-                    tle_file = os.path.join(satpred_output_dir, date_utc_with_underscore + "__TLE_" + UserData['username'] + '.txt')
-
-                with st.chat_message("assistant"):
-                    if passages_file and tle_file:
-                        passages = pd.read_csv(passages_file, comment='#', 
-                                            sep='\s+', engine='python', header=None)
-                        headers = [
-                            "ID", "name", "TLE epoch", "t0 [JD]", "az0 [deg]", "el0 [deg]", 
-                            "t1 [JD]", "az1 [deg]", "el1 [deg]", "t2 [JD]", "az2 [deg]", "el2 [deg]", 
-                            "exposures", "filter", "exp_time", "delay_after", "bin"
-                        ]
-                        passages.columns = headers
-                        passages['ID'] = passages['ID'].astype(str).str.zfill(5)
-                        tle_dict = planner.read_tle_file(tle_file)
-
-                        # Create a dataframe for display with fewer columns
-                        display_df = passages[['ID', 'name', 't0 [JD]', 't1 [JD]', 't2 [JD]', \
-                                            'az0 [deg]', 'az1 [deg]', 'az2 [deg]', 'el0 [deg]', 
-                                            'el1 [deg]', 'el2 [deg]']]
-
-                        display_and_save(display_df, role="assistant")
-
-                        fig = planner.plot_passages(passages, tle_dict)
-                        display_and_save(fig, type="plot")
-            
         case "query_obs_db":
-            # Query the database
-            if "query" not in args_dict:
-                st.write("Error calling the database. Query not found")
-            else:
-                tool_error = query_obs_db(psql=args_dict.get("query"), params=args_dict.get("params"))
-        case _:
-            raise ValueError(f"Unknown function name: {function_name}")
-        
-    # Call the LLM to explain the results (No preset tools)
-    if not tool_error:
-        kwargs = preset.copy(); del kwargs['tools'] 
-        compl = askgpt(
-            user = "Answer the last user prompt",
-            system = system_prompt, 
-            context=prepare_context_messages(st.session_state.messages, 
-                                                n=None, exclude_tool=False,
-                                                exclude_types=EXCLUDE_TYPES),
-            stream=True,
-            store=STORE_CHATS,
-            metadata=dict(st_session_id=ctx.session_id),
-            **kwargs)
+            psql = args_dict.get("query")
+            if psql and is_read_statement(psql):
+                return get_tool_pool().submit(fetch_query, get_db_engine(), get_query_cache(),
+                                              psql, args_dict.get("params"))
+        case "run_observation_planner":
+            planner_conf = planner_config(parse_config_parameters(args_dict.get("config_parameters", [])))
+            planner_cache = get_planner_cache()
+            if not IS_MOCK and (planner_cache is None or planner_cache.get(planner_cache.key(planner_conf)) is None):
+                return start_planner_run(planner_conf)
+    return None
+
+
+def cancel_tool_call(started):
+    """
+    Cancel the work started for a tool call that is not handled (see start_tool_call).
+
+    Work that has not started yet is cancelled. A database read already running
+    finishes in the background, and the files of a running planner run are
+    released once it returns.
+    """
+    if isinstance(started, Future):
+        started.cancel()
+    elif started is not None:
+        results, output, _ = started
+        abandon_planner_run(results, output)
+
+
+def handle_tool_call(function_name, arguments, tool_call_id, started=None):
+    """
+    Run a tool called by the LLM and show its status.
+
+    Args:
+        function_name: Name of the tool
+        arguments: JSON arguments of the call
+        tool_call_id: ID of the call, given to the tool message
+        started: Work already started for the call (see start_tool_call)
+
+    Returns:
+        tuple: (tool_error, results), where results are the planner results of the
+               call (None for other tools)
+    """
+    message = {"role": "tool", "tool_call_id": tool_call_id}
+    st.session_state.messages.append(message)
+    results = None
+    try:
+        args_dict = json.loads(arguments)
+        match function_name.lower():
+            case "run_observation_planner":
+                with st.status("Running observation planner...", state="running") as status:
+                    config_dict = parse_config_parameters(args_dict.get("config_parameters", []))
+                    tool_error, _, results = run_observation_planner(config_dict, st_status=status,
+                                                                      started=started)
+                # Later calls of the same turn (e.g. schedule_passages) use these results,
+                # although they are only shown once all the calls are handled
+                # None if the run failed or was skipped, so no stale passes get scheduled
+                st.session_state["planner_results"] = None if tool_error else pin_planner_results(results)
+            case "query_obs_db":
+                # Query the database
+                if "query" not in args_dict:
+                    raise ValueError("Error calling the database. Query not found")
+                tool_error = query_obs_db(psql=args_dict.get("query"), params=args_dict.get("params"),
+                                          started=started)
+            case "schedule_passages":
+                tool_error = schedule_passages(telescope=args_dict.get("telescope"), ids=args_dict.get("ids"))
+            case _:
+                raise ValueError(f"Unknown function name: {function_name}")
+    except Exception as e:
+        # Bad arguments or unknown tool: the tool message still gets a finished status
+        logging.exception(e)
+        lbl = f"Error calling {function_name}"
+        with st.status(lbl, state="error"):
+            display_and_save(e)
+        message.update({"label": lbl, "state": "error"})
+        tool_error = True
+    return tool_error, results
+
+
+@tracing.traced()
+def show_planner_results(results):
+    """Show the passages found by a planner run, as a table and a map."""
+    with st.chat_message("assistant"):
+        if results.passages_file and results.tle_file:
+            with tracing.span("read_passages") as read_span:
+                passages = results.passages()
+                read_span.set(passages=len(passages))
+            with tracing.span("read_tle_file"):
+                tle_dict = planner.read_tle_file(results.tle_file)
+
+            # Create a dataframe for display with fewer columns
+            display_df = passages[DISPLAY_COLUMNS]
+
+            with tracing.span("render_table"):
+                display_and_save(display_df, role="assistant")
+
+            with tracing.span("plot_passages"):
+                fig = planner.plot_passages(passages, tle_dict)
+            with tracing.span("render_plot"):
+                display_and_save(fig, type="plot")
+
+
+def handle_tool_calls(tool_calls, explain=True):
+    """
+    Run the tool calls of an assistant turn concurrently and show their results.
+
+    The work of every call is started first (see start_tool_call), then the status
+    of each call is shown in order, so the turn takes about as long as its slowest
+    tool. The passages found by the planner are shown after all the tool messages,
+    followed by a single explanation of all the results. If the turn is interrupted
+    (e.g. the script is stopped), the work of the calls not handled yet is cancelled.
+
+    Args:
+        tool_calls: Tool calls of the assistant message
+        explain: If True, ask the LLM to explain the results afterwards
+
+    Returns:
+        bool: True if any of the calls succeeded
+    """
+    started = []
+    errors = []
+    planner_results = []
+    try:
+        for tool_call in tool_calls:
+            try:
+                started.append(start_tool_call(tool_call["function"]["name"], 
+                                               json.loads(tool_call["function"]["arguments"])))
+            except Exception as e:
+                logging.warning(f"Could not start tool call {tool_call['id']}: {e}")
+                started.append(None)
+
+        for tool_call, started_work in zip(tool_calls, started):
+            message_index = len(st.session_state.messages) # of the tool message of the call
+            try:
+                tool_error, results = handle_tool_call(tool_call["function"]["name"], 
+                                                       tool_call["function"]["arguments"],
+                                                       tool_call["id"], started=started_work)
+            except Exception as e:
+                logging.exception(e)
+                st.write(e)
+                tool_error, results = True, None
+            errors.append(tool_error)
+            if not tool_error and results is not None:
+                planner_results.append((len(errors) - 1, message_index, results))
+    finally:
+        # The call interrupted (e.g. by a stopped script) and those never handled
+        for started_work in started[len(errors):]:
+            cancel_tool_call(started_work)
+
+    for call_index, message_index, results in planner_results:
+        try:
+            show_planner_results(results)
+        except Exception as e:
+            # e.g. unreadable passages: the other results are still shown and explained
+            logging.exception(e)
+            st.write(e)
+            errors[call_index] = True
+            st.session_state.messages[message_index].update({"label": "Error showing the planner results", 
+                                                             "state": "error"})
+    succeeded = not all(errors)
+    if explain and succeeded:
+        explain_tool_results()
+    return succeeded
+
+
+@tracing.traced("explain")
+def explain_tool_results():
+    """Call the LLM to explain the results of the last tool calls."""
+    # The tools are still sent, to keep the cacheable prompt prefix, but the model can't call them
+    kwargs = preset.copy()
+    context = prepare_context_messages(st.session_state.messages, 
+                                       n=None, exclude_tool=False,
+                                       exclude_types=EXCLUDE_TYPES,
+                                       max_tokens=CONTEXT_MAX_TOKENS)
+    compl = askgpt(
+        user = "Answer the last user prompt",
+        system = system_prompt, 
+        context=demonstrations_context + context + [volatile_context()],
+        stream=True,
+        stream_options={"include_usage": True},
+        tool_choice="none",
+        store=STORE_CHATS,
+        metadata=dict(st_session_id=ctx.session_id),
+        **kwargs)
+    with tracing.span("render_response"):
         cntnt = st.write_stream(stream_response(compl))
-        st.session_state.messages.append({"role": "assistant", "content": cntnt})
+    record_usage("explanation")
+    st.session_state.messages.append({"role": "assistant", "content": cntnt})
+
+
+def handle_local_planner_call(prompt, config_parameters, context):
+    """
+    Run the planner for a request understood by the local extractor (see intents).
+
+    The planner starts right away, while the LLM narrative is requested concurrently
+    and shown above the planner output once it is done. The tool call is recorded
+    as if the LLM had made it, so later turns see the same conversation.
+
+    Args:
+        prompt: The user prompt
+        config_parameters: Planner parameters extracted from the prompt
+        context: Prepared context messages of the conversation
+    """
+    kwargs = preset.copy()
+    note = {"role": "system", 
+            "content": "The observation planner is already running for the next user prompt, with the "
+                       f"configuration parameters {json.dumps(config_parameters)}. Briefly explain what "
+                       "you are doing; the results will be given to you afterwards."}
+    compl = askgpt(user = prompt, system = system_prompt, 
+                   context=demonstrations_context + context + [volatile_context(), note], 
+                   stream=True, stream_options={"include_usage": True},
+                   tool_choice="none", 
+                   store=STORE_CHATS, 
+                   metadata=dict(st_session_id=ctx.session_id), **kwargs)
+    tool_call = {"id": f"local_{uuid.uuid4().hex[:24]}", "type": "function",
+                 "function": {"name": "run_observation_planner",
+                              "arguments": json.dumps({"config_parameters": config_parameters})}}
+    assistant_message = {"role": "assistant", "content": "", "tool_calls": [tool_call]}
+    with st.chat_message("assistant"):
+        narrative = st.empty()
+    st.session_state.messages.append(assistant_message)
+
+    succeeded = handle_tool_calls([tool_call], explain=False)
+    try:
+        with narrative.container(), tracing.span("render_response"):
+            assistant_message["content"] = st.write_stream(stream_response(compl))
+        record_usage("narrative")
+    except Exception as e:
+        logging.exception(e)
+    if succeeded:
+        explain_tool_results()
 
 
+@tracing.traced()
 def handle_user_prompt(prompt, context_window=4):   
     """
     Handles the prompt input by the user, interacts with the LLM to generate a response,
@@ -238,34 +1007,110 @@ def handle_user_prompt(prompt, context_window=4):
         Exception: If there is an error during the tool execution.
     """
     kwargs = preset.copy()
-    context = prepare_context_messages(msgs=demonstrations + st.session_state.messages, 
-                                       n=context_window, exclude_tool=False, 
-                                       exclude_types=EXCLUDE_TYPES)
-    compl = askgpt(user = prompt, system = system_prompt, context=context, 
-                   stream=True, tool_choice="auto", parallel_tool_calls=False, 
+    # The last message is the prompt, which askgpt appends after the volatile context
+    with tracing.span("prepare_context"):
+        context = prepare_context_messages(msgs=st.session_state.messages[:-1], 
+                                           n=context_window, exclude_tool=False, 
+                                           exclude_types=EXCLUDE_TYPES,
+                                           max_tokens=CONTEXT_MAX_TOKENS)
+    # Routine planner requests don't wait for the LLM to pick the tool and its arguments
+    config_parameters = intents.extract_planner_call(prompt) if LOCAL_INTENTS else None
+    if config_parameters is not None:
+        logging.info(f"Local planner call ({intents.stats.hit_rate:.0%} hit rate): {config_parameters}")
+        handle_local_planner_call(prompt, config_parameters, context)
+        return
+
+    compl = askgpt(user = prompt, system = system_prompt, 
+                   context=demonstrations_context + context + [volatile_context()], 
+                   stream=True, stream_options={"include_usage": True},
+                   tool_choice="auto", 
                    store=STORE_CHATS, 
                    metadata=dict(st_session_id=ctx.session_id), **kwargs)
     # Stream the response
-    with st.chat_message("assistant"):       
+    with st.chat_message("assistant"), tracing.span("render_response"):
         assistant_response = st.write_stream(stream_response(compl))
         st.session_state.messages.append({"role": "assistant", "content": assistant_response})
+    record_usage("prompt")
 
-    if (st.session_state["last_stream"][-1].finish_reason == 'tool_calls'):
+    if (st.session_state["last_stream"]["finish_reason"] == 'tool_calls'):
         tool_calls = handle_stream_response_tool_calls()
         st.session_state.messages[-1].update({"tool_calls": tool_calls})
+        if tool_calls:
+            handle_tool_calls(tool_calls)
+        else:
+            display_and_save("Error processing tool call", role="assistant")
+    else:
+        logging.info("No tool found to call")
+
+
+def record_latency(trace):
+    """Keep the timing breakdown of a turn for the latency panel of development mode."""
+    durations = tracing.totals(trace)
+    llm_calls = sorted((s for s in trace.spans if s.name == "askgpt"), key=lambda s: s.start)
+    turns = st.session_state.setdefault("latency", [])
+    turns.append({
+        "summary": {
+            "turn": len([m for m in st.session_state.messages if m["role"] == "user"]),
+            "total_ms": trace.duration_ms,
+            "first_token_ms": llm_calls[0].attributes.get("first_chunk_ms") if llm_calls else None,
+            "llm_calls": len(llm_calls),
+            "llm_ms": durations.get("askgpt", 0.0),
+            "planner_ms": durations.get("run_observation_planner", 0.0),
+            "query_ms": durations.get("query_obs_db", 0.0),
+            "parse_ms": durations.get("read_passages", 0.0) + durations.get("read_tle_file", 0.0),
+            "plot_ms": durations.get("plot_passages", 0.0),
+            "render_ms": sum(durations.get(name, 0.0) for name in 
+                             ("render_history", "render_response", "render_table", "render_plot")),
+        },
+        "spans": tracing.breakdown(trace),
+    })
+    del turns[:-LATENCY_TURNS]
+
+
+def init_session():
+    """
+    Set up the conversation and the artifact store of a new session.
+
+    The conversation given by the "session" query parameter is restored, without
+    its artifacts, which are loaded from the database when displayed. Otherwise a
+    new conversation is started. Its ID is set in the URL, so reloading the page
+    or reconnecting restores it.
+    """
+    if "conversation_id" in st.session_state:
+        return
+    store = get_conversation_store()
+    conversation_id = st.query_params.get("session")
+    restored = None
+    if store is not None and conversation_id:
         try:
-            tool_call = tool_calls[0] # only first one
-            if tool_call:
-                handle_tool_call(tool_call["function"]["name"], 
-                                 tool_call["function"]["arguments"],
-                                 tool_call["id"])
-            else:
-                display_and_save("Error processing tool call", role="assistant")        
+            restored = store.load(conversation_id)
         except Exception as e:
-            logging.exception(e)
-            st.write(e)
+            logging.warning(f"Could not restore the conversation {conversation_id}: {e}")
+    if restored:
+        st.session_state.messages = restored
     else:
-        logging.info("No tool found to call")
+        conversation_id = uuid.uuid4().hex
+    st.session_state.conversation_id = conversation_id
+    st.session_state.saved_messages = len(st.session_state.messages)
+
+    # Tables and figures of the session are kept on disk, with the most recent ones in memory
+    st.session_state.artifact_store = ArtifactStore(
+        os.path.join(ARTIFACT_DIR, ctx.session_id), max_bytes=SESSION_MEMORY_MB * 1024**2,
+        on_put=(lambda ref, path: store.save_artifact(conversation_id, ref, path)) if store else None,
+        fallback=store.load_artifact if store else None)
+    if store is not None:
+        st.query_params["session"] = conversation_id
+
+
+def save_conversation():
+    """Queue the messages added since the last save (and the last one saved, which may have changed)."""
+    store = get_conversation_store()
+    messages = st.session_state.messages
+    if store is None or not messages:
+        return
+    start = max(st.session_state.saved_messages - 1, 0)
+    store.save_messages(st.session_state.conversation_id, messages, start=start)
+    st.session_state.saved_messages = len(messages)
 
 
 # If None, it takes the session state key from the chat input
@@ -278,56 +1123,28 @@ def append_user_prompt(prompt: str = None):
 # Streamlit app layout
 ######################################################################
 
+tracing.configure(TRACE_FILE)
+
+# The resources below are loaded on the first run of the process and reused by
+# every rerun and session
+init_weave()
+load_tokenizer()
+
 # Create database, if needed and if we are in development
 if IS_DEV:
-    DATABASE_URL = f'postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
-    engine = create_engine(DATABASE_URL)
-    Base.metadata.create_all(bind=engine, checkfirst=True)
+    init_db()
 
-# Load default YAML configuration
-default_conf_path = os.path.join(obs_planner_root, "configs", "config_default.yaml")
-with open(default_conf_path, "r") as file:
-    default_conf = yaml.safe_load(file)
+init_session()
 
-    UserData = {
-            "organization" : default_conf['User']['UserUniqueId'], \
-            "username": "llm", \
-            "user_unique_id": default_conf['User']['UserUniqueId'], \
-            "user_project": default_conf['User']['UserProject']
-        }
-    default_conf['User']['Username'] = "llm"
+# Every rerun marks the session as active, before the inactive ones are cleaned up
+st.session_state.artifact_store.touch()
+cleanup_artifacts()
+
+default_conf, UserData = load_default_conf()
+preset, system_prompt, demonstrations_context, starters = load_prompts(UserData["username"])
 
-    db_credentials = {
-        "ENDPOINT_reader": DB_HOST,
-        "PORT" : 		DB_PORT,
-        "USER" : 		DB_USER,
-        "PASSWORD" : 	DB_PASSWORD,
-        "DATABASE" :  "targets"
-    }
-
-# Load preset (default call configuration taken from the playground)
-# https://platform.openai.com/playground/p/M4iHV1L0uG6MK5SwNMzfVi9E?mode=chat
-with open("src/prompts/preset.json", "r") as file:
-    preset = json.load(file)
-    preset.pop('system', None) # the system prompt is taken separately
-    preset.pop('messages', []) # the messages are taken separately
-
-# Read system prompt (instructions) from file
-with open("src/prompts/instructions.md", "r") as file:
-    system_prompt = file.read()
-    system_prompt = system_prompt.replace("{{CURRENT_DATE}}", current_date)
-    system_prompt = system_prompt.replace("{{CURRENT_TIME}}", current_time) 
-    system_prompt = system_prompt.replace("{{USERNAME}}", UserData["username"])
-
-# Read demonstrations (few shot prompts) and add them as messages
-with open("src/prompts/demonstrations.json", "r") as file:
-    demonstrations = json.load(file)
-
-# Load three random starters from the starters file
-with open("src/prompts/starters.md", "r") as file:
-    starters = file.readlines()
-    starters = [starter.strip() for starter in starters if not starter.startswith('#') and starter.strip()]
-    starters = random.sample(starters, 3)
+# Three random starters
+starters = random.sample(starters, 3)
 
 
 st.set_page_config(layout="wide")
@@ -340,14 +1157,41 @@ if len(st.session_state.messages) == 0:
         with col:
             st.button(starter, on_click=append_user_prompt, args=(starter,))
 else:
-    display_messages()
     messages = st.session_state.messages
-    if messages[-1]["role"] == "user":
-        if len(messages) == 1:
-            cwin = len(demonstrations)
-        else:
-            cwin = min(len(demonstrations) + len(messages), CONTEXT_WINDOW)
-        handle_user_prompt(messages[-1]["content"], context_window=cwin)
+    is_turn = messages[-1]["role"] == "user"
+    # Each rerun is a trace; those answering a prompt are kept for the latency panel
+    with tracing.span("rerun", session_id=ctx.session_id, turn=is_turn) as trace:
+        with tracing.span("render_history", messages=len(messages)):
+            display_messages(recent_turns=RENDER_RECENT_TURNS)
+        if is_turn:
+            try:
+                handle_user_prompt(messages[-1]["content"], context_window=CONTEXT_WINDOW)
+            finally:
+                # Also when the turn is interrupted (e.g. by a new prompt)
+                save_conversation()
+    if is_turn and IS_DEV:
+        record_latency(trace)
+
+if IS_DEV and st.session_state.get("llm_usage"):
+    with st.sidebar.expander("LLM token usage"):
+        st.dataframe(pd.DataFrame(st.session_state["llm_usage"]))
+
+if IS_DEV:
+    with st.sidebar.expander("Session memory"):
+        st.json(st.session_state.artifact_store.metrics())
+    if get_conversation_store() is not None:
+        with st.sidebar.expander("Conversation store"):
+            st.caption(f"Conversation {st.session_state.conversation_id}")
+            st.json(get_conversation_store().metrics())
+    if st.session_state.get("latency"):
+        with st.sidebar.expander("Latency"):
+            st.dataframe(pd.DataFrame([turn["summary"] for turn in st.session_state["latency"]]).round(1),
+                         hide_index=True)
+            st.caption("Spans of the last turn")
+            st.dataframe(pd.DataFrame(st.session_state["latency"][-1]["spans"]), hide_index=True)
+    with st.sidebar.expander("Local intent extraction"):
+        st.json({"hits": intents.stats.hits, "misses": intents.stats.misses, 
+                 "hit_rate": intents.stats.hit_rate})
 
 # Chat input for user messages
 st.chat_input("Type your message here...", key="user_prompt", 
@@ -0,0 +1,206 @@
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import pandas as pd
+
+# File formats of the artifacts: data only, never pickles, as they may come from the database
+ARTIFACT_FORMATS = ("parquet", "json")
+
+
+class ArtifactRef:
+    """
+    Reference to an artifact of an ArtifactStore, kept in the messages in its place.
+
+    Besides the ID, it holds what is needed without loading the artifact: a short
+    summary for collapsed messages and the serialized text sent to the LLM.
+    """
+
+    __slots__ = ("id", "kind", "summary", "text")
+
+    def __init__(self, id, kind, summary="", text=""):
+        self.id = id
+        self.kind = kind
+        self.summary = summary
+        self.text = text
+
+    def __repr__(self):
+        return f"ArtifactRef({self.id!r}, {self.kind!r})"
+
+
+class ArtifactStore:
+    """
+    Store of the large artifacts (tables and figures) of a chat session.
+
+    Artifacts are written to disk when stored: tables as Parquet (with their
+    mixed-type columns as text if they can't be converted) and figures as JSON. The most recently used ones are also
+    kept in memory, up to `max_bytes`, and reloaded from disk when needed again.
+
+    Artifacts missing from disk (e.g. those of a restored conversation) are fetched
+    with `fallback` the first time they are needed, and written to disk.
+
+    Args:
+        directory: Directory of the session, removed by `clear`
+        max_bytes: Memory cap of the artifacts kept in memory
+        on_put: Function called with the reference and the file of each stored artifact
+        fallback: Function returning the (format, bytes) of an artifact ID, format
+                  being the file extension (one of ARTIFACT_FORMATS), or None if
+                  it is unknown
+    """
+
+    def __init__(self, directory, max_bytes=64 * 1024**2, on_put=None, fallback=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.on_put = on_put
+        self.fallback = fallback
+        self._memory = OrderedDict() # id -> (artifact, nbytes)
+        self._count = 0
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def cleanup(root, max_age):
+        """Remove the session directories under `root` not modified in `max_age` seconds."""
+        if not os.path.isdir(root):
+            return
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            try:
+                if time.time() - os.path.getmtime(path) > max_age:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+
+    def touch(self):
+        """Mark the session as active, so that `cleanup` keeps its artifacts."""
+        try:
+            os.utime(self.directory)
+        except FileNotFoundError:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, artifact_id, extension):
+        return os.path.join(self.directory, f"{artifact_id}.{extension}")
+
+    def _write(self, artifact_id, artifact, kind):
+        if kind == "figure":
+            path = self._path(artifact_id, "json")
+            with open(path, "w") as f:
+                f.write(artifact.to_json())
+            return path
+        path = self._path(artifact_id, "parquet")
+        try:
+            artifact.to_parquet(path)
+        except Exception as e:
+            # e.g. mixed types in an object column, or non-string column names
+            logging.debug(f"Could not store the table as Parquet, storing its object columns as text: {e}")
+            table = artifact.astype({name: str for name, dtype in artifact.dtypes.items() if dtype == object})
+            table.columns = [str(name) for name in table.columns]
+            table.to_parquet(path)
+        return path
+
+    def _fetch(self, artifact_id):
+        """Write an artifact missing from disk with the fallback, if it has it."""
+        fetched = self.fallback(artifact_id) if self.fallback is not None else None
+        if fetched is None:
+            return
+        extension, data = fetched
+        if extension not in ARTIFACT_FORMATS:
+            raise ValueError(f"Unexpected format of the artifact {artifact_id}: {extension}")
+        with open(self._path(artifact_id, extension), "wb") as f:
+            f.write(data)
+        with self._lock:
+            self._disk_bytes += len(data)
+
+    def _read(self, artifact_id, kind):
+        path = self._path(artifact_id, "json" if kind == "figure" else "parquet")
+        if not os.path.exists(path):
+            self._fetch(artifact_id)
+            if not os.path.exists(path):
+                raise KeyError(f"The artifact {artifact_id} is no longer available")
+        if kind == "figure":
+            import plotly.io as pio
+            with open(path, "r") as f:
+                return pio.from_json(f.read())
+        return pd.read_parquet(path)
+
+    def _nbytes(self, artifact_id, artifact, kind):
+        if kind == "table":
+            return int(artifact.memory_usage(deep=True).sum())
+        # Figures hold their data as arrays; their JSON size is a close estimate
+        return os.path.getsize(self._path(artifact_id, "json"))
+
+    def _remember(self, artifact_id, artifact, nbytes):
+        self._memory[artifact_id] = (artifact, nbytes)
+        self._memory_bytes += nbytes
+        while self._memory_bytes > self.max_bytes and len(self._memory) > 1:
+            _, (_, evicted_bytes) = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted_bytes
+
+    def put(self, artifact, kind, summary="", text=""):
+        """
+        Store an artifact.
+
+        Args:
+            artifact: DataFrame (kind "table") or plotly Figure (kind "figure")
+            kind: "table" or "figure"
+            summary: One-line description of the artifact
+            text: Serialized text of the artifact for the LLM
+
+        Returns:
+            ArtifactRef: Reference to keep in the messages
+        """
+        artifact_id = uuid.uuid4().hex
+        path = self._write(artifact_id, artifact, kind)
+        with self._lock:
+            self._disk_bytes += os.path.getsize(path)
+            self._remember(artifact_id, artifact, self._nbytes(artifact_id, artifact, kind))
+            self._count += 1
+        ref = ArtifactRef(artifact_id, kind, summary, text)
+        if self.on_put is not None:
+            self.on_put(ref, path)
+        return ref
+
+    def get(self, ref):
+        """
+        Return the artifact of a reference, from memory, from disk or from the fallback.
+
+        Raises:
+            KeyError: If the artifact is nowhere to be found (e.g. deleted)
+        """
+        with self._lock:
+            cached = self._memory.get(ref.id)
+            if cached is not None:
+                self._memory.move_to_end(ref.id)
+                return cached[0]
+        artifact = self._read(ref.id, ref.kind)
+        with self._lock:
+            if ref.id not in self._memory:
+                self._remember(ref.id, artifact, self._nbytes(ref.id, artifact, ref.kind))
+        return artifact
+
+    def metrics(self):
+        """Get the memory and disk usage of the session's artifacts."""
+        with self._lock:
+            return {
+                "artifacts": self._count,
+                "in_memory": len(self._memory),
+                "memory_mb": self._memory_bytes / 1024**2,
+                "memory_cap_mb": self.max_bytes / 1024**2,
+                "disk_mb": self._disk_bytes / 1024**2,
+            }
+
+    def clear(self):
+        """Drop every artifact of the session, in memory and on disk."""
+        with self._lock:
+            self._memory.clear()
+            self._count = 0
+            self._memory_bytes = 0
+            self._disk_bytes = 0
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory, exist_ok=True)
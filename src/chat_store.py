@@ -0,0 +1,305 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import (CheckConstraint, Column, DateTime, ForeignKey, Index, Integer, LargeBinary, String, Text,
+                        delete, func, select, text)
+from sqlalchemy.dialects.postgresql import JSONB, insert
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.schema import CreateSchema
+
+from artifact_store import ARTIFACT_FORMATS, ArtifactRef
+
+# The conversations are kept apart from the observations (db.Base): in their own
+# schema, written by a role that the connection of the query_obs_db tool can't use
+SCHEMA = "chat"
+ChatBase = declarative_base()
+
+TITLE_LENGTH = 200
+PURGE_INTERVAL = 3600 # seconds between two deletions of the expired conversations
+
+
+class ChatSession(ChatBase):
+    __tablename__ = 'chat_sessions'
+    __table_args__ = {'schema': SCHEMA}
+
+    id = Column(String, primary_key=True)
+    title = Column(String) # first user prompt
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class ChatMessage(ChatBase):
+    __tablename__ = 'chat_messages'
+    __table_args__ = {'schema': SCHEMA}
+
+    session_id = Column(String, ForeignKey(f'{SCHEMA}.chat_sessions.id', ondelete='CASCADE'), primary_key=True)
+    position = Column(Integer, primary_key=True)
+    role = Column(String, nullable=False)
+    tool_call_id = Column(String) # tool messages; the calls are in the "tool_calls" of the assistant message
+    data = Column(JSONB, nullable=False) # the message, with references in place of its artifacts
+
+
+class ChatArtifact(ChatBase):
+    __tablename__ = 'chat_artifacts'
+    __table_args__ = (
+        Index('ix_chat_artifacts_session_id', 'session_id'),
+        # Only data formats: artifacts are never unpickled from the database
+        CheckConstraint(f"format IN ({', '.join(repr(f) for f in ARTIFACT_FORMATS)})",
+                        name='ck_chat_artifacts_format'),
+        {'schema': SCHEMA},
+    )
+
+    id = Column(String, primary_key=True)
+    session_id = Column(String, ForeignKey(f'{SCHEMA}.chat_sessions.id', ondelete='CASCADE'), nullable=False)
+    kind = Column(String, nullable=False) # table or figure
+    format = Column(String, nullable=False) # file extension: parquet or json
+    summary = Column(Text)
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+
+
+def encode_item(item):
+    """Get the JSON form of a message item: artifacts are replaced by their reference."""
+    if isinstance(item, ArtifactRef):
+        return {"artifact": item.id, "kind": item.kind, "summary": item.summary, "text": item.text}
+    return item if isinstance(item, str) else str(item)
+
+
+def decode_item(item):
+    """Get a message item from its JSON form (see encode_item)."""
+    if isinstance(item, dict) and "artifact" in item:
+        return ArtifactRef(item["artifact"], item["kind"], item.get("summary", ""), item.get("text", ""))
+    return item
+
+
+def encode_message(message):
+    """
+    Get the JSON form of a message of the session state.
+
+    The keys starting with "_" (caches, see lm_hackers.serialize_message_items) are left out.
+    """
+    data = {key: value for key, value in message.items() if not key.startswith("_")}
+    if "content" in data:
+        content = data["content"]
+        data["content"] = [encode_item(c) for c in content] if isinstance(content, list) else encode_item(content)
+    return json.loads(json.dumps(data, default=str))
+
+
+def decode_message(data):
+    """Get a message of the session state from its JSON form (see encode_message)."""
+    message = dict(data)
+    if "content" in message:
+        content = message["content"]
+        message["content"] = [decode_item(c) for c in content] if isinstance(content, list) else decode_item(content)
+    return message
+
+
+class ConversationStore:
+    """
+    Store of the conversations and their artifacts in the database.
+
+    Writes are queued and inserted by a background thread, in batches of up to
+    `batch_size` records sent at most `flush_interval` seconds after the first of
+    them was queued, so saving never waits on the database. Messages are upserted
+    by position, so a message can be saved again once it changed. Artifact files
+    are read by the writer thread as well.
+
+    If the database can't be reached, the batch is dropped and logged: the chat
+    keeps working, only the conversation can't be restored. The conversations not
+    updated for `retention_days` are deleted (with their messages and artifacts)
+    by the writer thread, every PURGE_INTERVAL.
+
+    Args:
+        engine: SQLAlchemy engine of the role owning the SCHEMA schema
+        retention_days: Days a conversation is kept after its last update
+        batch_size: Records written per transaction
+        flush_interval: Seconds a queued record waits for others before being written
+        max_queue: Records queued at most; more are dropped
+    """
+
+    def __init__(self, engine, retention_days=30, batch_size=200, flush_interval=1.0, max_queue=10000):
+        self.engine = engine
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.purged = 0
+        self._next_purge = time.monotonic()
+        self.written = 0
+        self.dropped = 0
+        self.failed_batches = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="conversation-writer", daemon=True)
+
+    def start(self):
+        """Start the writer thread."""
+        self._thread.start()
+
+    def create_tables(self):
+        """Create the schema and the tables of the conversations, if needed."""
+        with self.engine.begin() as conn:
+            conn.execute(CreateSchema(SCHEMA, if_not_exists=True))
+        ChatBase.metadata.create_all(bind=self.engine, checkfirst=True)
+
+    def is_isolated_from(self, role):
+        """
+        Check that a database role can't read the conversations.
+
+        Returns:
+            bool: False if the role is a superuser or has usage of the schema
+        """
+        with self.engine.connect() as conn:
+            exposed = conn.execute(text(
+                "SELECT rolsuper OR has_schema_privilege(rolname, :schema, 'USAGE') "
+                "FROM pg_roles WHERE rolname = :role"), {"schema": SCHEMA, "role": role}).scalar()
+        return not exposed
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            logging.warning("Conversation writer queue full, dropping a record")
+
+    def _put_session(self, conversation_id, title=None):
+        now = datetime.now(timezone.utc)
+        self._put(("session", conversation_id,
+                   {"id": conversation_id, "title": title, "created_at": now, "updated_at": now}))
+
+    def save_messages(self, conversation_id, messages, start=0):
+        """
+        Queue the messages of a conversation from position `start` on.
+
+        Args:
+            conversation_id: ID of the conversation
+            messages: All the messages of the conversation (session state)
+            start: Position of the first message to save
+        """
+        title = next((m["content"] for m in messages if m["role"] == "user" and isinstance(m.get("content"), str)), None)
+        self._put_session(conversation_id, title[:TITLE_LENGTH] if title else None)
+        for position in range(start, len(messages)):
+            message = messages[position]
+            self._put(("message", (conversation_id, position),
+                       {"session_id": conversation_id, "position": position, "role": message["role"],
+                        "tool_call_id": message.get("tool_call_id"), "data": encode_message(message)}))
+
+    def save_artifact(self, conversation_id, ref, path):
+        """Queue an artifact of a conversation, stored in the file `path` (see ArtifactStore.put)."""
+        if os.path.splitext(path)[1][1:] not in ARTIFACT_FORMATS:
+            logging.warning(f"Not saving the artifact {ref.id}, stored as {path}")
+            return
+        self._put_session(conversation_id)
+        self._put(("artifact", ref.id,
+                   {"id": ref.id, "session_id": conversation_id, "kind": ref.kind, "summary": ref.summary,
+                    "path": path, "created_at": datetime.now(timezone.utc)}))
+
+    def flush(self, timeout=10.0):
+        """Wait until the records queued so far are written. Returns False on timeout."""
+        done = threading.Event()
+        self._put(done)
+        return done.wait(timeout)
+
+    def load(self, conversation_id):
+        """
+        Load the messages of a conversation, after writing the pending records.
+
+        Artifacts are not loaded: their references are, to be fetched with
+        `load_artifact` when displayed.
+
+        Returns:
+            List[dict]: The messages, or None if the conversation is unknown
+        """
+        self.flush()
+        with self.engine.connect() as conn:
+            if conn.execute(select(ChatSession.id).where(ChatSession.id == conversation_id)).first() is None:
+                return None
+            rows = conn.execute(select(ChatMessage.data).where(ChatMessage.session_id == conversation_id)
+                                .order_by(ChatMessage.position)).scalars().all()
+        return [decode_message(data) for data in rows]
+
+    def load_artifact(self, artifact_id):
+        """Get the (format, bytes) of an artifact, or None if it is unknown (see ArtifactStore)."""
+        with self.engine.connect() as conn:
+            row = conn.execute(select(ChatArtifact.format, ChatArtifact.data)
+                               .where(ChatArtifact.id == artifact_id,
+                                      ChatArtifact.format.in_(ARTIFACT_FORMATS))).first()
+        return (row.format, bytes(row.data)) if row is not None else None
+
+    def metrics(self):
+        """Get the counters of the writer."""
+        return {"queued": self._queue.qsize(), "written": self.written, "dropped": self.dropped,
+                "failed_batches": self.failed_batches, "purged": self.purged}
+
+    def _purge(self):
+        """Delete the conversations not updated for `retention_days`."""
+        self._next_purge = time.monotonic() + PURGE_INTERVAL
+        expired = datetime.now(timezone.utc) - timedelta(days=self.retention_days)
+        try:
+            with self.engine.begin() as conn:
+                # Their messages and artifacts are deleted by the foreign keys
+                self.purged += conn.execute(delete(ChatSession).where(ChatSession.updated_at < expired)).rowcount
+        except Exception as e:
+            logging.warning(f"Could not delete the expired conversations: {e}")
+
+    def _run(self):
+        pending, waiters, deadline = [], [], None
+        while True:
+            if time.monotonic() >= self._next_purge:
+                self._purge()
+            timeout = max(0.0, deadline - time.monotonic()) if pending else PURGE_INTERVAL
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if isinstance(item, threading.Event):
+                waiters.append(item)
+            elif item is not None:
+                if not pending:
+                    deadline = time.monotonic() + self.flush_interval
+                pending.append(item)
+            if pending and (item is None or waiters or len(pending) >= self.batch_size):
+                self._write(pending)
+                pending = []
+            for waiter in waiters:
+                waiter.set()
+            waiters = []
+
+    def _write(self, items):
+        # The last record of each key wins (a statement can't upsert the same row twice)
+        rows = {"session": {}, "artifact": {}, "message": {}}
+        for table, key, record in items:
+            if table == "session" and key in rows["session"]:
+                record = {**record, "title": record["title"] or rows["session"][key]["title"]}
+            rows[table][key] = record
+        artifacts = []
+        for record in rows["artifact"].values():
+            path = record.pop("path")
+            try:
+                with open(path, "rb") as f:
+                    artifacts.append({**record, "format": os.path.splitext(path)[1][1:], "data": f.read()})
+            except OSError as e:
+                logging.warning(f"Could not save the artifact {record['id']}: {e}")
+
+        sessions = insert(ChatSession)
+        sessions = sessions.on_conflict_do_update(index_elements=["id"], set_={
+            "updated_at": sessions.excluded.updated_at,
+            "title": func.coalesce(ChatSession.title, sessions.excluded.title)})
+        messages = insert(ChatMessage)
+        messages = messages.on_conflict_do_update(index_elements=["session_id", "position"], set_={
+            name: messages.excluded[name] for name in ("role", "tool_call_id", "data")})
+        try:
+            with self.engine.begin() as conn:
+                if rows["session"]:
+                    conn.execute(sessions, list(rows["session"].values()))
+                if artifacts:
+                    conn.execute(insert(ChatArtifact).on_conflict_do_nothing(index_elements=["id"]), artifacts)
+                if rows["message"]:
+                    conn.execute(messages, list(rows["message"].values()))
+            self.written += len(items)
+        except Exception as e:
+            self.failed_batches += 1
+            logging.warning(f"Could not save {len(items)} conversation records: {e}")
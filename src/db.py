@@ -1,16 +1,49 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean
+import os
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import pandas as pd
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Index, create_engine, inspect
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
+# First keywords of the statements that only read data
+READ_STATEMENTS = ("select", "with", "show", "explain", "table", "values")
+# Reads whose rows can be fetched through a server-side cursor (not SHOW or EXPLAIN)
+STREAMED_STATEMENTS = ("select", "with", "table", "values")
+
+TIME_COLUMNS = ("prep_time", "start_time", "end_time")
+
+# A satellite is observed once per user, telescope and start time. Satellites are
+# told apart by NORAD ID, as names such as "DEB" are shared by many objects
+SCHEDULE_KEY = ("username", "telescope", "norad_id", "start_time")
+# Unique index of the former key, on the designation instead of the NORAD ID
+LEGACY_SCHEDULE_INDEX = "uq_observations_schedule"
+
+# Engines whose observations table has the unique index of SCHEDULE_KEY (see schedule_index_ready)
+_migrated_engines = weakref.WeakSet()
+
 class Observation(Base):
     __tablename__ = 'observations'
 
+    __table_args__ = (
+        # Typical queries filter by user or telescope and a time range
+        Index('ix_observations_username_start_time', 'username', 'start_time'),
+        Index('ix_observations_telescope_start_time', 'telescope', 'start_time'),
+        Index('uq_observations_schedule_norad', *SCHEDULE_KEY, unique=True),
+    )
+
     obsid = Column(Integer, primary_key=True)
     designation = Column(String, nullable=False)
-    prep_time = Column(String, nullable=False)
-    start_time = Column(String, nullable=False)
-    end_time = Column(String, nullable=False)
+    norad_id = Column(String)
+    prep_time = Column(DateTime(timezone=True), nullable=False)
+    start_time = Column(DateTime(timezone=True), nullable=False)
+    end_time = Column(DateTime(timezone=True), nullable=False)
     pa = Column(Float)
     too = Column(Boolean, nullable=False)
     telescope = Column(String, nullable=False)
@@ -40,3 +73,365 @@ class Observation(Base):
     user_project = Column(String)  
     exposures = Column(Integer)  
     priority = Column(Integer)
+
+
+def create_db_engine(url, pool_size=5, max_overflow=5, pool_timeout=30, statement_timeout=30):
+    """
+    Create the SQLAlchemy engine shared by all sessions.
+
+    Sessions use UTC, so times given as strings without time zone are taken as UTC.
+
+    Args:
+        url: Database URL
+        pool_size: Connections kept open in the pool
+        max_overflow: Extra connections allowed when the pool is exhausted
+        pool_timeout: Seconds to wait for a free connection before failing
+        statement_timeout: Seconds after which PostgreSQL cancels a statement
+
+    Returns:
+        sqlalchemy.Engine: The engine
+    """
+    return create_engine(url, pool_size=pool_size, max_overflow=max_overflow,
+                         pool_timeout=pool_timeout, pool_pre_ping=True,
+                         connect_args={"options": f"-c statement_timeout={int(statement_timeout * 1000)} -c timezone=UTC"})
+
+
+def migrate_observations(engine):
+    """
+    Migrate an existing observations table to the current model.
+
+    Time columns stored as strings (UTC, 'YYYY-MM-DD HH:MM:SS') are converted to
+    TIMESTAMP WITH TIME ZONE in a single table rewrite, the NORAD ID column is added
+    (filled from the TLE of the observations already scheduled), and the missing
+    indexes are created. Tables already up to date are left untouched. This is an
+    explicit deployment step (`python src/db.py`), not run by the app.
+
+    Args:
+        engine: SQLAlchemy engine
+
+    Raises:
+        ValueError: If some observations are scheduled more than once (same user,
+            telescope, NORAD ID and start time), as the unique index of SCHEDULE_KEY
+            can't be created. Nothing is changed.
+    """
+    table = Observation.__table__
+    inspector = inspect(engine)
+    if not inspector.has_table(table.name):
+        return
+    column_types = {c["name"]: c["type"] for c in inspector.get_columns(table.name)}
+    to_convert = [name for name in TIME_COLUMNS if not isinstance(column_types[name], DateTime)]
+    with engine.begin() as conn:
+        conn.exec_driver_sql("SET LOCAL timezone = 'UTC'")
+        if "norad_id" not in column_types:
+            # The NORAD ID is the catalog number of line 1 of the TLE
+            conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN norad_id VARCHAR")
+            conn.exec_driver_sql(f"UPDATE {table.name} SET norad_id = lpad(trim(substr(tle_line1, 3, 5)), 5, '0') "
+                                 "WHERE tle_line1 IS NOT NULL")
+        if not has_schedule_index(engine):
+            # Start times are compared once converted, as the index will see them. Rows
+            # with a NULL key column (e.g. targets without TLE) never conflict.
+            key = ", ".join(f"{name}::timestamptz" if name in TIME_COLUMNS else name for name in SCHEDULE_KEY)
+            not_null = " AND ".join(f"{name} IS NOT NULL" for name in SCHEDULE_KEY)
+            duplicates = conn.exec_driver_sql(
+                f"SELECT count(*) FROM (SELECT 1 FROM {table.name} WHERE {not_null} "
+                f"GROUP BY {key} HAVING count(*) > 1) d").scalar()
+            if duplicates:
+                raise ValueError(f"Observations scheduled more than once: {duplicates} values of "
+                                 f"({', '.join(SCHEDULE_KEY)}) have several rows. "
+                                 "Remove the duplicates and migrate again")
+        if to_convert:
+            conn.exec_driver_sql(f"ALTER TABLE {table.name} " + ", ".join(
+                f"ALTER COLUMN {name} TYPE TIMESTAMP WITH TIME ZONE USING {name}::timestamptz"
+                for name in to_convert))
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS {LEGACY_SCHEDULE_INDEX}")
+    _migrated_engines.add(engine)
+
+
+def has_schedule_index(engine):
+    """Check whether the observations table has the unique index on SCHEDULE_KEY that upserts rely on."""
+    indexes = inspect(engine).get_indexes(Observation.__tablename__)
+    return any(index["unique"] and list(index["column_names"]) == list(SCHEDULE_KEY) for index in indexes)
+
+
+def schedule_index_ready(engine):
+    """
+    Check once per engine whether the observations table is migrated (see has_schedule_index).
+
+    Only a positive result is remembered, as the index is never dropped: until the
+    table is migrated, every call checks again.
+    """
+    if engine not in _migrated_engines and has_schedule_index(engine):
+        _migrated_engines.add(engine)
+    return engine in _migrated_engines
+
+
+def first_keyword(psql):
+    """Get the first keyword of a SQL statement, lowercase, ignoring comments and parentheses."""
+    psql = re.sub(r"--[^\n]*|/\*.*?\*/", " ", psql, flags=re.S).lstrip(" \t\n\r(")
+    return psql.split(None, 1)[0].lower() if psql else ""
+
+
+def is_read_statement(psql):
+    """Check whether a SQL statement only reads data, by its first keyword."""
+    return first_keyword(psql) in READ_STATEMENTS
+
+
+def normalize_sql(psql):
+    """Normalize a SQL statement for caching: collapse whitespace outside string literals and drop the final ';'."""
+    parts = re.split(r"('(?:[^']|'')*')", psql)
+    parts = [part if i % 2 else re.sub(r"\s+", " ", part) for i, part in enumerate(parts)]
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+class QueryCache:
+    """
+    Short-lived cache of query results, keyed on the normalized SQL and its parameters.
+
+    Results are kept for `ttl` seconds, and at most `max_entries` of them (the least
+    recently used are dropped first). Any write to the observations table made
+    through this process must call `invalidate`, which bumps the table version so
+    that no result read before the write is served afterwards. Writes made by other
+    processes are only seen once the cached results expire.
+
+    Args:
+        ttl: Time to live of the results, in seconds
+        max_entries: Maximum number of results kept
+    """
+
+    def __init__(self, ttl=30, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(psql, params=None):
+        return normalize_sql(psql), tuple(str(p) for p in params or ())
+
+    def get(self, psql, params=None):
+        """
+        Look up the result of a query.
+
+        Returns:
+            tuple: (result, version). The result is None if it is not cached, and the
+                   version must be given back to `put` when storing it.
+        """
+        key = self.key(psql, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None, self.version
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], self.version
+
+    def put(self, psql, params, result, version):
+        """Store the result of a query, unless the table was written since `version` was read."""
+        key = self.key(psql, params)
+        with self._lock:
+            if version != self.version:
+                return
+            self._entries[key] = (result, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        """Drop every cached result after a write to the table."""
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+
+def stream_query(engine, psql, params=None, chunk_size=1000, max_rows=None):
+    """
+    Run a SQL statement and yield its results in chunks.
+
+    Reads run in a read-only transaction and are fetched through a server-side
+    cursor (except SHOW and EXPLAIN, which PostgreSQL can't run in one), so only
+    `chunk_size` rows are in memory at a time. Other statements run in their own
+    read-write transaction, committed at the end.
+
+    Args:
+        engine: SQLAlchemy engine
+        psql: SQL statement, with %s placeholders for the parameters
+        params: List of parameters to bind to the statement
+        chunk_size: Rows fetched per round trip
+        max_rows: Stop after this many rows (None for no limit)
+
+    Yields:
+        pd.DataFrame: The rows of each chunk. Statements that don't return rows
+                      yield a single DataFrame with the number of rows affected.
+                      If `max_rows` left rows out, the last chunk has
+                      attrs["truncated"] set to True.
+    """
+    if params:
+        params = tuple(params)
+    else:
+        # The driver always applies %-formatting, so literal % (e.g. in LIKE) must be escaped
+        psql, params = psql.replace("%", "%%"), None
+    if is_read_statement(psql):
+        options = dict(postgresql_readonly=True)
+        if first_keyword(psql) in STREAMED_STATEMENTS:
+            options.update(stream_results=True, max_row_buffer=chunk_size)
+        with engine.connect().execution_options(**options) as conn:
+            result = conn.exec_driver_sql(psql, params)
+            if not result.returns_rows:
+                return
+            columns = list(result.keys())
+            n_rows = 0
+            for rows in result.partitions(chunk_size):
+                truncated = max_rows is not None and n_rows + len(rows) > max_rows
+                if truncated:
+                    rows = rows[:max_rows - n_rows]
+                n_rows += len(rows)
+                if max_rows is not None and n_rows >= max_rows and not truncated:
+                    # The limit falls at the end of a chunk: check for one more row
+                    truncated = result.fetchone() is not None
+                chunk = pd.DataFrame(rows, columns=columns)
+                if truncated:
+                    chunk.attrs["truncated"] = True
+                yield chunk
+                if max_rows is not None and n_rows >= max_rows:
+                    break
+            if n_rows == 0:
+                yield pd.DataFrame(columns=columns)
+    else:
+        with engine.begin() as conn:
+            result = conn.exec_driver_sql(psql, params)
+            if result.returns_rows:
+                rows = result.fetchall()
+                chunk = pd.DataFrame(rows[:max_rows], columns=list(result.keys()))
+                if max_rows is not None and len(rows) > max_rows:
+                    chunk.attrs["truncated"] = True
+                yield chunk
+            else:
+                yield pd.DataFrame({"rows_affected": [result.rowcount]})
+
+
+def jd_to_datetime(jd):
+    """Convert UTC Julian Dates (array-like) to timezone-aware datetimes."""
+    days = pd.Series(jd, dtype="float64") - 2440587.5
+    return pd.to_datetime(days, unit="D", utc=True).dt.round("us")
+
+
+def passages_to_observations(passages, tle_catalog, telescope, user_data, prep_minutes=5, priority=None):
+    """
+    Map planner passages onto rows of the observations table.
+
+    Exposures run from the start (t0) to the end (t2) of each passage, with the
+    telescope preparing `prep_minutes` before. The target is tracked with its TLE,
+    and the camera settings (lists in the passage file) are stored ';'-separated,
+    as in the planner configuration.
+
+    Args:
+        passages: DataFrame from passages.read_passages
+        tle_catalog: TLE catalog (or dict) of the run, by NORAD ID
+        telescope: Name of the telescope
+        user_data: Dict with the organization, username, user_unique_id and user_project
+        prep_minutes: Minutes the telescope needs to prepare before the exposures
+        priority: Priority of the observations (0-1000)
+
+    Returns:
+        List[dict]: One record per passage with a TLE, keyed by column name
+    """
+    passages = passages[passages["ID"].isin(list(tle_catalog.keys()))]
+    start = jd_to_datetime(passages["t0 [JD]"].to_numpy())
+    tles = [tle_catalog[norad_id] for norad_id in passages["ID"]]
+    if hasattr(tle_catalog, "line0"):
+        names = [tle_catalog.line0(norad_id) for norad_id in passages["ID"]]
+    else:
+        names = passages["name"].tolist()
+
+    def join(column):
+        return [";".join(str(v) for v in values) if isinstance(values, list) else str(values)
+                for values in passages[column]]
+
+    records = pd.DataFrame({
+        "designation": passages["name"].to_numpy(),
+        "norad_id": passages["ID"].to_numpy(),
+        "prep_time": start - pd.Timedelta(minutes=prep_minutes),
+        "start_time": start,
+        "end_time": jd_to_datetime(passages["t2 [JD]"].to_numpy()),
+        "telescope": telescope,
+        "too": False,
+        "dither": False,
+        "tle_line0": names,
+        "tle_line1": [line1 for line1, _ in tles],
+        "tle_line2": [line2 for _, line2 in tles],
+        "eph_flag": 0, # TLE
+        "az_deg": passages["az0 [deg]"].to_numpy(),
+        "el_deg": passages["el0 [deg]"].to_numpy(),
+        "sid_track_flag": False,
+        "exp_time": join("exp_time"),
+        "filter": join("filter"),
+        "focus_prior": False,
+        "delay_after": join("delay_after"),
+        "bin_value": join("bin"),
+        "organization": user_data["organization"],
+        "username": user_data["username"],
+        "user_unique_id": user_data["user_unique_id"],
+        "user_project": user_data["user_project"],
+        "exposures": passages["exposures"].to_numpy(),
+        "priority": priority,
+    })
+    records = records.astype(object).where(records.notna(), None)
+    return records.to_dict("records")
+
+
+def upsert_observations(engine, records, batch_size=1000):
+    """
+    Insert observations in bulk, in a single transaction.
+
+    Rows are sent as multi-row INSERT statements of up to `batch_size` rows, so a
+    night's plan is committed in one round trip (the table is only checked for its
+    unique index on the first call per engine). Observations already scheduled
+    (same user, telescope, NORAD ID and start time) are updated instead.
+
+    Args:
+        engine: SQLAlchemy engine
+        records: List of dicts with the same keys (see passages_to_observations)
+        batch_size: Rows per INSERT statement
+
+    Returns:
+        int: Number of rows inserted or updated
+
+    Raises:
+        RuntimeError: If the table is not migrated (see migrate_observations)
+    """
+    if not records:
+        return 0
+    if not schedule_index_ready(engine):
+        raise RuntimeError("The observations table is not migrated (no unique index on "
+                           f"{', '.join(SCHEDULE_KEY)}). Migrate it with `python src/db.py`")
+    stmt = insert(Observation)
+    updates = {name: stmt.excluded[name] for name in records[0] if name not in SCHEDULE_KEY}
+    stmt = stmt.on_conflict_do_update(index_elements=list(SCHEDULE_KEY), set_=updates)
+    with engine.begin() as conn:
+        for i in range(0, len(records), batch_size):
+            conn.execute(stmt, records[i:i + batch_size])
+    return len(records)
+
+
+if __name__ == "__main__":
+    # Create or migrate the observations table, after each deployment: python src/db.py
+    database_url = "postgresql+psycopg2://{}:{}@{}:{}/{}".format(
+        os.environ.get('DB_USER', 'postgres'), os.environ.get('DB_PASSWORD', 'postgres'),
+        os.environ.get('DB_HOST', 'localhost'), os.environ.get('DB_PORT', '5432'),
+        os.environ.get('DB_NAME', 'targets'))
+    engine = create_db_engine(database_url, statement_timeout=0)
+    try:
+        migrate_observations(engine)
+    except ValueError as e:
+        raise SystemExit(f"Migration aborted: {e}")
+    Base.metadata.create_all(bind=engine, checkfirst=True)
+    print("The observations table is up to date")
@@ -0,0 +1,143 @@
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Orbit class (TLE file of the planner) of well-known satellite families
+FAMILY_ORBITS = {
+    "GALAXY": "GEO", "INTELSAT": "GEO", "SES": "GEO", "EUTELSAT": "GEO", "TDRS": "GEO",
+    "GOES": "GEO", "DIRECTV": "GEO", "ECHOSTAR": "GEO", "SIRIUS": "GEO",
+    "STARLINK": "LEO", "ONEWEB": "LEO", "IRIDIUM": "LEO", "GLOBALSTAR": "LEO",
+    "NAVSTAR": "MEO", "GPS": "MEO", "GLONASS": "MEO", "GALILEO": "MEO",
+}
+
+ORBIT_WORDS = {
+    "geo": "GEO", "geostationary": "GEO", "geosynchronous": "GEO",
+    "meo": "MEO", "leo": "LEO", "low earth orbit": "LEO",
+}
+
+VISIBILITY = re.compile(r"\b(visible|visibility|pass|passes|passing|overhead|observable)\b", re.I)
+
+# Requests about the database, or with criteria the extractor doesn't handle, go to the LLM
+NOT_HANDLED = re.compile(
+    r"\b(schedul\w*|database|my observations|do i have|insert|delete|update|"
+    r"magnitude|mag|elevation|altitude|duration|inclination|eccentricity|period|"
+    r"rising|sun\w*|degrees?|km|minutes?|between|until|except|not|without|or)\b", re.I)
+
+# A family, or one of its satellites: "GOES-16", "GOES 16", "GOES16" and "GOES_16" are
+# all the catalog name "GOES 16"
+SATELLITE = re.compile(r"\b(" + "|".join(FAMILY_ORBITS) + r")(?:[\s_-]*(\d+))?\b", re.I)
+# A number that is a count, as in "STARLINK 5 satellites", goes to the LLM
+COUNTED_FAMILY = re.compile(r"\b(" + "|".join(FAMILY_ORBITS) + r")[\s_-]*\d+\s+(satellites?|sats?|objects?)\b", re.I)
+NEXT_HOURS = re.compile(r"\bnext (\d+) (hour|day)s?\b", re.I)
+
+# Time zone of the observatory, in which the planner takes TimeStart. Arizona has no
+# daylight saving time, so it is a fixed offset if the time zone database is missing
+try:
+    SITE_TZ = ZoneInfo("America/Phoenix")
+except ZoneInfoNotFoundError:
+    SITE_TZ = timezone(timedelta(hours=-7), "MST")
+
+# Local hour at which "tonight" searches start, and hours they last
+NIGHT_START_HOUR = 18
+NIGHT_HOURS = 12
+# Longest search window, as in the demonstrations
+MAX_SEARCH_HOURS = 24
+
+
+class ExtractorStats:
+    """Thread-safe hit counter of the local extractor."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+stats = ExtractorStats()
+
+
+def _search_window(prompt, now):
+    """Get the (TimeStart, SearchTime) of the time expression of a prompt, or None."""
+    match = NEXT_HOURS.search(prompt)
+    if match:
+        hours = int(match.group(1)) * (24 if match.group(2).lower() == "day" else 1)
+        return "Now", f"{min(max(hours, 1), MAX_SEARCH_HOURS):02d};00"
+    text = prompt.lower()
+    night = now.replace(hour=NIGHT_START_HOUR, minute=0, second=0, microsecond=0)
+    if now < night - timedelta(hours=24 - NIGHT_HOURS):
+        # Before dawn, "tonight" is the night that started yesterday
+        night -= timedelta(days=1)
+    if "tomorrow night" in text:
+        return (night + timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S"), f"{NIGHT_HOURS:02d};00"
+    if "tonight" in text:
+        if now < night:
+            return night.strftime("%Y-%m-%d %H:%M:%S"), f"{NIGHT_HOURS:02d};00"
+        # The night has started: search from now until it ends
+        hours_left = (night + timedelta(hours=NIGHT_HOURS) - now).total_seconds() / 3600
+        return "Now", f"{max(int(hours_left + 0.5), 1):02d};00"
+    if "tomorrow" in text:
+        midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        return midnight.strftime("%Y-%m-%d %H:%M:%S"), "24;00"
+    return None
+
+
+def _orbit(prompt, family):
+    text = prompt.lower()
+    for word, orbit in ORBIT_WORDS.items():
+        if re.search(rf"\b{word}\b", text):
+            return orbit
+    return FAMILY_ORBITS.get(family)
+
+
+def extract_planner_call(prompt, now=None):
+    """
+    Build the arguments of `run_observation_planner` for common request shapes.
+
+    Handles visibility questions about one satellite family or satellite (e.g.
+    "Which INTELSAT satellites are visible tomorrow night?", "Is GOES-16 visible
+    tonight?") over a time window ("next N hours/days", "tonight", "tomorrow night",
+    "tomorrow"). Satellites are named as in the catalogs ("GOES 16"), however the
+    number is separated from the family. Anything else, including extra criteria
+    the extractor doesn't understand, returns None so the request goes to the LLM.
+
+    Windows are in the local time of the observatory (SITE_TZ) and last at most
+    MAX_SEARCH_HOURS.
+
+    Args:
+        prompt: User prompt
+        now: Current local time of the observatory, naive (defaults to the current time in SITE_TZ)
+
+    Returns:
+        List[str]: Configuration parameters ("Name:Value"), or None
+    """
+    now = now or datetime.now(SITE_TZ).replace(tzinfo=None)
+    parameters = None
+    satellites = {(m.group(1).upper(), m.group(2)) for m in SATELLITE.finditer(prompt)}
+    if (VISIBILITY.search(prompt) and not NOT_HANDLED.search(prompt) and not COUNTED_FAMILY.search(prompt)
+            and len(satellites) == 1):
+        family, number = satellites.pop()
+        name = f"{family} {int(number)}" if number else family
+        orbit = _orbit(prompt, family)
+        window = _search_window(prompt, now)
+        if orbit is not None and window is not None:
+            parameters = [
+                f"TLEFile:{orbit}",
+                f"TimeStart:{window[0]}",
+                f"SearchTime:{window[1]}",
+                f"NameCriteria:{name}",
+            ]
+    stats.record(parameters is not None)
+    return parameters
@@ -7,30 +7,220 @@ from pydantic import create_model
 import inspect, json
 from inspect import Parameter
 import os
+import asyncio
+import queue
+import random
+import threading
+import weakref
+from datetime import datetime
 
 import streamlit as st
+import tracing
 import utils
 from typing import List, Dict, Optional
 import logging as log
 
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
-client = openai.OpenAI()
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60)) # seconds without data before a request fails
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", 10))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 20)) # shared by all sessions
+
+# Errors worth retrying: the request may succeed if sent again
+RETRYABLE_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+MESSAGE_OVERHEAD_TOKENS = 4 # tokens added by the chat format to each message
+
+TOKENIZER_MODEL = "gpt-4o"
+
+_encoding = None # tokenizer, see load_tokenizer
+_tokenizer_lock = threading.Lock()
+_loop = None
+_async_client = None
+_client_lock = threading.Lock()
+_DONE = object()
 
 def response(compl): print(nested_idx(compl, 'choices', 0, 'message', 'content'))
 
 
-def askgpt(user, system=None, model="gpt-4o", context=[], **kwargs):
+def get_event_loop():
+    """Get the event loop shared by all sessions, running in a background thread."""
+    global _loop
+    with _client_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-event-loop", daemon=True).start()
+        return _loop
+
+
+def get_async_client():
+    """
+    Get the async OpenAI client shared by all sessions.
+
+    It uses a single pooled HTTP client, so concurrent sessions reuse connections
+    instead of opening new ones. The client is built with openai's own defaults
+    and types, so the app does not depend on the HTTP transport directly. The base URL can be pointed to any
+    OpenAI-compatible server (e.g. a local mock) with OPENAI_BASE_URL.
+    """
+    global _async_client
+    with _client_lock:
+        if _async_client is None:
+            limits = type(openai.DEFAULT_CONNECTION_LIMITS)(
+                max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+            http_client = openai.DefaultAsyncHttpxClient(
+                timeout=openai.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT), limits=limits)
+            # Retries are handled by askgpt_async, with jittered backoff
+            _async_client = openai.AsyncOpenAI(http_client=http_client, max_retries=0)
+        return _async_client
+
+
+def backoff_delay(attempt, base=0.5, cap=8.0):
+    """Full-jitter exponential backoff: a random delay in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def volatile_context(now=None):
+    """
+    Message with the values that change on every call (current date and time).
+
+    It goes right before the user prompt, after the static prefix (tools, system prompt
+    and demonstrations), so the prefix is identical across calls and can be cached
+    by the provider.
+    """
+    now = now or datetime.now()
+    return {"role": "system", 
+            "content": f"<date>{now.strftime('%Y-%m-%d')}</date>\n<time>{now.strftime('%H:%M:%S')}</time>"}
+
+
+def build_messages(user, system=None, context=None):
+    context = context or []
     msgs = []
     if system: msgs.append({"role": "system", "content": system})
-    if context and len(context) > 0: msgs += context
+    msgs += context
     msgs.append({"role": "user", "content": user})
+    return msgs
+
+
+async def askgpt_async(user, system=None, model="gpt-4o", context=None, max_retries=None, **kwargs):
+    """
+    Async version of `askgpt`, using the shared pooled client.
+
+    Connection errors, rate limits and server errors are retried with jittered
+    exponential backoff. With stream=True, the returned AsyncStream should be
+    consumed inside `async with`, so that the connection is released on cancellation.
+
+    Args:
+        user: The user prompt
+        system: The system prompt
+        model: The model to use
+        context: Previous messages
+        max_retries: Number of retries (defaults to LLM_MAX_RETRIES)
+        **kwargs: Extra arguments for chat.completions.create
+
+    Returns:
+        The chat completion (or AsyncStream of chunks if stream=True)
+    """
+    context = context or []
+    msgs = build_messages(user, system, context)
+    max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+    for attempt in range(max_retries + 1):
+        try:
+            return await get_async_client().chat.completions.create(model=model, messages=msgs, **kwargs)
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                log.error(f"Error in askgpt after {attempt + 1} attempts: {str(e)}")
+                raise e
+            delay = backoff_delay(attempt)
+            log.warning(f"askgpt attempt {attempt + 1} failed ({str(e)}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+        except Exception as e:
+            log.error(f"Error in askgpt: {str(e)}")
+            log.error(f"Messages that caused the error: {json.dumps(msgs, indent=2)}")
+            raise e
+
+
+def _iterate_stream(open_stream, span):
+    """
+    Iterate synchronously over the chunks of a streamed completion run on the shared loop.
+
+    The request starts right away, so the chunks are buffered while the caller does
+    other work. If the consumer stops iterating (e.g. the Streamlit script is
+    stopped because the user navigated away), or drops the iterator before
+    iterating it, the request is cancelled and its connection released.
+
+    The span records the time to the first chunk and to the first tool call delta
+    as they arrive, and finishes when the response is fully received.
+
+    Args:
+        open_stream: Function returning the coroutine that opens the stream. It is only
+              called on the loop, so no coroutine is left unawaited if the request is
+              cancelled before it starts.
+        span: Span of the request
+    """
+    chunks = queue.Queue()
+
+    async def pump():
+        n_chunks = 0
+        try:
+            async with await open_stream() as stream:
+                async for chunk in stream:
+                    if n_chunks == 0:
+                        span.set(first_chunk_ms=round(span.elapsed_ms(), 1))
+                    if ("first_tool_call_ms" not in span.attributes and chunk.choices 
+                            and chunk.choices[0].delta.tool_calls):
+                        span.set(first_tool_call_ms=round(span.elapsed_ms(), 1))
+                    n_chunks += 1
+                    chunks.put(chunk)
+        except BaseException as e:
+            span.set(error=type(e).__name__)
+            if isinstance(e, Exception):
+                chunks.put(e)
+            else:
+                raise
+        finally:
+            span.set(chunks=n_chunks)
+            span.end()
+            chunks.put(_DONE)
+
+    future = asyncio.run_coroutine_threadsafe(pump(), get_event_loop())
+    stream = _drain_stream(chunks, future)
+    # The finally of _drain_stream only runs once the iteration has started
+    weakref.finalize(stream, future.cancel).atexit = False
+    return stream
+
+
+def _drain_stream(chunks, future):
     try:
-        return client.chat.completions.create(model=model, messages=msgs, **kwargs)
-    except Exception as e:
-        log.error(f"Error in askgpt: {str(e)}")
-        log.error(f"Messages that caused the error: {json.dumps(msgs, indent=2)}")
-        raise e
+        while True:
+            chunk = chunks.get()
+            if chunk is _DONE:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        if not future.done():
+            future.cancel()
+
+
+def askgpt(user, system=None, model="gpt-4o", context=None, **kwargs):
+    """
+    Ask the model, running the request on the shared event loop and pooled client.
+
+    Keeps the interface of the synchronous client: with stream=True it returns an
+    iterator of chunks, otherwise the completion.
+    """
+    context = context or []
+
+    def request():
+        return askgpt_async(user, system=system, model=model, context=context, **kwargs)
+
+    attributes = {"model": model, "tool_choice": kwargs.get("tool_choice")}
+    if kwargs.get("stream"):
+        return _iterate_stream(request, tracing.start_span("askgpt", stream=True, **attributes))
+    with tracing.span("askgpt", stream=False, **attributes):
+        return asyncio.run_coroutine_threadsafe(request(), get_event_loop()).result()
 
 
 def schema(f):
@@ -40,16 +230,109 @@ def schema(f):
     return dict(name=f.__name__, description=f.__doc__, parameters=s)
 
 
+def load_tokenizer():
+    """
+    Loads the local tokenizer of the model, once per process.
+
+    tiktoken downloads its encoding files on first use, unless they are cached in
+    TIKTOKEN_CACHE_DIR (the Docker image caches them at build time). If the tokenizer
+    is not available, token counts are estimated at 4 characters per token.
+
+    Returns:
+        The encoding, or False if the token counts are estimated.
+    """
+    global _encoding
+    with _tokenizer_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+                _encoding = tiktoken.encoding_for_model(TOKENIZER_MODEL)
+                log.info(f"Counting tokens with the {_encoding.name} encoding")
+            except Exception as e:
+                log.warning(f"Tokenizer not available, estimating token counts: {str(e)}")
+                _encoding = False
+        return _encoding
+
+
+def count_tokens(text):
+    """Counts the tokens of a text with the local tokenizer of the model (see `load_tokenizer`)."""
+    encoding = load_tokenizer() if _encoding is None else _encoding
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def serialize_message_items(message):
+    """
+    Serializes the content items of a message, caching the result in the message.
+
+    Items are only serialized (and their tokens counted) the first time they are
+    seen; items appended later to the message content are serialized incrementally.
+
+    Args:
+        message (dict): The message. Its serialized items are cached under "_serialized".
+
+    Returns:
+        List[tuple]: (type, serialized text, token count) of each content item.
+    """
+    content = message.get("content", "")
+    items = content if isinstance(content, list) else [content]
+    types = message.get("type", ["text"] * len(items))
+    cache = message.get("_serialized")
+    if cache is None or cache["content_id"] != id(content) or len(cache["items"]) > len(items):
+        cache = {"content_id": id(content), "items": []}
+        message["_serialized"] = cache
+    for item, item_type in list(zip(items, types))[len(cache["items"]):]:
+        text = utils.serialize_content(item, item_type)
+        cache["items"].append((item_type, text, count_tokens(text)))
+    return cache["items"]
+
+
+def fit_token_budget(messages: List[Dict[str, any]], tokens: List[int], max_tokens: int) -> List[Dict[str, any]]:
+    """
+    Drops the oldest conversation turns until the messages fit in the token budget.
+
+    A turn starts with a user message, so assistant tool calls are never separated
+    from their tool results. The messages before the first turn (e.g. a system
+    message) and the last turn are always kept.
+
+    Args:
+        messages (List[dict]): Prepared messages.
+        tokens (List[int]): Token count of each message.
+        max_tokens (int): Token budget.
+
+    Returns:
+        List[dict]: The messages of the most recent turns that fit in the budget.
+    """
+    turn_starts = [i for i, m in enumerate(messages) if m["role"] == "user"]
+    head = turn_starts[0] if turn_starts else len(messages)
+    start, total = head, sum(tokens)
+    for turn_start in turn_starts[1:]:
+        if total <= max_tokens:
+            break
+        total -= sum(tokens[start:turn_start])
+        start = turn_start
+    if total > max_tokens:
+        log.warning(f"Context of {total} tokens exceeds the budget of {max_tokens} tokens")
+    return messages[:head] + messages[start:]
+
+
 def prepare_context_messages(msgs: List[Dict[str, any]], n: Optional[int] = None, 
-                             exclude_tool: bool = False, exclude_types: List[str] = []) -> List[Dict[str, any]]:
+                             exclude_tool: bool = False, exclude_types: List[str] = [],
+                             max_tokens: Optional[int] = None) -> List[Dict[str, any]]:
     """
     Prepares the last n messages from session state to send as context to the LLM.
 
+    Large items are summarized or truncated when serialized (see `utils.serialize_content`),
+    and the serialized form of each message is cached, so it is not recomputed every turn.
+
     Args:
         msgs (List[dict]): List of messages to prepare.
         n (int, optional): Number of messages to include. If None, include all messages.
         exclude_tool (bool, optional): If True, filters out messages with role "tool".
         exclude_types (List[str], optional): List of message types to exclude.
+        max_tokens (int, optional): Token budget of the context. If given, the oldest
+            turns are dropped until the context fits.
 
     Returns:
         List[dict]: A list of serialized messages.
@@ -68,59 +351,123 @@ def prepare_context_messages(msgs: List[Dict[str, any]], n: Optional[int] = None
     else:
         collected = msgs
     prepared_messages = []
+    tokens = []
     for message in collected:
         if exclude_tool and message.get("role") == "tool":
             continue  # Skip messages with role "tool"
         
         prepared_message = {"role": message["role"], "content": ""}
-        content = message.get("content", "")
+        n_tokens = MESSAGE_OVERHEAD_TOKENS
         if "tool_calls" in message and not exclude_tool:
             prepared_message["tool_calls"] = message["tool_calls"]
+            n_tokens += sum(count_tokens(tc["function"]["arguments"]) for tc in message["tool_calls"])
         if "tool_call_id" in message:
             prepared_message["tool_call_id"] = message["tool_call_id"]
 
-        if not isinstance(content, list): content = [content]
         serialized_items = []
-        types = message.get("type", ["text"] * len(content))
-        for item, item_type in zip(content, types):
+        for item_type, text, item_tokens in serialize_message_items(message):
             if item_type not in exclude_types:
-                serialized_items.append(utils.serialize_content(item, item_type))
+                serialized_items.append(text)
+                n_tokens += item_tokens
         prepared_message["content"] = "\n".join(serialized_items)
 
         prepared_messages.append(prepared_message)
-    
+        tokens.append(n_tokens)
+
+    if max_tokens is not None:
+        prepared_messages = fit_token_budget(prepared_messages, tokens, max_tokens)
     return prepared_messages
 
 
-def handle_stream_response_tool_calls():
+def usage_metrics(usage):
     """
-    Processes chunks of a streaming response to extract tool call information.
+    Extracts the prompt caching metrics from the usage of a completion.
+
+    Returns:
+        dict: prompt, cached, uncached and completion token counts.
+    """
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = (getattr(details, "cached_tokens", None) or 0) if details else 0
+    return {"prompt_tokens": usage.prompt_tokens, 
+            "cached_tokens": cached,
+            "uncached_tokens": usage.prompt_tokens - cached,
+            "completion_tokens": usage.completion_tokens}
+
+
+def accumulate_tool_calls(tool_calls, deltas):
+    """
+    Merges the tool call deltas of a streamed chunk into the tool calls aggregated so far.
+
+    Args:
+        tool_calls (dict): Tool calls by index, updated in place. Each value is a dictionary
+              containing the tool call's id and function details (name and arguments).
+        deltas: The tool_calls of the delta of a chunk
+    """
+    for tool_call in deltas:
+        if tool_call.index not in tool_calls:
+            tool_calls[tool_call.index] = {
+                "id": tool_call.id,
+                "type": tool_call.type,
+                "function": {
+                    "name": "",
+                    "arguments": ""
+                }
+            }
+        aggregated = tool_calls[tool_call.index]
+        if tool_call.id and not aggregated["id"]:
+            aggregated["id"] = tool_call.id
+        if tool_call.function:
+            if tool_call.function.name:
+                aggregated["function"]["name"] += tool_call.function.name
+            if tool_call.function.arguments:
+                aggregated["function"]["arguments"] += tool_call.function.arguments
+
+
+def aggregate_stream(chunks, last_stream, yield_in="content"):
+    """
+    Aggregates a streamed response, yielding its content as it arrives.
+
+    The tool call deltas, the finish reason and the usage (sent in a last chunk
+    without choices) are aggregated in `last_stream`. The chunks themselves are
+    not kept.
+
+    Args:
+        chunks: The chunks of the response
+        last_stream (dict): Aggregated stream, updated in place, with the "finish_reason",
+              the "tool_calls" (by index) and the "usage" of the response
+        yield_in (str): The attribute to extract from each chunk's delta (default: "content")
+
+    Yields:
+        str: Content extracted from each chunk based on the yield_in parameter
+    """
+    for chunk in chunks:
+        if getattr(chunk, "usage", None):
+            last_stream["usage"] = chunk.usage
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        content = getattr(choice.delta, yield_in, "")
+        if content is not None:
+            yield content
+        if choice.delta.tool_calls:
+            accumulate_tool_calls(last_stream["tool_calls"], choice.delta.tool_calls)
+        if choice.finish_reason:
+            last_stream["finish_reason"] = choice.finish_reason
+
+
+def handle_stream_response_tool_calls(last_stream=None):
+    """
+    Returns the tool calls aggregated while streaming a response.
+
+    Args:
+        last_stream (dict, optional): Aggregated stream, as stored by `stream_response`.
+              Defaults to the last stream stored in session state.
+
     Returns:
-        dict: A dictionary where each key is a tool call index and each value is a dictionary containing
+        list: The tool calls, ordered by index. Each one is a dictionary containing
               the tool call's id and function details (name and arguments).
-    The function processes the last stream stored in session state, extracts tool call information, 
-    and aggregates it into a dictionary.
-    """
-    tool_calls = {}
-
-    for chunk in st.session_state["last_stream"]:
-        delta = chunk.delta
-        if delta.tool_calls:
-            for tool_call in delta.tool_calls:
-                if tool_call.index not in tool_calls:
-                    tool_calls[tool_call.index] = {
-                        "id": tool_call.id,
-                        "type": tool_call.type,
-                        "function": {
-                            "name": "",
-                            "arguments": ""
-                        }
-                    }
-
-                if tool_call.function.name:
-                    tool_calls[tool_call.index]["function"]["name"] += tool_call.function.name
-                if tool_call.function.arguments:
-                    tool_calls[tool_call.index]["function"]["arguments"] += tool_call.function.arguments
-
-    # Convert dictionary to ordered list
-    return [tool_calls[i] for i in sorted(tool_calls.keys())]
\ No newline at end of file
+    """
+    if last_stream is None:
+        last_stream = st.session_state["last_stream"]
+    tool_calls = last_stream["tool_calls"]
+    return [tool_calls[i] for i in sorted(tool_calls.keys())]
@@ -0,0 +1,234 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+# Columns of the passage files written by SatellitePredictor, in file order
+PASSAGE_COLUMNS = [
+    "ID", "name", "TLE epoch", "t0 [JD]", "az0 [deg]", "el0 [deg]",
+    "t1 [JD]", "az1 [deg]", "el1 [deg]", "t2 [JD]", "az2 [deg]", "el2 [deg]",
+    "exposures", "filter", "exp_time", "delay_after", "bin"
+]
+
+PASSAGE_DTYPES = {
+    "ID": str,
+    "name": str,
+    "TLE epoch": np.float64,
+    "t0 [JD]": np.float64,
+    "az0 [deg]": np.float64,
+    "el0 [deg]": np.float64,
+    "t1 [JD]": np.float64,
+    "az1 [deg]": np.float64,
+    "el1 [deg]": np.float64,
+    "t2 [JD]": np.float64,
+    "az2 [deg]": np.float64,
+    "el2 [deg]": np.float64,
+    "exposures": np.int64,
+    "filter": str,
+    "exp_time": str,
+    "delay_after": str,
+    "bin": str,
+}
+
+# Bracketed list columns, e.g. [gprime,rprime,iprime], and the type of their items
+LIST_COLUMNS = {
+    "filter": str,
+    "exp_time": float,
+    "delay_after": float,
+    "bin": int,
+}
+
+DISPLAY_COLUMNS = [
+    'ID', 'name', 't0 [JD]', 't1 [JD]', 't2 [JD]',
+    'az0 [deg]', 'az1 [deg]', 'az2 [deg]', 'el0 [deg]', 'el1 [deg]', 'el2 [deg]'
+]
+
+
+def parse_list(value, item_type=str):
+    """
+    Parse a bracketed list value from a passage file.
+
+    Args:
+        value: String like '[1.0,1.0,1.0]'
+        item_type: Type to convert each item to
+
+    Returns:
+        list: The decoded items (empty for '[]')
+    """
+    inner = value.strip().strip("[]")
+    return [item_type(item.strip()) for item in inner.split(",") if item.strip()]
+
+
+def decode_list_column(column, item_type=str):
+    """
+    Decode a column of bracketed lists into Python lists.
+
+    Every row of a run usually carries the same camera settings, so each distinct
+    string is parsed only once and the result is mapped back onto the column.
+
+    Args:
+        column: pandas Series of bracketed list strings
+        item_type: Type to convert each item to
+
+    Returns:
+        pandas.Series: Series of lists
+    """
+    decoded = {value: parse_list(value, item_type) for value in column.unique()}
+    return column.map(decoded)
+
+
+def decode_list_columns(passages):
+    """Decode the bracketed list columns of a passage table read with decode_lists=False (in place)."""
+    for column, item_type in LIST_COLUMNS.items():
+        passages[column] = decode_list_column(passages[column], item_type)
+    return passages
+
+
+def count_header_lines(filename):
+    """
+    Count the leading comment and blank lines of a passage file.
+
+    SatellitePredictor indents its '#' header line, which the C parser would
+    otherwise read as a row of missing values.
+    """
+    n = 0
+    with open(filename, "r") as f:
+        for line in f:
+            stripped = line.strip()
+            if stripped and not stripped.startswith("#"):
+                break
+            n += 1
+    return n
+
+
+def read_passages(filename, decode_lists=True, **kwargs):
+    """
+    Read a SatellitePredictor passage file into a typed DataFrame.
+
+    Uses the C parser with a fixed dtype schema, zero-pads the NORAD IDs and
+    decodes the bracketed list columns (filter, exp_time, delay_after, bin).
+
+    Args:
+        filename: Path of the passage file
+        decode_lists: If True, decode the list columns into Python lists
+        **kwargs: Extra arguments for pandas.read_csv (e.g. skiprows, nrows).
+            By default, the header lines are skipped.
+
+    Returns:
+        pandas.DataFrame: One row per passage, with columns PASSAGE_COLUMNS
+    """
+    kwargs.setdefault("skiprows", count_header_lines(filename))
+    return _read_passage_table(filename, decode_lists, **kwargs)
+
+
+def parse_passage_lines(lines, decode_lists=True):
+    """
+    Parse data lines of a passage file (without header) into a typed DataFrame.
+
+    Args:
+        lines: List of data lines
+        decode_lists: If True, decode the list columns into Python lists
+
+    Returns:
+        pandas.DataFrame: One row per line, with columns PASSAGE_COLUMNS
+    """
+    return _read_passage_table(io.StringIO("\n".join(lines)), decode_lists)
+
+
+def _read_passage_table(source, decode_lists=True, **kwargs):
+    passages = pd.read_csv(source, comment='#', sep=r'\s+', engine='c',
+                           header=None, names=PASSAGE_COLUMNS,
+                           dtype=PASSAGE_DTYPES, **kwargs)
+    passages['ID'] = passages['ID'].str.zfill(5)
+    if decode_lists:
+        decode_list_columns(passages)
+    return passages
+
+
+def _file_signature(filename):
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class PassageTail:
+    """
+    Incrementally read the rows appended to a passage file while it is being written.
+
+    Each call to `poll` parses only the complete lines written since the previous
+    call. If the file is truncated or replaced, reading starts over. A file that
+    already exists when the tail is created is considered stale (e.g. the output of
+    a previous run for the same day) and ignored until it is modified.
+
+    Args:
+        filename: Path of the passage file
+        ignore_existing: If True, ignore the current content of the file until it changes
+    """
+
+    def __init__(self, filename, ignore_existing=True):
+        self.filename = filename
+        self.passages = None
+        self._offset = 0
+        self._partial = b""
+        self._stale = _file_signature(filename) if ignore_existing else None
+
+    def reset(self):
+        self.passages = None
+        self._offset = 0
+        self._partial = b""
+
+    def poll(self):
+        """
+        Read the rows appended since the last call.
+
+        Returns:
+            pandas.DataFrame: The new rows, or None if there are none
+        """
+        signature = _file_signature(self.filename)
+        if signature is None:
+            return None
+        if self._stale is not None:
+            if signature == self._stale:
+                return None
+            self._stale = None
+            self.reset()
+        if signature[2] < self._offset:
+            self.reset()
+
+        with open(self.filename, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        self._offset += len(data)
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        lines = [line.decode(errors="replace") for line in lines]
+        lines = [line for line in lines if line.strip() and not line.strip().startswith("#")]
+        if not lines:
+            return None
+
+        new_rows = parse_passage_lines(lines)
+        if self.passages is None:
+            self.passages = new_rows
+        else:
+            self.passages = pd.concat([self.passages, new_rows], ignore_index=True)
+        return new_rows
+
+
+class PlannerOutput:
+    """
+    Passage and TLE files written by a planner run.
+
+    Has the same interface as `planner_cache.CacheEntry`, so results can be
+    rendered the same way whether they come from a run or from the cache.
+    """
+
+    def __init__(self, passages_file, tle_file):
+        self.passages_file = passages_file
+        self.tle_file = tle_file
+
+    def passages(self):
+        """Return the parsed passages DataFrame."""
+        return read_passages(self.passages_file)
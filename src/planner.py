@@ -1,9 +1,83 @@
-import plotly.graph_objects as go
 import numpy as np
-from skyfield.api import load, EarthSatellite
+import propagation
+from tle_catalog import TLECatalog
+
+MAX_LABELED_SATELLITES = 50 # above this, satellite names are only shown on hover
+TRACK_POINT_BUDGET = 100_000 # ground track points of a figure, shared by its passes
+MAX_TRACK_POINTS = 32 # points of a ground track when there are few passes
+MIN_TRACK_POINTS = 3 # t0, t1 and t2
+
+# Orbit classes by mean motion (revolutions per day), and their colors
+GEO_MEAN_MOTION = (0.9, 1.1)
+LEO_MIN_MEAN_MOTION = 11.25 # periods under 128 minutes
+ORBIT_COLORS = {"LEO": "#1f77b4", "MEO": "#2ca02c", "GEO": "#d62728", "Other": "#9467bd"}
+
+
+def track_points(n_passes):
+    """Number of points of each ground track, so a figure stays light with many passes."""
+    return int(np.clip(TRACK_POINT_BUDGET // max(n_passes, 1), MIN_TRACK_POINTS, MAX_TRACK_POINTS))
+
+
+def track_times(t0, t1, t2, n_points):
+    """
+    Sample the times of ground tracks from t0 to t2, through t1.
+
+    Args:
+        t0, t1, t2: Arrays of UTC Julian Dates of the passes
+        n_points: Points of each track (at least 3)
+
+    Returns:
+        numpy.ndarray: UTC Julian Dates with shape (n_passes, n_points)
+    """
+    n_first = (n_points + 1) // 2
+    rising = np.linspace(0, 1, n_first)
+    setting = np.linspace(0, 1, n_points - n_first + 1)[1:]
+    return np.hstack([t0[:, None] + (t1 - t0)[:, None] * rising,
+                      t1[:, None] + (t2 - t1)[:, None] * setting])
+
+
+def track_arrays(lon, lat):
+    """
+    Flatten ground tracks into the arrays of a single line trace.
+
+    Tracks are separated by NaN, and also broken where they cross the
+    antimeridian, so no line is drawn across the map.
+
+    Args:
+        lon, lat: Arrays of degrees with shape (n_passes, n_points)
+
+    Returns:
+        tuple: (lon, lat) float32 arrays
+    """
+    gap = np.full((lon.shape[0], 1), np.nan)
+    lon = np.hstack([lon, gap]).ravel()
+    lat = np.hstack([lat, gap]).ravel()
+    wraps = np.flatnonzero(np.abs(np.diff(lon)) > 180) + 1
+    return (np.insert(lon, wraps, np.nan).astype(np.float32),
+            np.insert(lat, wraps, np.nan).astype(np.float32))
+
+
+def orbit_classes(satrecs):
+    """Classify satellites as LEO, MEO, GEO or Other by the mean motion of their TLE."""
+    mean_motion = np.array([sat.no_kozai for sat in satrecs]) * 1440 / (2 * np.pi) # rad/min to rev/day
+    return np.select(
+        [mean_motion >= LEO_MIN_MEAN_MOTION,
+         (mean_motion >= GEO_MEAN_MOTION[0]) & (mean_motion <= GEO_MEAN_MOTION[1]),
+         mean_motion > GEO_MEAN_MOTION[1]],
+        ["LEO", "GEO", "MEO"], default="Other")
 
 def plot_passages(passages_df, tle_dict):
-    """Plot satellite passages on an interactive map."""
+    """
+    Plot satellite passages on an interactive map.
+
+    Each pass is drawn as its ground track from t0 to t2, with a marker at t0. The
+    passes of an orbit class share one line trace and one marker trace, and the
+    tracks have fewer points when there are many passes (see track_points).
+
+    The times of the passage file are UTC Julian Dates, as its TLE epoch column
+    (the TLE epochs are UTC), and are propagated as UTC (see propagation).
+    """
+    import plotly.graph_objects as go # imported on first use, it is slow to load
 
     fig = go.Figure()
 
@@ -24,35 +98,52 @@ def plot_passages(passages_df, tle_dict):
         showlegend=True
     ))
 
-    ts = load.timescale()
-
-    # Plot each satellite
-    for _, sat_row in passages_df.iterrows():
-        sat_id = sat_row['ID']
-        sat_name = sat_row['name']
-
-        if sat_id in tle_dict:
-            tle_lines = tle_dict[sat_id]
-            satellite = EarthSatellite(tle_lines[0], tle_lines[1], sat_name, ts)
-
-            t = ts.tt_jd(float(sat_row['t0 [JD]']))
-            geocentric = satellite.at(t)
-            subpoint = geocentric.subpoint()
+    # Ground tracks and t0 markers of the passes, in one pair of traces per orbit class
+    has_tle = passages_df['ID'].isin(list(tle_dict.keys()))
+    sats = passages_df[has_tle]
+    if len(sats) > 0:
+        if isinstance(tle_dict, TLECatalog):
+            satrecs = tle_dict.satrecs(sats['ID'])
+        else:
+            satrecs = propagation.satrecs_from_tles(tle_dict[sat_id] for sat_id in sats['ID'])
+        times = track_times(sats['t0 [JD]'].to_numpy(float), sats['t1 [JD]'].to_numpy(float),
+                            sats['t2 [JD]'].to_numpy(float), track_points(len(sats)))
+        lat, lon = propagation.subpoints(satrecs, times)
+        classes = orbit_classes(satrecs)
+        names = sats['name'].to_numpy()
+        labeled = len(sats) <= MAX_LABELED_SATELLITES
 
+        for orbit_class, color in ORBIT_COLORS.items():
+            in_class = classes == orbit_class
+            if not in_class.any():
+                continue
+            track_lon, track_lat = track_arrays(lon[in_class], lat[in_class])
             fig.add_trace(go.Scattergeo(
-                lon=[subpoint.longitude.degrees],
-                lat=[subpoint.latitude.degrees],
-                mode='markers+text',
-                name=sat_name,
+                lon=track_lon,
+                lat=track_lat,
+                mode='lines',
+                name=f'{orbit_class} ({in_class.sum()} passes)',
+                legendgroup=orbit_class,
+                line=dict(color=color, width=1.5),
+                hoverinfo='skip',
+                showlegend=True
+            ))
+            fig.add_trace(go.Scattergeo(
+                lon=lon[in_class, 0].astype(np.float32),
+                lat=lat[in_class, 0].astype(np.float32),
+                mode='markers+text' if labeled else 'markers',
+                name=orbit_class,
+                legendgroup=orbit_class,
                 marker=dict(
-                    size=10,
+                    size=10 if labeled else 5,
                     symbol='diamond',
+                    color=color,
                     line=dict(
                         width=1,
                         color='white'
                     )
                 ),
-                text=[sat_name],
+                text=names[in_class],
                 textposition="top center",
                 textfont=dict(
                     size=14,
@@ -64,7 +155,7 @@ def plot_passages(passages_df, tle_dict):
                     "Latitude: %{lat:.2f}°<br>" +
                     "<extra></extra>"
                 ),
-                showlegend=True
+                showlegend=False
             ))
 
     # Add Tucson marker
@@ -149,19 +240,16 @@ def plot_passages(passages_df, tle_dict):
 
 
 def read_tle_file(filename):
-    tle_dict = {}
-    with open(filename, 'r') as f:
-        lines = f.readlines()
-        i = 0
-        while i < len(lines):
-            if lines[i].startswith('0'):
-                # Skip the satellite name line
-                tle_line1 = lines[i + 1].strip()
-                tle_line2 = lines[i + 2].strip()
-                # Extract NORAD ID from TLE line 1 (columns 3-7)
-                norad_id = tle_line1[2:7].strip()
-                tle_dict[norad_id] = (tle_line1, tle_line2)
-                i += 3
-            else:
-                i += 1
-    return tle_dict
\ No newline at end of file
+    """
+    Read a TLE file into a catalog keyed by NORAD ID.
+
+    The catalog is cached and only reparsed when the file changes, so repeated
+    tool calls on the same `__TLE_<user>.txt` file are free.
+
+    Args:
+        filename: Path to the TLE file
+
+    Returns:
+        TLECatalog: Mapping from NORAD ID to (line1, line2)
+    """
+    return TLECatalog.load(filename)
@@ -0,0 +1,226 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from passages import decode_list_columns, read_passages
+
+PASSAGES_NAME = "passages.txt"
+TLE_NAME = "tle.txt"
+DATAFRAME_NAME = "passages.parquet"
+META_NAME = "meta.json"
+
+
+def canonical_config(planner_conf, now_resolution=900, tle_refresh=6 * 3600, now=None):
+    """
+    Get the canonical form of a planner configuration used to build cache keys.
+
+    Relative start times ('Now') are resolved to the current time, rounded down to
+    `now_resolution` seconds, so that the same question asked a few minutes apart
+    hits the same entry. The TLE catalog is downloaded by the planner on each run,
+    so its epoch is represented by the TLE refresh period the run falls in.
+
+    Args:
+        planner_conf: Merged planner configuration
+        now_resolution: Resolution in seconds of relative start times
+        tle_refresh: Period in seconds at which the TLE catalogs are refreshed
+        now: Current POSIX time (defaults to time.time())
+
+    Returns:
+        dict: Canonical configuration
+    """
+    now = time.time() if now is None else now
+    conf = copy.deepcopy(planner_conf)
+    criteria = conf.get("Criteria", {})
+    time_start = str(criteria.get("TimeStart", ""))
+    if time_start.split(" ")[0].lower() == "now":
+        bucket = now - now % now_resolution
+        criteria["TimeStart"] = datetime.fromtimestamp(bucket, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    return {"config": conf, "tle_epoch": int(now // tle_refresh)}
+
+
+def config_key(planner_conf, **kwargs):
+    """
+    Hash a planner configuration into a cache key.
+
+    Args:
+        planner_conf: Merged planner configuration
+        **kwargs: Arguments for canonical_config
+
+    Returns:
+        str: Hex SHA-256 of the canonical configuration
+    """
+    canonical = json.dumps(canonical_config(planner_conf, **kwargs), sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class CacheEntry:
+    """Files and parsed passages of a cached planner run."""
+
+    def __init__(self, cache, key, path):
+        self.cache = cache
+        self.key = key
+        self.path = path
+        self.passages_file = os.path.join(path, PASSAGES_NAME)
+        self.tle_file = os.path.join(path, TLE_NAME)
+
+    def passages(self):
+        """Return a copy of the parsed passages DataFrame (from memory, disk, or parsing the file)."""
+        return self.cache.passages(self)
+
+
+class PlannerCache:
+    """
+    Content-addressed cache of observation planner results.
+
+    Each entry is a directory named after the configuration key, holding copies of
+    the passage and TLE files written by the planner and the parsed passages, as
+    Parquet (data only, never pickles, as the directory may be shared). Entries
+    expire after `ttl` seconds, and the least recently used ones are evicted when
+    the cache exceeds `max_bytes`. The most recently used parsed DataFrames are
+    also kept in memory.
+
+    Args:
+        cache_dir: Directory where the entries are stored
+        ttl: Time to live of the entries, in seconds
+        max_bytes: Maximum size of the cache on disk
+        max_in_memory: Maximum number of parsed DataFrames kept in memory
+        **key_kwargs: Arguments for canonical_config (now_resolution, tle_refresh)
+    """
+
+    def __init__(self, cache_dir, ttl=3600, max_bytes=512 * 1024**2, max_in_memory=8, **key_kwargs):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_in_memory = max_in_memory
+        self.key_kwargs = key_kwargs
+        self._memory = OrderedDict()
+        self._lock = threading.RLock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, planner_conf):
+        return config_key(planner_conf, **self.key_kwargs)
+
+    def _meta(self, path):
+        try:
+            with open(os.path.join(path, META_NAME), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, path, meta):
+        tmp = os.path.join(path, META_NAME + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(path, META_NAME))
+
+    def _remove(self, key):
+        self._memory.pop(key, None)
+        shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+    def get(self, key):
+        """
+        Look up a cached run.
+
+        Args:
+            key: Configuration key (see `key`)
+
+        Returns:
+            CacheEntry: The entry, or None if missing or expired
+        """
+        with self._lock:
+            path = os.path.join(self.cache_dir, key)
+            meta = self._meta(path)
+            if meta is None:
+                return None
+            if time.time() - meta["created"] > self.ttl:
+                self._remove(key)
+                return None
+            meta["last_access"] = time.time()
+            self._write_meta(path, meta)
+            return CacheEntry(self, key, path)
+
+    def put(self, key, passages_file, tle_file, planner_conf=None):
+        """
+        Store the output files of a planner run.
+
+        Args:
+            key: Configuration key (see `key`)
+            passages_file: Passage file written by the planner
+            tle_file: TLE file written by the planner
+            planner_conf: Configuration of the run, stored for reference
+
+        Returns:
+            CacheEntry: The new entry
+        """
+        with self._lock:
+            path = os.path.join(self.cache_dir, key)
+            tmp_path = path + ".tmp"
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            os.makedirs(tmp_path)
+            shutil.copyfile(passages_file, os.path.join(tmp_path, PASSAGES_NAME))
+            shutil.copyfile(tle_file, os.path.join(tmp_path, TLE_NAME))
+            # The list columns are stored as their text, and decoded when loaded
+            passages = read_passages(os.path.join(tmp_path, PASSAGES_NAME), decode_lists=False)
+            passages.to_parquet(os.path.join(tmp_path, DATAFRAME_NAME))
+            passages = decode_list_columns(passages)
+            now = time.time()
+            self._write_meta(tmp_path, {"created": now, "last_access": now, "config": planner_conf})
+            self._remove(key)
+            os.replace(tmp_path, path)
+            self._remember(key, passages)
+            self.evict()
+            return CacheEntry(self, key, path)
+
+    def _remember(self, key, passages):
+        self._memory[key] = passages
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_in_memory:
+            self._memory.popitem(last=False)
+
+    def passages(self, entry):
+        """
+        Return the parsed passages of an entry.
+
+        The DataFrame kept in memory is shared by the sessions, so each caller gets its
+        own copy, which it can filter or extend (the lists of the list columns are
+        still shared, and must not be modified in place).
+        """
+        with self._lock:
+            passages = self._memory.get(entry.key)
+            if passages is None:
+                try:
+                    passages = decode_list_columns(pd.read_parquet(os.path.join(entry.path, DATAFRAME_NAME)))
+                except Exception as e:
+                    logging.warning(f"Could not load cached passages, parsing the file: {e}")
+                    passages = read_passages(entry.passages_file)
+            self._remember(entry.key, passages)
+            return passages.copy()
+
+    def evict(self):
+        """Remove the expired entries, then the least recently used ones until the cache fits in max_bytes."""
+        with self._lock:
+            entries = []
+            for key in os.listdir(self.cache_dir):
+                path = os.path.join(self.cache_dir, key)
+                meta = self._meta(path)
+                if meta is None or time.time() - meta["created"] > self.ttl:
+                    if not key.endswith(".tmp"):
+                        self._remove(key)
+                    continue
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                entries.append((meta["last_access"], key, size))
+            total = sum(size for _, _, size in entries)
+            for _, key, size in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(key)
+                total -= size
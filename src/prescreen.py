@@ -0,0 +1,206 @@
+import re
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+import propagation
+
+# Tucson observatory
+SITE_LAT = 32.2226
+SITE_LON = -110.9747
+SITE_ALT_KM = 0.728
+SITE_UTC_OFFSET = timedelta(hours=-7) # TimeStart is local time; Arizona has no daylight saving time
+
+# Time steps of the elevation grid. Slow objects (GEO, MEO) barely move in the sky
+# between samples; fast ones (LEO) can cross the sky in minutes, so the peak of each
+# of their passes is refined on a fine grid around the highest coarse sample.
+FAST_STEP_S = 60
+SLOW_STEP_S = 300
+FINE_STEP_S = 5
+FAST_MEAN_MOTION = 6.0 # rev/day
+ELEVATION_MARGIN = 3.0 # degrees kept below the threshold, for the peaks missed between samples
+CHUNK_SIZE = 1000 # objects propagated at once, to bound the memory of the grid
+
+
+class Prescreen:
+    """
+    Result of a pre-screen: the objects that may have passes, and their approximate passes.
+
+    Attributes:
+        ids: NORAD IDs of the objects rising above the elevation threshold (minus the margin)
+        passes: Approximate passes (the columns of passages.DISPLAY_COLUMNS), from the sampled elevations
+        n_candidates: Objects screened (those matching the name criteria)
+        min_elevation: Elevation threshold in degrees
+        fresh: Whether the catalog is recent enough to restrict the planner run to `ids`
+               (or to skip it); older catalogs may miss newly catalogued objects
+    """
+
+    def __init__(self, ids, passes, n_candidates, min_elevation, fresh=True):
+        self.ids = ids
+        self.passes = passes
+        self.n_candidates = n_candidates
+        self.min_elevation = min_elevation
+        self.fresh = fresh
+
+    def summary(self):
+        summary = (f"Pre-screen: {len(self.ids)} of {self.n_candidates} objects may rise above "
+                   f"{self.min_elevation:g}° from Tucson in the search window "
+                   f"({len(self.passes)} approximate passes)")
+        if not self.fresh:
+            summary += ". The catalog is not from today, so the planner searches all the objects"
+        return summary
+
+
+def datetime_to_jd(dt):
+    return dt.timestamp() / 86400 + 2440587.5
+
+
+def search_window(criteria, now=None):
+    """
+    Get the search window of a planner configuration as UTC Julian Dates.
+
+    Args:
+        criteria: Criteria section of the configuration (TimeStart, SearchTime)
+        now: Current UTC time (defaults to datetime.now)
+
+    Returns:
+        tuple: (jd_start, jd_end)
+    """
+    time_start = str(criteria.get("TimeStart", "Now")).strip()
+    if time_start.lower() == "now":
+        start = now or datetime.now(timezone.utc)
+    else:
+        start = datetime.strptime(time_start, "%Y-%m-%d %H:%M:%S") - SITE_UTC_OFFSET
+        start = start.replace(tzinfo=timezone.utc)
+    hours, minutes = (int(part) for part in re.split(r"[;:]", str(criteria.get("SearchTime", "08;00")))[:2])
+    return datetime_to_jd(start), datetime_to_jd(start + timedelta(hours=hours, minutes=minutes))
+
+
+def min_pass_elevation(criteria):
+    """Elevation in degrees a pass must reach to meet the criteria (PassMinimumAltitude, PassStartAltitude)."""
+    thresholds = [criteria.get(key) for key in ("PassMinimumAltitude", "PassStartAltitude")]
+    return max([float(value) for value in thresholds if isinstance(value, (int, float))], default=0.0)
+
+
+def name_candidates(catalog, name_criteria):
+    """
+    Get the IDs of the objects of a catalog matching the name criteria of the planner.
+
+    Each ';'-separated term matches the objects whose name contains it, or whose
+    NORAD ID it is. An empty criteria matches every object.
+    """
+    terms = [term.strip().upper() for term in str(name_criteria or "").split(";") if term.strip()]
+    if not terms:
+        return catalog.ids
+    names = pd.Series(catalog.names, dtype=str).str.upper()
+    ids = pd.Series(catalog.ids)
+    matches = np.zeros(len(catalog), dtype=bool)
+    for term in terms:
+        matches |= names.str.contains(term, regex=False).to_numpy()
+        if term.isdigit():
+            matches |= (ids == term.zfill(5)).to_numpy()
+    return catalog.ids[matches]
+
+
+def _runs(elevation, threshold):
+    """
+    Find the runs of consecutive samples above a threshold in each row.
+
+    Returns:
+        tuple: (rows, starts, ends, peaks) arrays, with exclusive ends and the
+               index of the highest sample of each run
+    """
+    edges = np.diff(np.pad(elevation >= threshold, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1) # in the same (row-major) order as the starts
+    peaks = np.array([start + np.argmax(elevation[row, start:end]) 
+                      for row, start, end in zip(rows, starts, ends)], dtype=int)
+    return rows, starts, ends, peaks
+
+
+def _refine_peaks(satrecs, peak_jd, step):
+    """Find the highest elevation within a coarse step of each peak, on a FINE_STEP_S grid."""
+    offsets = np.arange(-step, step + FINE_STEP_S, FINE_STEP_S) / 86400
+    jd = peak_jd[:, None] + offsets[None, :]
+    e, r = propagation.propagate_each(satrecs, jd)
+    azimuth, elevation = propagation.look_angles(r, jd, SITE_LAT, SITE_LON, SITE_ALT_KM)
+    elevation[e != 0] = -90.0
+    best = np.argmax(elevation, axis=1)
+    index = np.arange(len(jd))
+    return jd[index, best], azimuth[index, best], elevation[index, best]
+
+
+def _screen_chunk(satrecs, jd, step, refine, min_elevation):
+    """
+    Screen a chunk of objects over a coarse time grid.
+
+    Returns:
+        tuple: (rows, passes), the rows of the objects that may reach the threshold and
+               the approximate passes (row, t0, t1, t2, az0, az1, az2, el0, el1, el2)
+    """
+    e, r = propagation.propagate(satrecs, jd)
+    azimuth, elevation = propagation.look_angles(r, jd[None, :], SITE_LAT, SITE_LON, SITE_ALT_KM)
+    elevation[e != 0] = -90.0
+    # Fast objects: every pass above the horizon is refined, as its peak can fall between samples
+    rows, starts, ends, peaks = _runs(elevation, 0.0 if refine else min_elevation - ELEVATION_MARGIN)
+    if refine and len(rows):
+        peak_jd, peak_az, peak_el = _refine_peaks([satrecs[row] for row in rows], jd[peaks], step)
+    else:
+        peak_jd, peak_az, peak_el = jd[peaks], azimuth[rows, peaks], elevation[rows, peaks]
+
+    passes = []
+    for i in np.flatnonzero(peak_el >= min_elevation):
+        row = rows[i]
+        # Rise and set: the first and last samples of the run above the threshold. The
+        # refined peak may fall outside of them (or be the only point above it)
+        above = np.flatnonzero(elevation[row, starts[i]:ends[i]] >= min_elevation) + starts[i]
+        peak = (peak_jd[i], peak_az[i], peak_el[i])
+        rise = (jd[above[0]], azimuth[row, above[0]], elevation[row, above[0]]) if len(above) else peak
+        set_ = (jd[above[-1]], azimuth[row, above[-1]], elevation[row, above[-1]]) if len(above) else peak
+        rise = peak if peak[0] < rise[0] else rise
+        set_ = peak if peak[0] > set_[0] else set_
+        passes.append((row, rise[0], peak[0], set_[0], rise[1], peak[1], set_[1], rise[2], peak[2], set_[2]))
+    return np.unique(rows[peak_el >= min_elevation - ELEVATION_MARGIN]), passes
+
+
+def prescreen(catalog, jd_start, jd_end, min_elevation, name_criteria=""):
+    """
+    Find the objects of a catalog that may pass above an elevation from Tucson in a window.
+
+    Every candidate is propagated over a time grid covering the window (FAST_STEP_S
+    for fast objects, SLOW_STEP_S for slow ones) in vectorized sgp4 calls. The peaks
+    of the passes of fast objects are then refined (see FINE_STEP_S), and only the
+    objects reaching `min_elevation - ELEVATION_MARGIN` survive. The passes reaching
+    `min_elevation` are returned as approximate passes.
+
+    Args:
+        catalog: TLECatalog of the objects
+        jd_start, jd_end: Search window (UTC Julian Dates)
+        min_elevation: Elevation threshold in degrees
+        name_criteria: NameCriteria of the planner, to screen only the matching objects
+
+    Returns:
+        Prescreen: The surviving objects and their approximate passes
+    """
+    candidates = name_candidates(catalog, name_criteria)
+    satrecs = catalog.satrecs(candidates)
+    mean_motion = np.array([sat.no_kozai for sat in satrecs]) * 1440 / (2 * np.pi) # rad/min to rev/day
+    survivors, records = [], []
+    for is_fast, step in ((True, FAST_STEP_S), (False, SLOW_STEP_S)):
+        group = np.flatnonzero((mean_motion >= FAST_MEAN_MOTION) == is_fast)
+        # One step beyond each end, so passes at the edges of the window are not missed
+        jd = np.arange(jd_start - step / 86400, jd_end + 2 * step / 86400, step / 86400)
+        for chunk in np.array_split(group, max(1, int(np.ceil(len(group) / CHUNK_SIZE)))):
+            if len(chunk) == 0:
+                continue
+            rows, passes = _screen_chunk([satrecs[i] for i in chunk], jd, step, is_fast, min_elevation)
+            survivors.extend(candidates[chunk[rows]].tolist())
+            for row, *values in passes:
+                norad_id = candidates[chunk[row]]
+                records.append([norad_id, catalog.name(norad_id), *values])
+    passes = pd.DataFrame(records, columns=["ID", "name", "t0 [JD]", "t1 [JD]", "t2 [JD]",
+                                            "az0 [deg]", "az1 [deg]", "az2 [deg]",
+                                            "el0 [deg]", "el1 [deg]", "el2 [deg]"])
+    passes = passes.sort_values("t0 [JD]", ignore_index=True)
+    return Prescreen(sorted(survivors), passes, len(candidates), min_elevation)
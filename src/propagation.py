@@ -0,0 +1,194 @@
+import numpy as np
+from sgp4.api import Satrec, SatrecArray
+
+# WGS84 ellipsoid
+EARTH_RADIUS_KM = 6378.137
+EARTH_FLATTENING = 1 / 298.257223563
+EARTH_E2 = EARTH_FLATTENING * (2 - EARTH_FLATTENING)
+
+
+def satrecs_from_tles(tles):
+    """
+    Build sgp4 Satrec objects from TLE line pairs.
+
+    Args:
+        tles: Iterable of (line1, line2) tuples
+
+    Returns:
+        list: One Satrec per TLE, in the same order
+    """
+    return [Satrec.twoline2rv(line1, line2) for line1, line2 in tles]
+
+
+def split_jd(jd):
+    """
+    Split Julian Dates into whole and fractional parts to keep sgp4 precision.
+
+    Args:
+        jd: Array-like of Julian Dates
+
+    Returns:
+        tuple: (whole, fraction) arrays, with whole days starting at midnight
+    """
+    jd = np.asarray(jd, dtype=np.float64)
+    whole = np.floor(jd - 0.5) + 0.5
+    return whole, jd - whole
+
+
+def propagate(satrecs, jd):
+    """
+    Propagate an array of satellites over a shared array of times in a single call.
+
+    Args:
+        satrecs: List of Satrec objects (or a prebuilt SatrecArray)
+        jd: 1-D array-like of UTC Julian Dates
+
+    Returns:
+        tuple: (error codes, TEME positions in km), with shapes
+               (n_sats, n_times) and (n_sats, n_times, 3)
+    """
+    sat_array = satrecs if isinstance(satrecs, SatrecArray) else SatrecArray(list(satrecs))
+    whole, fraction = split_jd(np.atleast_1d(jd))
+    e, r, _ = sat_array.sgp4(whole, fraction)
+    return e, r
+
+
+def propagate_each(satrecs, jd):
+    """
+    Propagate every satellite at its own times.
+
+    Unlike `propagate`, which evaluates the full satellites x times grid, row i of
+    `jd` is only evaluated for satellite i. Each satellite is still propagated over
+    all its times in a single vectorized sgp4 call.
+
+    Args:
+        satrecs: List of Satrec objects
+        jd: Array-like of UTC Julian Dates with shape (n_sats,) or (n_sats, n_times)
+
+    Returns:
+        tuple: (error codes, TEME positions in km), with shapes
+               (n_sats, n_times) and (n_sats, n_times, 3)
+    """
+    jd = np.asarray(jd, dtype=np.float64)
+    if jd.ndim == 1:
+        jd = jd[:, None]
+    whole, fraction = split_jd(jd)
+    e = np.zeros(jd.shape, dtype=np.uint8)
+    r = np.full(jd.shape + (3,), np.nan)
+    for i, sat in enumerate(satrecs):
+        e[i], r[i], _ = sat.sgp4_array(whole[i], fraction[i])
+    return e, r
+
+
+def gmst(jd):
+    """
+    Greenwich Mean Sidereal Time (IAU 1982, as used by TEME) in radians.
+
+    Args:
+        jd: UTC Julian Dates, standing in for UT1 (they differ by less than 0.9 s)
+    """
+    t = (np.asarray(jd, dtype=np.float64) - 2451545.0) / 36525.0
+    seconds = (67310.54841 + (876600.0 * 3600 + 8640184.812866) * t
+               + 0.093104 * t**2 - 6.2e-6 * t**3)
+    return np.mod(np.radians(seconds / 240.0), 2 * np.pi)
+
+
+def teme_to_ecef(r, jd):
+    """
+    Rotate TEME positions to the Earth-fixed frame (polar motion is neglected).
+
+    Args:
+        r: Array of TEME positions in km, with shape (..., 3)
+        jd: UTC Julian Dates broadcastable to r.shape[:-1]
+
+    Returns:
+        tuple: (x, y, z) arrays in km
+    """
+    r = np.asarray(r, dtype=np.float64)
+    theta = gmst(jd)
+    cos_t, sin_t = np.cos(theta), np.sin(theta)
+    x = cos_t * r[..., 0] + sin_t * r[..., 1]
+    y = -sin_t * r[..., 0] + cos_t * r[..., 1]
+    return x, y, r[..., 2]
+
+
+def site_position(lat, lon, alt):
+    """Earth-fixed position (x, y, z) in km of a site given in degrees and km on the WGS84 ellipsoid."""
+    lat, lon = np.radians(lat), np.radians(lon)
+    n = EARTH_RADIUS_KM / np.sqrt(1 - EARTH_E2 * np.sin(lat)**2)
+    return ((n + alt) * np.cos(lat) * np.cos(lon),
+            (n + alt) * np.cos(lat) * np.sin(lon),
+            (n * (1 - EARTH_E2) + alt) * np.sin(lat))
+
+
+def look_angles(r, jd, lat, lon, alt):
+    """
+    Compute the azimuth and elevation of TEME positions seen from a site.
+
+    Args:
+        r: Array of TEME positions in km, with shape (..., 3)
+        jd: UTC Julian Dates broadcastable to r.shape[:-1]
+        lat, lon: Geodetic coordinates of the site in degrees
+        alt: Altitude of the site in km
+
+    Returns:
+        tuple: (azimuth [deg, from North through East], elevation [deg]) arrays
+    """
+    x, y, z = teme_to_ecef(r, jd)
+    site_x, site_y, site_z = site_position(lat, lon, alt)
+    dx, dy, dz = x - site_x, y - site_y, z - site_z
+    sin_lat, cos_lat = np.sin(np.radians(lat)), np.cos(np.radians(lat))
+    sin_lon, cos_lon = np.sin(np.radians(lon)), np.cos(np.radians(lon))
+    east = -sin_lon * dx + cos_lon * dy
+    north = -sin_lat * cos_lon * dx - sin_lat * sin_lon * dy + cos_lat * dz
+    up = cos_lat * cos_lon * dx + cos_lat * sin_lon * dy + sin_lat * dz
+    azimuth = np.mod(np.degrees(np.arctan2(east, north)), 360)
+    elevation = np.degrees(np.arctan2(up, np.hypot(east, north)))
+    return azimuth, elevation
+
+
+def teme_to_subpoint(r, jd):
+    """
+    Convert TEME positions to geodetic subpoints on the WGS84 ellipsoid.
+
+    Args:
+        r: Array of TEME positions in km, with shape (..., 3)
+        jd: UTC Julian Dates broadcastable to r.shape[:-1]
+
+    Returns:
+        tuple: (latitude [deg], longitude [deg], altitude [km]) arrays
+    """
+    x, y, z = teme_to_ecef(r, jd)
+
+    lon = np.arctan2(y, x)
+    p = np.hypot(x, y)
+    lat = np.arctan2(z, p * (1 - EARTH_E2))
+    for _ in range(3):
+        sin_lat = np.sin(lat)
+        n = EARTH_RADIUS_KM / np.sqrt(1 - EARTH_E2 * sin_lat**2)
+        lat = np.arctan2(z + n * EARTH_E2 * sin_lat, p)
+    sin_lat = np.sin(lat)
+    n = EARTH_RADIUS_KM / np.sqrt(1 - EARTH_E2 * sin_lat**2)
+    alt = p / np.cos(lat) - n
+
+    return np.degrees(lat), np.degrees(lon), alt
+
+
+def subpoints(satrecs, jd):
+    """
+    Compute geodetic subpoints of each satellite at its own times.
+
+    Args:
+        satrecs: List of Satrec objects
+        jd: Array-like of UTC Julian Dates with shape (n_sats,) or (n_sats, n_times)
+
+    Returns:
+        tuple: (latitude [deg], longitude [deg]) arrays with the shape of `jd`.
+               Entries where sgp4 reported an error are NaN.
+    """
+    jd = np.asarray(jd, dtype=np.float64)
+    e, r = propagate_each(satrecs, jd)
+    lat, lon, _ = teme_to_subpoint(r, jd.reshape(e.shape))
+    lat[e != 0] = np.nan
+    lon[e != 0] = np.nan
+    return lat.reshape(jd.shape), lon.reshape(jd.shape)
@@ -0,0 +1,183 @@
+import mmap
+import os
+import re
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+
+import numpy as np
+from sgp4.api import Satrec
+
+TLE_LINE_LENGTH = 69
+MAX_CACHED_CATALOGS = 8 # catalogs kept by TLECatalog.load (a BULK catalog is tens of MB with its Satrecs)
+# Sequence number the planner writes before each name in its TLE files ("0000 GALAXY 1")
+SEQUENCE_PREFIX = re.compile(r"^\d{4,} ")
+
+
+def _norad_id(line1):
+    """Extract the zero-padded NORAD ID from TLE line 1 (columns 3-7)."""
+    return line1[2:7].strip().zfill(5)
+
+
+class TLECatalog(Mapping):
+    """
+    Parsed TLE file indexed by NORAD ID.
+
+    The file is parsed once into fixed-width byte arrays (one row per object), and
+    sgp4 Satrec objects are built lazily and cached per object. The catalog behaves
+    like the dict returned by the former `read_tle_file`: `catalog[norad_id]` gives
+    the (line1, line2) tuple.
+
+    Use `TLECatalog.load` to get a catalog that is shared between calls and
+    reparsed only when the file changes (by mtime and size). At most
+    MAX_CACHED_CATALOGS are kept, the least recently used being dropped first,
+    and those of deleted files are dropped on the next load.
+    """
+
+    _cache = OrderedDict()
+    _cache_lock = threading.Lock()
+
+    def __init__(self, filename):
+        self.filename = os.path.abspath(filename)
+        stat = os.stat(self.filename)
+        self.signature = (stat.st_mtime_ns, stat.st_size)
+        with open(self.filename, "rb") as f:
+            names, lines1, lines2 = self._parse(f.read().splitlines())
+        self.names = np.array(names, dtype=object)
+        self.lines1 = np.array(lines1, dtype=f"S{TLE_LINE_LENGTH}")
+        self.lines2 = np.array(lines2, dtype=f"S{TLE_LINE_LENGTH}")
+        self.ids = np.array([_norad_id(l.decode()) for l in lines1], dtype="U5")
+        self._index = {norad_id: i for i, norad_id in enumerate(self.ids)}
+        self._satrecs = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _parse(raw_lines):
+        names, lines1, lines2 = [], [], []
+        i = 0
+        while i < len(raw_lines) - 1:
+            line1, line2 = raw_lines[i].strip(), raw_lines[i + 1].strip()
+            if line1.startswith(b"1 ") and line2.startswith(b"2 "):
+                prev = raw_lines[i - 1].strip() if i > 0 else b""
+                is_name = prev and not prev.startswith((b"1 ", b"2 "))
+                names.append(prev.decode(errors="replace") if is_name else "")
+                lines1.append(line1)
+                lines2.append(line2)
+                i += 2
+            else:
+                i += 1
+        return names, lines1, lines2
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Return the catalog for a file, reusing the cached one if the file is unchanged.
+
+        Args:
+            filename: Path to the TLE file
+
+        Returns:
+            TLECatalog: The (possibly cached) catalog
+        """
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        with cls._cache_lock:
+            catalog = cls._cache.get(path)
+            if catalog is None or catalog.signature != (stat.st_mtime_ns, stat.st_size):
+                catalog = cls(path)
+                cls._cache[path] = catalog
+            cls._cache.move_to_end(path)
+            # e.g. the TLE files of planner runs, deleted once the results are cached
+            for deleted in [cached for cached in cls._cache if not os.path.exists(cached)]:
+                del cls._cache[deleted]
+            while len(cls._cache) > MAX_CACHED_CATALOGS:
+                cls._cache.popitem(last=False)
+            return catalog
+
+    @staticmethod
+    def lookup(filename, norad_id):
+        """
+        Find a single object in a TLE file without parsing the rest of it.
+
+        The file is memory-mapped and searched for the line 1 of the requested
+        object, which is much cheaper than a full parse for multi-MB BULK catalogs.
+
+        Args:
+            filename: Path to the TLE file
+            norad_id: NORAD ID of the object (str or int)
+
+        Returns:
+            tuple: (name, line1, line2), or None if the object is not in the file
+        """
+        key = b"1 " + str(norad_id).strip().lstrip("0").rjust(5, "0").encode()
+        with open(filename, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if mm[:len(key)] == key:
+                    start = 0
+                else:
+                    start = mm.find(b"\n" + key) + 1
+                    if start == 0:
+                        return None
+                end1 = mm.find(b"\n", start)
+                end1 = len(mm) if end1 < 0 else end1
+                end2 = mm.find(b"\n", end1 + 1)
+                end2 = len(mm) if end2 < 0 else end2
+                line1 = mm[start:end1].strip().decode()
+                line2 = mm[end1 + 1:end2].strip().decode()
+                name = ""
+                if start > 0:
+                    name_start = mm.rfind(b"\n", 0, start - 1) + 1
+                    name = mm[name_start:start - 1].strip().decode(errors="replace")
+        if not line2.startswith("2 "):
+            return None
+        if name.startswith(("1 ", "2 ")):
+            name = ""
+        return name, line1, line2
+
+    def __getitem__(self, norad_id):
+        i = self._index[norad_id]
+        return self.lines1[i].decode(), self.lines2[i].decode()
+
+    def __contains__(self, norad_id):
+        return norad_id in self._index
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def __len__(self):
+        return len(self.ids)
+
+    def name(self, norad_id):
+        """Return the name line of an object (empty if the file has none)."""
+        return self.names[self._index[norad_id]]
+
+    def line0(self, norad_id):
+        """Return the name of an object as in a standard TLE line 0, without the planner's sequence number."""
+        return SEQUENCE_PREFIX.sub("", self.name(norad_id))
+
+    def satrec(self, norad_id):
+        """Return the cached sgp4 Satrec of an object, building it on first use."""
+        i = self._index[norad_id]
+        satrec = self._satrecs.get(i)
+        if satrec is None:
+            with self._lock:
+                satrec = self._satrecs.get(i)
+                if satrec is None:
+                    satrec = Satrec.twoline2rv(self.lines1[i].decode(), self.lines2[i].decode())
+                    self._satrecs[i] = satrec
+        return satrec
+
+    def satrecs(self, norad_ids=None):
+        """
+        Return the cached Satrec objects for several objects.
+
+        Args:
+            norad_ids: Iterable of NORAD IDs. If None, all objects in the catalog.
+
+        Returns:
+            list: Satrec objects, in the order of `norad_ids`
+        """
+        norad_ids = self.ids if norad_ids is None else norad_ids
+        return [self.satrec(norad_id) for norad_id in norad_ids]
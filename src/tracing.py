@@ -0,0 +1,157 @@
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_export_path = None
+_export_lock = threading.Lock()
+
+
+def configure(path=None):
+    """
+    Set the JSONL file the finished traces are appended to (None to disable the export).
+
+    Each line is a span, with the fields of an OpenTelemetry span: trace_id, span_id,
+    parent_id, name, start (Unix time), duration_ms and attributes.
+    """
+    global _export_path
+    _export_path = path or None
+
+
+def _export(spans):
+    if _export_path is None:
+        return
+    lines = "".join(json.dumps(span.to_dict(), default=str) + "\n" for span in spans)
+    try:
+        with _export_lock, open(_export_path, "a") as f:
+            f.write(lines)
+    except OSError as e:
+        logging.warning(f"Could not export the trace: {e}")
+
+
+class Span:
+    """
+    Timed operation of a trace.
+
+    A span without parent is the root of a trace: it collects the spans of the
+    trace as they finish and exports them all when it finishes itself. Spans
+    may finish in other threads (e.g. a stream read on the LLM event loop).
+    """
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "root", "start", "duration_ms",
+                 "attributes", "spans", "_t0")
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.root = parent.root if parent else self
+        self.start = time.time()
+        self.duration_ms = None
+        self.attributes = dict(attributes or {})
+        self.spans = [] if parent is None else None
+        self._t0 = time.perf_counter()
+
+    def set(self, **attributes):
+        """Add attributes to the span."""
+        self.attributes.update(attributes)
+
+    def elapsed_ms(self):
+        """Milliseconds since the span started."""
+        return (time.perf_counter() - self._t0) * 1000
+
+    def end(self):
+        """Finish the span. Finishing the root of a trace exports the trace."""
+        if self.duration_ms is not None:
+            return
+        self.duration_ms = self.elapsed_ms()
+        if self.root is self:
+            self.spans.append(self)
+            _export(self.spans)
+        elif self.root.duration_ms is None:
+            self.root.spans.append(self)
+        else:
+            _export([self]) # finished after its trace
+
+    def to_dict(self):
+        return {"trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+                "name": self.name, "start": self.start, "duration_ms": self.duration_ms,
+                "attributes": self.attributes}
+
+
+def start_span(name, **attributes):
+    """
+    Start a span, child of the current span, to be finished with `Span.end`.
+
+    Unlike `span`, it doesn't become the current span, so it can outlive the block
+    that started it (e.g. a streamed response consumed later).
+    """
+    return Span(name, parent=_current_span.get(), attributes=attributes)
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time a block as a span, child of the current span (or the root of a new trace).
+
+    Exceptions raised in the block are recorded in the "error" attribute.
+
+    Example:
+        with tracing.span("plot_passages", passages=len(passages)):
+            fig = planner.plot_passages(passages, tle_dict)
+    """
+    current = start_span(name, **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+def traced(name=None):
+    """Decorator timing each call of a function as a span (named after the function by default)."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def totals(root):
+    """Total duration in ms of the spans of a finished trace, by span name."""
+    durations = {}
+    for s in root.spans:
+        durations[s.name] = durations.get(s.name, 0.0) + s.duration_ms
+    return durations
+
+
+def breakdown(root):
+    """
+    List the spans of a finished trace in start order, for display.
+
+    Returns:
+        List[dict]: Name (indented by depth), start offset and duration in ms, and
+                    attributes of each span
+    """
+    depths = {root.span_id: 0}
+    rows = []
+    for s in sorted(root.spans, key=lambda s: (s.start, s is not root)):
+        depth = depths.get(s.parent_id, 0) + 1 if s is not root else 0
+        depths[s.span_id] = depth
+        rows.append({"span": "  " * depth + s.name,
+                     "start_ms": round((s.start - root.start) * 1000, 1),
+                     "duration_ms": round(s.duration_ms, 1),
+                     "attributes": json.dumps(s.attributes, default=str) if s.attributes else ""})
+    return rows
@@ -4,15 +4,17 @@ import re
 import sys
 import threading
 import queue
+import contextvars
+from concurrent.futures import Future
 import os
-import time
-from skyfield.api import load, EarthSatellite
-import plotly.graph_objects as go 
-from astropy.time import Time 
 import pandas as pd
 import datetime
 import logging
+import uuid
+from artifact_store import ArtifactRef
 
+MAX_TABLE_ROWS = 20 # tables longer than this are summarized in the LLM context
+MAX_CONTENT_CHARS = 8000 # longer message items are truncated in the LLM context
 
 
 def extract_valid_yaml(text):
@@ -48,89 +50,206 @@ def extract_valid_yaml(text):
 def stream_str(text):
     for word in text.split():
         yield word + " "
-        time.sleep(0.01)
 
 
-def stream_function_output(func, **kwargs):
+class _StdoutRouter:
+    """
+    Replacement for sys.stdout that sends each writer's output to its own sink.
+
+    The sink is taken from a context variable, so functions running in different
+    threads (e.g. planner runs of different sessions) write to different sinks.
+    Writes from contexts without a sink go to the original stdout.
+    """
+    def __init__(self, default):
+        self.default = default
+
+    def _target(self):
+        return _output_sink.get() or self.default
+
+    def write(self, message):
+        return self._target().write(message)
+
+    def flush(self):
+        self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.default, name)
+
+
+class _LineChannel:
+    """File-like sink that puts every complete line written to it in a queue."""
+    def __init__(self, output_queue):
+        self.queue = output_queue
+        self.buffer = ''
+
+    def write(self, message):
+        if not message:
+            return 0
+        self.buffer += message
+        if '\n' in self.buffer:
+            lines = self.buffer.split('\n')
+            for line in lines[:-1]:
+                self.queue.put(line + '\n')
+            self.buffer = lines[-1]
+        return len(message)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.buffer:
+            self.queue.put(self.buffer)
+            self.buffer = ''
+
+
+_output_sink = contextvars.ContextVar("output_sink", default=None)
+_router_lock = threading.Lock()
+_DONE = object()
+
+
+def _install_stdout_router():
+    with _router_lock:
+        if not isinstance(sys.stdout, _StdoutRouter):
+            sys.stdout = _StdoutRouter(sys.stdout)
+
+
+def stream_function_output(func, idle_interval=None, executor=None, **kwargs):
     """
     Stream the output of any function with the given keyword arguments.
+
+    What the function prints is captured only for the thread it runs in, so several
+    functions (e.g. planner runs of different sessions) can be streamed at the same
+    time in one process. The function starts right away, and its lines are yielded
+    as soon as they are written (or once consumed, if written before). The iterator
+    ends as soon as the function returns.
+
     Args:
         func: The function to execute
+        idle_interval: If given, yield an empty string whenever the function has not
+            written anything for this many seconds, so the consumer can do other work
+            (e.g. refresh partial results) while waiting
+        executor: If given, the function is submitted to this executor (e.g. a bounded
+            pool shared by all sessions) instead of running in a new thread
         **kwargs: All arguments are passed directly to the function
+
+    Returns:
+        FunctionOutput: Iterator over each line written by the function. It raises any
+            exception raised by the function, once its output is consumed.
     """
+    _install_stdout_router()
     output_queue = queue.Queue()
-    error_queue = queue.Queue()
-    
-    class StreamToQueue:
-        def __init__(self):
-            self.queue = output_queue
-        def write(self, message):
-            if message:
-                self.queue.put(message)
-        def flush(self):
-            if hasattr(self, 'buffer') and self.buffer:
-                self.queue.put(self.buffer)
-                self.buffer = ''
-
-    old_stdout = sys.stdout
-    sys.stdout = StreamToQueue()
+    errors = []
+    finished = Future()
 
     def run_function():
+        if not finished.set_running_or_notify_cancel():
+            output_queue.put(_DONE)  # cancelled while waiting for the executor
+            return
+        channel = _LineChannel(output_queue)
+        token = _output_sink.set(channel)
         try:
             func(**kwargs)  # Call the passed function with kwargs
         except Exception as e:
-            error_queue.put(e)
+            errors.append(e)
         finally:
-            sys.stdout.flush()
-            output_queue.put(None)
+            _output_sink.reset(token)
+            channel.close()
+            output_queue.put(_DONE)
+            finished.set_result(None)
 
-    thread = threading.Thread(target=run_function)
-    thread.start()
+    if executor is not None:
+        join = executor.submit(run_function).result
+    else:
+        thread = threading.Thread(target=run_function)
+        thread.start()
+        join = thread.join
+    return FunctionOutput(_iterate_output(output_queue, idle_interval, join, errors), finished)
 
-    buffer = ''
-    
+
+class FunctionOutput:
+    """
+    Iterator over the lines printed by a function started with `stream_function_output`.
+
+    Besides the lines, it gives control over the function itself, which keeps running
+    if its output is not consumed (e.g. when the script is stopped).
+    """
+    def __init__(self, lines, finished):
+        self._lines = lines
+        self._finished = finished
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._lines)
+
+    def cancel(self):
+        """Cancel the function if it has not started yet (returns True if it is cancelled)."""
+        return self._finished.cancel()
+
+    def add_done_callback(self, fn):
+        """Call `fn` (without arguments, in any thread) once the function has returned or was cancelled."""
+        self._finished.add_done_callback(lambda _: fn())
+
+
+def _iterate_output(output_queue, idle_interval, join, errors):
     while True:
         try:
-            # Check for exceptions first
-            try:
-                exc = error_queue.get_nowait()
-                sys.stdout = old_stdout
-                thread.join()
-                raise exc  # Re-raise exception in main thread
-            except queue.Empty:
-                pass
-
-            output = output_queue.get(timeout=1.0)
-            if output is None:
-                if buffer:
-                    yield buffer
-                break
-                
-            buffer += output
-            if '\n' in buffer:
-                lines = buffer.split('\n')
-                for line in lines[:-1]:
-                    yield line + '\n'
-                buffer = lines[-1]
-                
+            output = output_queue.get(timeout=idle_interval)
         except queue.Empty:
+            yield ''
             continue
+        if output is _DONE:
+            break
+        yield output
 
-    sys.stdout = old_stdout
-    thread.join()
+    join()
+    if errors:
+        raise errors[0]  # Re-raise exception in the calling thread
 
-    # Check one final time for exceptions after thread completion
-    try:
-        exc = error_queue.get_nowait()
-        raise exc
-    except queue.Empty:
-        pass
+
+def summarize_dataframe(df, max_rows=MAX_TABLE_ROWS):
+    """
+    Serializes a DataFrame for the LLM context, summarizing it if it is long.
+
+    Tables longer than max_rows are reduced to their first and last rows, plus the
+    row count and the min/mean/max of the numeric columns.
+
+    Args:
+        df (pd.DataFrame): The table to serialize.
+        max_rows (int): Maximum number of rows serialized in full.
+
+    Returns:
+        str: Markdown representation of the table (or of its summary).
+    """
+    if len(df) <= max_rows:
+        return df.to_markdown()
+    half = max(max_rows // 2, 1)
+    parts = [f"Table with {len(df)} rows and {len(df.columns)} columns. First and last {half} rows:",
+             df.head(half).to_markdown(), "...", df.tail(half).to_markdown()]
+    numeric = df.select_dtypes("number")
+    if not numeric.empty:
+        parts += ["Statistics of the numeric columns:", 
+                  numeric.agg(["min", "mean", "max"]).to_markdown()]
+    return "\n".join(parts)
+
+
+def truncate_text(text, max_chars=MAX_CONTENT_CHARS):
+    """Keep the beginning and the end of a text longer than max_chars."""
+    if len(text) <= max_chars:
+        return text
+    half = max_chars // 2
+    return f"{text[:half]}\n... [{len(text) - 2 * half} characters omitted] ...\n{text[-half:]}"
 
 
 def serialize_content(content, content_type):
     """
     Serializes message content based on its type.
 
+    DataFrames are summarized if they are long (see `summarize_dataframe`), and
+    other content is truncated to MAX_CONTENT_CHARS, so a single large tool output
+    cannot blow up the prompt.
+
     Args:
         content: The message content to serialize.
         content_type (str): The type of the content ('text', 'code', 'md', etc.).
@@ -138,14 +257,14 @@ def serialize_content(content, content_type):
     Returns:
         str: Serialized content as a string.
     """
-    if content_type == "text" or content_type == "md":
-        return str(content)
-    elif content_type == "code":
-        return f"```{content}```"
+    if isinstance(content, ArtifactRef):
+        return content.text
     elif isinstance(content, pd.DataFrame):
-        return content.to_markdown()
+        return summarize_dataframe(content)
+    elif content_type == "code":
+        return truncate_text(f"```{content}```")
     else:
-        return str(content)
+        return truncate_text(str(content))
     
 
 def format_date_for_filename(time_start: str) -> str:
@@ -178,14 +297,26 @@ def format_date_for_filename(time_start: str) -> str:
     return date_utc_with_underscore
 
 
-def display_message(msg, type: str = "text"):
+def display_message(msg, type: str = "text", key=None):
     """Display a message in Streamlit with different formatting options.
 
     Args:
         msg: The message to display
         type: Format type - 'text', 'code', 'md', ...
+        key: Element key of a figure. Identical figures (e.g. of a cached planner run)
+             need different keys to be shown together; if not given, the ID of the
+             artifact is used, or a new one
     """
-    if type == "code":
+    if isinstance(msg, ArtifactRef):
+        key = key or f"artifact_{msg.id}"
+        try:
+            msg = st.session_state["artifact_store"].get(msg)
+        except KeyError:
+            st.caption(f"{msg.summary} (no longer available)")
+            return
+    if hasattr(msg, "to_plotly_json"):
+        st.plotly_chart(msg, key=key or f"plot_{uuid.uuid4().hex}")
+    elif type == "code":
         st.code(msg)
     elif type == "md":
         st.markdown(msg)
@@ -193,15 +324,40 @@ def display_message(msg, type: str = "text"):
         st.write(msg)  # Default to text for unknown types
 
 
+def compact_message(msg, type="text"):
+    """
+    Get the compact form of a message item to keep in the session state.
+
+    Tables and figures are moved to the session's artifact store (if there is one)
+    and replaced by a reference. Exceptions are kept as text, so that they don't
+    retain their traceback frames.
+    """
+    if isinstance(msg, BaseException):
+        return f"{msg.__class__.__name__}: {msg}"
+    store = st.session_state.get("artifact_store")
+    if store is None:
+        return msg
+    if isinstance(msg, pd.DataFrame):
+        return store.put(msg, "table", summary=summarize_artifact(msg, type), text=serialize_content(msg, type))
+    if hasattr(msg, "to_plotly_json"):
+        # Figures are left out of the context (see app.EXCLUDE_TYPES): their summary
+        # stands in for the text, rather than the whole str(fig)
+        summary = summarize_artifact(msg, type)
+        return store.put(msg, "figure", summary=summary, text=summary)
+    return msg
+
+
 def save_message(msg, type: str = "text", role=None, append_to_last=True):
     """
     Save a message to the session state.
 
     Args:
-        msg: The message to save
+        msg: The message to save. Tables, figures and exceptions are saved in a compact
+            form (see `compact_message`).
         type: The type of message - 'text', 'code', 'md', or None (unspecified)
         append_to_last: If True, it will append the message to the last message, as an array of strings (same with the type). If False, it will replace the content.
     """
+    msg = compact_message(msg, type)
     if role:
         st.session_state.messages.append({"role": role, "type": [type], "content": [msg]})
     else:
@@ -228,28 +384,84 @@ def display_and_save(msg, type="text", role=None, append_to_last=True):
                     message, as an array of strings (same with the type). If False, 
                     it will replace the content.
     """
-    display_message(msg, type)
-    save_message(msg, type, role, append_to_last)
-
-
-def display_messages():
-    """Function to display chat messages"""
-    for message in st.session_state.messages:
-        if message["role"] == "tool":
-            with st.status(label=message["label"], state=message["state"]):
-                if "content" in message:
-                    if isinstance(message["content"], list):
-                        for content in message["content"]:
-                            display_message(content)
-                    else:
-                        display_message(message["content"])
+    compact = compact_message(msg, type)
+    # The figure gets the key of its artifact, the same it has when replayed
+    display_message(msg, type, key=f"artifact_{compact.id}" if isinstance(compact, ArtifactRef) else None)
+    save_message(compact, type, role, append_to_last)
+
+
+def is_artifact(content, type="text"):
+    """Check whether a message item is a heavy artifact (table or figure) rather than text."""
+    return (type == "plot" or isinstance(content, (pd.DataFrame, ArtifactRef))
+            or hasattr(content, "to_plotly_json"))
+
+
+def summarize_artifact(content, type="text"):
+    """Describe a table or figure in one line, for collapsed messages."""
+    if isinstance(content, ArtifactRef):
+        return content.summary
+    if isinstance(content, pd.DataFrame):
+        return f"Table with {len(content)} rows and {len(content.columns)} columns"
+    n_traces = len(getattr(content, "data", ()))
+    return f"Figure with {n_traces} traces"
+
+
+def display_collapsed(content, type, key):
+    """Display the summary of an artifact, and the artifact itself only once it is expanded."""
+    st.caption(summarize_artifact(content, type))
+    if st.toggle("Show", key=key):
+        display_message(content, type, key=f"{key}_content")
+
+
+def message_items(message):
+    """Get the (content, type) items of a message, whose content may be a single value or a list."""
+    if "content" not in message:
+        return []
+    contents = message["content"] if isinstance(message["content"], list) else [message["content"]]
+    types = message.get("type") or []
+    types = types if isinstance(types, list) else [types]
+    return [(content, types[j] if j < len(types) else "text") for j, content in enumerate(contents)]
+
+
+# Icons of the finished st.status states, used to replay tool messages as plain expanders
+STATUS_ICONS = {"complete": ":material/check:", "error": ":material/error:"}
+
+
+def display_messages(recent_turns=2):
+    """
+    Function to display chat messages.
+
+    The tables and figures of the messages before the last `recent_turns` user turns
+    are collapsed into one-line summaries, and only rendered when expanded, so the
+    cost of a rerun doesn't grow with the length of the conversation. Finished tool
+    messages are replayed as expanders, which look the same as st.status containers
+    but don't pause the script when created.
+
+    Args:
+        recent_turns: Number of recent user turns displayed in full (None for all)
+    """
+    messages = st.session_state.messages
+    user_indices = [i for i, message in enumerate(messages) if message["role"] == "user"]
+    if recent_turns is None or len(user_indices) <= recent_turns:
+        first_recent = 0
+    else:
+        first_recent = user_indices[-recent_turns] if recent_turns > 0 else len(messages)
+
+    for i, message in enumerate(messages):
+        if message["role"] == "tool" and message.get("state") in STATUS_ICONS:
+            container = st.expander(message["label"], icon=STATUS_ICONS[message["state"]])
+        elif message["role"] == "tool":
+            # A tool message without status was interrupted before its tool finished
+            container = st.status(label=message.get("label", "Tool call interrupted"),
+                                  state=message.get("state", "error"))
         else:
-            with st.chat_message(message["role"]):
-                if isinstance(message["content"], list):
-                    for content in message["content"]:
-                        display_message(content)
+            container = st.chat_message(message["role"])
+        with container:
+            for j, (content, type) in enumerate(message_items(message)):
+                if i < first_recent and is_artifact(content, type):
+                    display_collapsed(content, type, key=f"expand_{i}_{j}")
                 else:
-                    display_message(message["content"])
+                    display_message(content, key=f"message_{i}_{j}")
 
 
 def try_convert_number(val):
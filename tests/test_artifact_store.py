@@ -0,0 +1,53 @@
+import os
+import sys
+
+import pandas as pd
+import plotly.graph_objects as go
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+from artifact_store import ArtifactStore
+
+
+def test_artifacts_are_reloaded_from_disk(tmp_path):
+    store = ArtifactStore(str(tmp_path), max_bytes=1)
+    table = pd.DataFrame({"ID": ["14158", "23016"], "el0 [deg]": [60.3, 53.7]})
+    fig = go.Figure(go.Scatter(x=[1, 2], y=[3, 4]))
+    table_ref = store.put(table, "table", summary="Table with 2 rows and 2 columns")
+    fig_ref = store.put(fig, "figure")
+    # Only the last artifact fits in memory
+    assert store.metrics()["in_memory"] == 1
+    pd.testing.assert_frame_equal(store.get(table_ref), table)
+    assert store.get(fig_ref).data[0].y == (3, 4)
+    assert not any(name.endswith(".pkl") for name in os.listdir(tmp_path))
+
+
+def test_mixed_type_columns_are_stored_as_text(tmp_path):
+    store = ArtifactStore(str(tmp_path), max_bytes=0)
+    ref = store.put(pd.DataFrame({"value": [1, "a"]}), "table")
+    store._memory.clear()
+    assert store.get(ref)["value"].tolist() == ["1", "a"]
+
+
+def test_missing_artifacts_are_fetched_with_the_fallback(tmp_path):
+    source = ArtifactStore(str(tmp_path / "source"))
+    ref = source.put(pd.DataFrame({"n": [1]}), "table")
+    with open(os.path.join(source.directory, f"{ref.id}.parquet"), "rb") as f:
+        data = f.read()
+    store = ArtifactStore(str(tmp_path / "restored"), fallback=lambda artifact_id: ("parquet", data))
+    assert store.get(ref)["n"].tolist() == [1]
+
+    store = ArtifactStore(str(tmp_path / "unsafe"), fallback=lambda artifact_id: ("pkl", data))
+    with pytest.raises(ValueError):
+        store.get(ref)
+    with pytest.raises(KeyError):
+        ArtifactStore(str(tmp_path / "empty")).get(ref)
+
+
+def test_clear_drops_every_artifact(tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    ref = store.put(pd.DataFrame({"n": [1]}), "table")
+    store.clear()
+    assert store.metrics()["artifacts"] == 0
+    with pytest.raises(KeyError):
+        store.get(ref)
@@ -0,0 +1,22 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+from artifact_store import ArtifactRef
+from chat_store import decode_message, encode_message
+
+
+def test_messages_keep_references_to_their_artifacts():
+    ref = ArtifactRef("abc", "table", summary="Table with 1 rows", text="| n |")
+    message = {"role": "assistant", "type": ["text", "text"], "content": ["Passages:", ref],
+               "_serialized": "cached"}
+    data = encode_message(message)
+    assert "_serialized" not in data
+    decoded = decode_message(data)
+    assert decoded["content"][0] == "Passages:"
+    assert (decoded["content"][1].id, decoded["content"][1].text) == ("abc", "| n |")
+
+
+def test_other_items_are_stored_as_text():
+    data = encode_message({"role": "tool", "content": [ValueError("no passages")], "label": "Error"})
+    assert data == {"role": "tool", "content": ["no passages"], "label": "Error"}
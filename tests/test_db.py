@@ -0,0 +1,231 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+from sqlalchemy import DateTime, create_engine, event, inspect
+from sqlalchemy.pool import QueuePool
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+import db
+from db import (SCHEDULE_KEY, Base, QueryCache, first_keyword, is_read_statement, normalize_sql,
+                passages_to_observations, stream_query, upsert_observations)
+from passages import read_passages
+from tle_catalog import TLECatalog
+
+MOCK_PASSAGES = os.path.join(ROOT, "mock_data", "2024_11_15__Passage_Galaxy.txt")
+MOCK_TLE = os.path.join(ROOT, "mock_data", "2024_11_15__TLE_Galaxy.txt")
+USER_DATA = {"organization": "UA", "username": "space4", "user_unique_id": "1", "user_project": "GEO"}
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """SQLite engine with a table of 10 rows, and a pool that counts the connections in use."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'obs.db'}", poolclass=QueuePool)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE t (n INTEGER)")
+        conn.exec_driver_sql("INSERT INTO t VALUES " + ",".join(f"({i})" for i in range(10)))
+    return engine
+
+
+@pytest.mark.parametrize("psql", [
+    "SELECT * FROM observations",
+    "  select count(*) from observations;",
+    "-- scheduled tonight\nSELECT * FROM observations",
+    "/* by telescope */ (SELECT telescope FROM observations)",
+    "WITH t AS (SELECT 1) SELECT * FROM t",
+    "SHOW timezone",
+    "EXPLAIN SELECT * FROM observations",
+    "TABLE observations",
+    "VALUES (1)",
+])
+def test_read_statements(psql):
+    assert is_read_statement(psql)
+
+
+@pytest.mark.parametrize("psql", [
+    "INSERT INTO observations (designation) VALUES ('1')",
+    "update observations SET notes = 'x'",
+    "-- SELECT\nDELETE FROM observations",
+    "/* SELECT */ DROP TABLE observations",
+    "",
+])
+def test_write_statements(psql):
+    assert not is_read_statement(psql)
+
+
+def test_first_keyword_skips_comments_and_parentheses():
+    assert first_keyword("/* a */ -- b\n((select 1))") == "select"
+
+
+def chunk_sizes(engine, psql, **kwargs):
+    chunks = list(stream_query(engine, psql, **kwargs))
+    return [len(chunk) for chunk in chunks], chunks[-1].attrs.get("truncated", False)
+
+
+@pytest.mark.parametrize("max_rows, sizes, truncated", [
+    (None, [4, 4, 2], False),
+    (3, [3], True),
+    (4, [4], True), # the limit falls at the end of a chunk
+    (6, [4, 2], True),
+    (10, [4, 4, 2], False), # exactly all the rows
+    (11, [4, 4, 2], False),
+])
+def test_rows_are_fetched_in_chunks_up_to_max_rows(engine, max_rows, sizes, truncated):
+    assert chunk_sizes(engine, "SELECT n FROM t ORDER BY n", chunk_size=4, max_rows=max_rows) == (sizes, truncated)
+
+
+def test_empty_results_keep_their_columns(engine):
+    (chunk,) = stream_query(engine, "SELECT n FROM t WHERE n > 100")
+    assert chunk.empty and list(chunk.columns) == ["n"]
+
+
+def test_reads_are_read_only_and_streamed(engine):
+    options = []
+    event.listen(engine, "before_cursor_execute",
+                 lambda conn, *args: options.append(dict(conn.get_execution_options())))
+    list(stream_query(engine, "SELECT n FROM t", chunk_size=4))
+    list(stream_query(engine, "EXPLAIN SELECT n FROM t"))
+    list(stream_query(engine, "DELETE FROM t WHERE n = 0"))
+    assert options[0] == {"postgresql_readonly": True, "stream_results": True, "max_row_buffer": 4}
+    # PostgreSQL can't run SHOW or EXPLAIN through a server-side cursor
+    assert options[1] == {"postgresql_readonly": True}
+    assert options[2] == {}
+
+
+def test_writes_report_the_rows_affected(engine):
+    (chunk,) = stream_query(engine, "DELETE FROM t WHERE n < 3")
+    assert chunk["rows_affected"].tolist() == [3]
+
+
+def test_connection_is_released_when_the_consumer_stops_early(engine):
+    chunks = stream_query(engine, "SELECT n FROM t", chunk_size=2)
+    next(chunks)
+    assert engine.pool.checkedout() == 1
+    chunks.close()
+    assert engine.pool.checkedout() == 0
+
+
+def test_statement_timeout_and_utc_are_set_on_every_connection(monkeypatch):
+    created = {}
+    monkeypatch.setattr(db, "create_engine", lambda url, **kwargs: created.update(kwargs))
+    db.create_db_engine("postgresql+psycopg2://u:p@h/db", pool_size=3, statement_timeout=2.5)
+    assert created["connect_args"]["options"] == "-c statement_timeout=2500 -c timezone=UTC"
+    assert (created["pool_size"], created["pool_pre_ping"]) == (3, True)
+
+
+def test_normalize_sql_keeps_string_literals():
+    assert normalize_sql("SELECT *\n  FROM  t WHERE notes = 'a  b';") == "SELECT * FROM t WHERE notes = 'a  b'"
+
+
+def test_cached_results_are_shared_by_equivalent_queries():
+    cache = QueryCache()
+    result = pd.DataFrame({"n": [1]})
+    assert cache.get("SELECT * FROM t WHERE id = %s", [1]) == (None, 0)
+    cache.put("SELECT * FROM t WHERE id = %s", [1], result, 0)
+    assert cache.get("SELECT *  FROM t\nWHERE id = %s;", [1])[0] is result
+    assert cache.get("SELECT * FROM t WHERE id = %s", [2])[0] is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_results_expire_after_the_ttl():
+    cache = QueryCache(ttl=-1)
+    cache.put("SELECT 1", None, pd.DataFrame(), 0)
+    assert cache.get("SELECT 1")[0] is None
+
+
+def test_least_recently_used_results_are_dropped():
+    cache = QueryCache(max_entries=2)
+    for psql in ("SELECT 1", "SELECT 2"):
+        cache.put(psql, None, pd.DataFrame(), 0)
+    cache.get("SELECT 1")
+    cache.put("SELECT 3", None, pd.DataFrame(), 0)
+    assert cache.get("SELECT 2")[0] is None
+    assert cache.get("SELECT 1")[0] is not None
+
+
+def test_a_write_invalidates_the_results():
+    cache = QueryCache()
+    cache.put("SELECT 1", None, pd.DataFrame(), 0)
+    cache.invalidate()
+    assert cache.get("SELECT 1") == (None, 1)
+
+
+def test_results_read_before_a_write_are_not_stored():
+    cache = QueryCache()
+    _, version = cache.get("SELECT 1")
+    cache.invalidate() # written while the query ran
+    cache.put("SELECT 1", None, pd.DataFrame(), version)
+    assert cache.get("SELECT 1")[0] is None
+
+
+def test_observation_times_are_typed_and_range_queries_indexed():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    inspector = inspect(engine)
+    columns = {c["name"]: c["type"] for c in inspector.get_columns("observations")}
+    assert all(isinstance(columns[name], DateTime) for name in db.TIME_COLUMNS)
+    indexes = {tuple(index["column_names"]) for index in inspector.get_indexes("observations")}
+    assert {("username", "start_time"), ("telescope", "start_time")} <= indexes
+
+
+def test_missing_tables_are_not_migrated():
+    engine = create_engine("sqlite://")
+    db.migrate_observations(engine)
+    assert not inspect(engine).has_table("observations")
+
+
+def test_schedule_index_is_checked_once_per_engine(monkeypatch):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    checks = []
+    monkeypatch.setattr(db, "has_schedule_index", lambda engine: checks.append(engine) or True)
+    assert db.schedule_index_ready(engine)
+    assert db.schedule_index_ready(engine)
+    assert len(checks) == 1
+
+
+def test_unmigrated_tables_are_checked_again():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE observations (obsid INTEGER PRIMARY KEY)")
+    assert not db.schedule_index_ready(engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DROP TABLE observations")
+    Base.metadata.create_all(engine)
+    assert db.schedule_index_ready(engine)
+
+
+def test_passages_are_mapped_to_observations():
+    passages = read_passages(MOCK_PASSAGES).head(2)
+    records = passages_to_observations(passages, TLECatalog(MOCK_TLE), "RAPTORS", USER_DATA, prep_minutes=5)
+    assert [r["norad_id"] for r in records] == ["14158", "23016"]
+    assert [r["designation"] for r in records] == ["GALAXY_1", "GALAXY_1R"]
+    # Line 0 of the TLE, without the sequence number of the planner's file
+    assert [r["tle_line0"] for r in records] == ["GALAXY 1", "GALAXY 1R"]
+    assert records[0]["tle_line1"].startswith("1 14158U")
+    assert (records[0]["start_time"] - records[0]["prep_time"]).total_seconds() == 300
+    assert records[0]["filter"] == "gprime;rprime;iprime"
+    assert records[0]["username"] == "space4"
+
+
+def test_objects_with_the_same_name_are_scheduled_apart(tmp_path):
+    # Two pieces of debris with the same name, passing at the same time
+    tle_lines = open(MOCK_TLE).read().splitlines()[:6]
+    tle_lines[0], tle_lines[3] = "0000 DEB", "0001 DEB"
+    tle_file = tmp_path / "tle.txt"
+    tle_file.write_text("\n".join(tle_lines) + "\n")
+    passages = read_passages(MOCK_PASSAGES).head(2).assign(name="DEB")
+    passages["t0 [JD]"] = passages["t0 [JD]"].iloc[0]
+    records = passages_to_observations(passages, TLECatalog(str(tle_file)), "RAPTORS", USER_DATA)
+    assert [r["tle_line0"] for r in records] == ["DEB", "DEB"]
+    assert len({tuple(r[name] for name in SCHEDULE_KEY) for r in records}) == 2
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    assert upsert_observations(engine, records) == 2
+    assert upsert_observations(engine, records) == 2 # scheduled again: updated
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql("SELECT norad_id, designation FROM observations ORDER BY norad_id").all()
+    assert rows == [("14158", "DEB"), ("23016", "DEB")]
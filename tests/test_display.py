@@ -0,0 +1,42 @@
+import os
+
+from streamlit.testing.v1 import AppTest
+
+SRC = os.path.join(os.path.dirname(__file__), "..", "src")
+
+
+def show_the_same_figure_twice(src, directory, store):
+    import sys
+    sys.path.insert(0, src)
+    import plotly.graph_objects as go
+    import streamlit as st
+    import utils
+    from artifact_store import ArtifactStore
+
+    if "messages" not in st.session_state:
+        st.session_state.messages = []
+        if store:
+            st.session_state.artifact_store = ArtifactStore(directory)
+    # e.g. the maps of two planner runs with the same configuration (the second one cached)
+    fig = go.Figure(go.Scatter(x=[1, 2], y=[3, 4]))
+    utils.display_messages()
+    with st.chat_message("assistant"):
+        utils.display_and_save(fig, type="plot", role="assistant")
+
+
+def run_twice(tmp_path, store):
+    app = AppTest.from_function(show_the_same_figure_twice, args=(SRC, str(tmp_path), store))
+    app.run()
+    assert not app.exception
+    # The first figure is now replayed from the history while the second one is drawn
+    app.run()
+    assert not app.exception
+    return app
+
+
+def test_identical_figures_in_the_store_can_be_shown_together(tmp_path):
+    assert len(run_twice(tmp_path, store=True).get("plotly_chart")) == 2
+
+
+def test_identical_figures_without_store_can_be_shown_together(tmp_path):
+    assert len(run_twice(tmp_path, store=False).get("plotly_chart")) == 2
@@ -0,0 +1,112 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import intents
+
+
+def window(prompt, now):
+    parameters = intents.extract_planner_call(prompt, now=now)
+    assert parameters is not None
+    return parameters[1], parameters[2]
+
+
+def test_tonight_in_the_afternoon_starts_at_dusk():
+    assert window("Which INTELSAT satellites are visible tonight?", datetime(2024, 6, 1, 15, 0)) == \
+        ("TimeStart:2024-06-01 18:00:00", "SearchTime:12;00")
+
+
+def test_tonight_in_the_evening_searches_until_dawn():
+    assert window("Which INTELSAT satellites are visible tonight?", datetime(2024, 6, 1, 22, 0)) == \
+        ("TimeStart:Now", "SearchTime:08;00")
+
+
+def test_tonight_before_dawn_is_the_current_night():
+    assert window("Which INTELSAT satellites are visible tonight?", datetime(2024, 6, 2, 2, 0)) == \
+        ("TimeStart:Now", "SearchTime:04;00")
+
+
+def test_tonight_in_the_morning_is_the_coming_night():
+    assert window("Which INTELSAT satellites are visible tonight?", datetime(2024, 6, 2, 7, 0)) == \
+        ("TimeStart:2024-06-02 18:00:00", "SearchTime:12;00")
+
+
+def test_tomorrow_night_before_dawn_is_the_coming_night():
+    assert window("Which INTELSAT satellites are visible tomorrow night?", datetime(2024, 6, 2, 2, 0)) == \
+        ("TimeStart:2024-06-02 18:00:00", "SearchTime:12;00")
+
+
+@pytest.mark.parametrize("prompt, search_time", [
+    ("Which STARLINK satellites pass overhead in the next 3 hours?", "SearchTime:03;00"),
+    ("Which STARLINK satellites pass overhead in the next 400 hours?", "SearchTime:24;00"),
+    ("Which STARLINK satellites pass overhead in the next 30 days?", "SearchTime:24;00"),
+    ("Which STARLINK satellites pass overhead in the next 0 hours?", "SearchTime:01;00"),
+])
+def test_next_hours_are_capped(prompt, search_time):
+    assert window(prompt, datetime(2024, 6, 1, 12, 0)) == ("TimeStart:Now", search_time)
+
+
+def test_default_time_is_local_to_the_observatory():
+    local = datetime.now(intents.SITE_TZ)
+    assert local.utcoffset() == timedelta(hours=-7)
+    time_start, _ = window("Which INTELSAT satellites are visible tomorrow?", None)
+    assert time_start == (local + timedelta(days=1)).strftime("TimeStart:%Y-%m-%d 00:00:00")
+
+
+@pytest.mark.parametrize("prompt", [
+    "Is GOES-16 visible tonight?",
+    "Is GOES 16 visible tonight?",
+    "Is goes16 visible tonight?",
+    "Is GOES_16 visible tonight?",
+])
+def test_designators_are_named_as_in_the_catalogs(prompt):
+    parameters = intents.extract_planner_call(prompt, now=datetime(2024, 6, 1, 12, 0))
+    assert parameters[0] == "TLEFile:GEO"
+    assert parameters[-1] == "NameCriteria:GOES 16"
+
+
+def test_debris_of_a_satellite_are_matched_by_its_name():
+    parameters = intents.extract_planner_call("Which IRIDIUM 33 debris are visible in the next 3 hours?",
+                                              now=datetime(2024, 6, 1, 12, 0))
+    assert parameters[-1] == "NameCriteria:IRIDIUM 33"
+
+
+@pytest.mark.parametrize("prompt", [
+    "Are STARLINK 5 satellites visible tonight?",
+    "Is GALAXY 17 or GALAXY 18 visible tonight?",
+    "Are GALAXY 17 and GALAXY 18 visible tonight?",
+])
+def test_counts_and_several_satellites_go_to_the_llm(prompt):
+    assert intents.extract_planner_call(prompt, now=datetime(2024, 6, 1, 12, 0)) is None
+
+
+# Parameters extracted from each starter prompt, None if it goes to the LLM
+STARTERS = {
+    "🛰️ Is there any GEO satellite from the GALAXY constellation visible in the next 24 hours with a magnitude greater than 17?": None,
+    "📡 Can you schedule an observation of the INTELSAT satellites tomorrow night?": None,
+    "🛰️ Which INTELSAT satellites are visible tomorrow night?":
+        ["TLEFile:GEO", "TimeStart:2024-06-02 18:00:00", "SearchTime:12;00", "NameCriteria:INTELSAT"],
+    "📅 Do I have any observations scheduled for tonight?": None,
+}
+
+
+def starters():
+    """The active starter prompts, as the app loads and sends them."""
+    with open(os.path.join(os.path.dirname(__file__), "..", "src", "prompts", "starters.md")) as f:
+        return [line.strip() for line in f if not line.startswith("#") and line.strip()]
+
+
+def test_every_starter_has_an_expected_result():
+    assert sorted(starters()) == sorted(STARTERS)
+
+
+@pytest.mark.parametrize("prompt", sorted(STARTERS))
+def test_starters(prompt):
+    assert intents.extract_planner_call(prompt, now=datetime(2024, 6, 1, 12, 0)) == STARTERS[prompt]
+
+
+def test_some_starter_is_handled_locally():
+    assert any(parameters is not None for parameters in STARTERS.values())
@@ -0,0 +1,308 @@
+import asyncio
+import gc
+import json
+import os
+import sys
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import openai
+import pytest
+from openai.types.chat import ChatCompletionChunk
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import lm_hackers
+
+PROMPTS = os.path.join(os.path.dirname(__file__), "..", "src", "prompts")
+
+COMPLETION = {"id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+              "choices": [{"index": 0, "finish_reason": "stop",
+                           "message": {"role": "assistant", "content": "Clear skies"}}],
+              "usage": {"prompt_tokens": 10, "completion_tokens": 2, "total_tokens": 12}}
+CHUNK = {"id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o",
+         "choices": [{"index": 0, "delta": {"content": "Clear"}, "finish_reason": None}]}
+
+
+class StubLLM(BaseHTTPRequestHandler):
+    """OpenAI-compatible endpoint answering with the next queued status."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server.requests.append(request)
+        status = server.statuses.pop(0) if server.statuses else 200
+        if status != 200:
+            self.reply(status, {"error": {"message": f"stub error {status}", "type": "server_error"}})
+        elif request.get("stream"):
+            self.stream()
+        else:
+            self.reply(200, COMPLETION)
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def stream(self):
+        """Send a chunk, then keep the response open until the client goes away."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        try:
+            self.wfile.write(f"data: {json.dumps(CHUNK)}\n\n".encode())
+            self.wfile.flush()
+            self.server.streaming.set()
+            for _ in range(500):
+                if self.server.done.wait(0.02):
+                    return
+                self.wfile.write(b": keep-alive\n\n")
+                self.wfile.flush()
+        except OSError:
+            self.server.disconnected.set()
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubLLM)
+    server.daemon_threads = True
+    server.requests, server.statuses = [], []
+    server.streaming, server.disconnected, server.done = threading.Event(), threading.Event(), threading.Event()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_port}/v1")
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setattr(lm_hackers, "_async_client", None)
+    yield server
+    server.done.set()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    """The backoff delays drawn by askgpt, which doesn't actually wait."""
+    drawn = []
+
+    def backoff_delay(attempt, **kwargs):
+        drawn.append((attempt, lm_hackers.backoff_delay.__wrapped__(attempt, **kwargs)))
+        return 0
+
+    backoff_delay.__wrapped__ = lm_hackers.backoff_delay
+    monkeypatch.setattr(lm_hackers, "backoff_delay", backoff_delay)
+    return drawn
+
+
+@pytest.fixture
+def futures(monkeypatch):
+    """The futures of the requests submitted to the shared loop."""
+    submitted = []
+    run_coroutine_threadsafe = asyncio.run_coroutine_threadsafe
+
+    def submit(coro, loop):
+        submitted.append(run_coroutine_threadsafe(coro, loop))
+        return submitted[-1]
+
+    monkeypatch.setattr(lm_hackers.asyncio, "run_coroutine_threadsafe", submit)
+    return submitted
+
+
+def test_messages_without_context_are_not_shared():
+    first = lm_hackers.build_messages("Is it clear tonight?", system="You plan observations")
+    first.append({"role": "assistant", "content": "Clear skies"})
+    assert lm_hackers.build_messages("And tomorrow?") == [{"role": "user", "content": "And tomorrow?"}]
+    assert lm_hackers.build_messages("And tomorrow?", context=None) == lm_hackers.build_messages("And tomorrow?", context=[])
+
+
+@pytest.mark.parametrize("attempt, bound", [(0, 0.5), (1, 1.0), (3, 4.0), (5, 8.0), (10, 8.0)])
+def test_backoff_delay_is_bounded(attempt, bound):
+    delays = [lm_hackers.backoff_delay(attempt) for _ in range(200)]
+    assert all(0 <= delay <= bound for delay in delays)
+    assert max(delays) > bound / 2
+
+
+def test_rate_limits_and_server_errors_are_retried(llm, delays):
+    llm.statuses[:] = [429, 500, 503]
+    compl = lm_hackers.askgpt("Is it clear tonight?", max_retries=3)
+    assert compl.choices[0].message.content == "Clear skies"
+    assert len(llm.requests) == 4
+    assert [attempt for attempt, _ in delays] == [0, 1, 2]
+    assert all(0 <= delay <= 0.5 * 2 ** attempt for attempt, delay in delays)
+
+
+def test_the_last_error_is_raised_after_the_retries(llm, delays):
+    llm.statuses[:] = [503, 429, 429]
+    with pytest.raises(openai.RateLimitError):
+        lm_hackers.askgpt("Is it clear tonight?", max_retries=2)
+    assert len(llm.requests) == 3
+    assert len(delays) == 2
+
+
+def test_client_errors_are_not_retried(llm, delays):
+    llm.statuses[:] = [400]
+    with pytest.raises(openai.BadRequestError):
+        lm_hackers.askgpt("Is it clear tonight?")
+    assert len(llm.requests) == 1
+    assert delays == []
+
+
+def test_closing_the_stream_cancels_the_request(llm, futures):
+    stream = lm_hackers.askgpt("Is it clear tonight?", stream=True)
+    assert next(stream).choices[0].delta.content == "Clear"
+    (future,) = futures
+    assert not future.done()
+    stream.close()
+    assert future.cancelled()
+    assert llm.disconnected.wait(5)
+
+
+def test_dropping_a_stream_that_was_never_iterated_cancels_the_request(llm, futures):
+    stream = lm_hackers.askgpt("Is it clear tonight?", stream=True)
+    assert llm.streaming.wait(5)
+    (future,) = futures
+    del stream
+    gc.collect()
+    assert future.cancelled()
+    assert llm.disconnected.wait(5)
+
+
+def turn(i, tool=False):
+    """Messages of a conversation turn, with an optional tool call and its result."""
+    messages = [{"role": "user", "content": f"prompt {i}"}]
+    if tool:
+        messages += [{"role": "assistant", "content": "", "tool_calls": [{"id": f"call_{i}"}]},
+                     {"role": "tool", "tool_call_id": f"call_{i}", "content": f"result {i}"}]
+    return messages + [{"role": "assistant", "content": f"answer {i}"}]
+
+
+def test_context_within_the_budget_is_kept():
+    messages = turn(0) + turn(1)
+    assert lm_hackers.fit_token_budget(messages, [10] * 4, 40) == messages
+
+
+def test_the_oldest_turns_are_dropped_first():
+    messages = turn(0, tool=True) + turn(1) + turn(2)
+    tokens = [10] * len(messages)
+    # One token over the budget drops the whole first turn, with its tool call and result
+    assert lm_hackers.fit_token_budget(messages, tokens, 79) == turn(1) + turn(2)
+    assert lm_hackers.fit_token_budget(messages, tokens, 39) == turn(2)
+
+
+def test_the_last_turn_is_kept_over_the_budget():
+    messages = turn(0) + turn(1, tool=True)
+    assert lm_hackers.fit_token_budget(messages, [10] * len(messages), 5) == turn(1, tool=True)
+
+
+def test_messages_before_the_first_turn_are_kept():
+    system = {"role": "system", "content": "You plan observations"}
+    messages = [system] + turn(0) + turn(1)
+    assert lm_hackers.fit_token_budget(messages, [10] * len(messages), 30) == [system] + turn(1)
+
+
+def test_the_system_prompt_and_demonstrations_are_outside_the_budget(monkeypatch):
+    monkeypatch.setattr(lm_hackers, "_encoding", False) # 4 characters per token
+    demonstrations = turn("demo", tool=True)
+    history = turn(0) + turn(1)
+    for message in history:
+        message["content"] = "x" * 400
+    context = lm_hackers.prepare_context_messages(history, max_tokens=250)
+    assert context == [{"role": m["role"], "content": m["content"]} for m in history[2:]]
+    messages = lm_hackers.build_messages("prompt 2", system="You plan observations",
+                                         context=demonstrations + context)
+    assert messages[0] == {"role": "system", "content": "You plan observations"}
+    assert messages[1:1 + len(demonstrations)] == demonstrations
+    assert messages[-1] == {"role": "user", "content": "prompt 2"}
+
+
+def chunk(content=None, tool_calls=None, finish_reason=None, usage=None):
+    """Streamed chunk, as parsed by the OpenAI client."""
+    choices = [] if usage else [{"index": 0, "finish_reason": finish_reason,
+                                 "delta": {"content": content, "tool_calls": tool_calls}}]
+    return ChatCompletionChunk.model_validate(
+        {"id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o",
+         "choices": choices, "usage": usage})
+
+
+def tool_call_delta(index, id=None, name=None, arguments=None):
+    delta = {"index": index, "function": {"name": name, "arguments": arguments}}
+    if id:
+        delta.update(id=id, type="function")
+    return delta
+
+
+def test_tool_call_deltas_split_across_chunks_are_merged():
+    tool_calls = {}
+    for delta in [tool_call_delta(0, "call_1", "run_observation_planner", ""),
+                  tool_call_delta(0, arguments='{"config_'),
+                  tool_call_delta(0, arguments='parameters": {}}')]:
+        lm_hackers.accumulate_tool_calls(tool_calls, chunk(tool_calls=[delta]).choices[0].delta.tool_calls)
+    assert tool_calls == {0: {"id": "call_1", "type": "function",
+                              "function": {"name": "run_observation_planner",
+                                           "arguments": '{"config_parameters": {}}'}}}
+
+
+def test_parallel_tool_calls_are_kept_apart_by_index():
+    chunks = [chunk(tool_calls=[tool_call_delta(0, "call_a", "query_db", '{"psql": ')]),
+              chunk(tool_calls=[tool_call_delta(1, "call_b", "run_observation_planner", "{")]),
+              chunk(tool_calls=[tool_call_delta(1, arguments="}"), tool_call_delta(0, arguments='"SELECT 1"}')]),
+              chunk(finish_reason="tool_calls")]
+    last_stream = {"tool_calls": {}}
+    assert list(lm_hackers.aggregate_stream(chunks, last_stream)) == []
+    assert last_stream["finish_reason"] == "tool_calls"
+    tool_calls = lm_hackers.handle_stream_response_tool_calls(last_stream)
+    assert [tc["id"] for tc in tool_calls] == ["call_a", "call_b"]
+    assert [json.loads(tc["function"]["arguments"]) for tc in tool_calls] == [{"psql": "SELECT 1"}, {}]
+
+
+def test_content_is_yielded_and_the_usage_taken_from_the_last_chunk():
+    usage = {"prompt_tokens": 1200, "completion_tokens": 5, "total_tokens": 1205,
+             "prompt_tokens_details": {"cached_tokens": 1024}}
+    chunks = [chunk(content="Clear"), chunk(content=" skies"), chunk(content="", finish_reason="stop"),
+              chunk(usage=usage)]
+    last_stream = {"tool_calls": {}}
+    assert "".join(lm_hackers.aggregate_stream(iter(chunks), last_stream)) == "Clear skies"
+    assert last_stream["finish_reason"] == "stop"
+    assert last_stream["usage"].prompt_tokens == 1200
+    assert last_stream["tool_calls"] == {}
+
+
+def test_date_and_time_stay_out_of_the_cached_prefix():
+    with open(os.path.join(PROMPTS, "instructions.md")) as f:
+        system = f.read().replace("{{USERNAME}}", "space4")
+    with open(os.path.join(PROMPTS, "demonstrations.json")) as f:
+        demonstrations = lm_hackers.prepare_context_messages(json.load(f))
+    calls = [lm_hackers.build_messages("Plan tonight", system=system,
+                                       context=demonstrations + [lm_hackers.volatile_context(now)])
+             for now in (datetime(2024, 11, 15, 21, 30, 5), datetime(2024, 11, 16, 3, 0, 0))]
+    # Only the message right before the prompt changes
+    assert calls[0][:-2] == calls[1][:-2]
+    assert calls[0][-2] == {"role": "system", "content": "<date>2024-11-15</date>\n<time>21:30:05</time>"}
+    prefix = json.dumps(calls[0][:-2])
+    assert "2024-11-15" not in prefix and "21:30" not in prefix and "{{" not in prefix
+
+
+def usage(**details):
+    return SimpleNamespace(prompt_tokens=1500, completion_tokens=20, **details)
+
+
+@pytest.mark.parametrize("compl_usage, cached", [
+    (usage(prompt_tokens_details=SimpleNamespace(cached_tokens=1280)), 1280),
+    (usage(), 0), # no details, e.g. an OpenAI-compatible server
+    (usage(prompt_tokens_details=None), 0),
+    (usage(prompt_tokens_details=SimpleNamespace(cached_tokens=None)), 0),
+    (usage(prompt_tokens_details=SimpleNamespace()), 0),
+])
+def test_usage_metrics(compl_usage, cached):
+    assert lm_hackers.usage_metrics(compl_usage) == {"prompt_tokens": 1500, "cached_tokens": cached,
+                                                     "uncached_tokens": 1500 - cached, "completion_tokens": 20}
+
+
+def test_usage_metrics_of_a_streamed_response():
+    compl_usage = chunk(usage={"prompt_tokens": 1500, "completion_tokens": 20, "total_tokens": 1520}).usage
+    assert lm_hackers.usage_metrics(compl_usage)["cached_tokens"] == 0
@@ -0,0 +1,76 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+from passages import PASSAGE_COLUMNS, PassageTail, parse_list, read_passages
+
+MOCK_PASSAGES = os.path.join(os.path.dirname(__file__), "..", "mock_data", "2024_11_15__Passage_Galaxy.txt")
+
+
+def passage_lines():
+    with open(MOCK_PASSAGES) as f:
+        lines = f.read().splitlines()
+    return lines[0], [line for line in lines[1:] if line.strip()]
+
+
+def test_parse_list():
+    assert parse_list("[gprime,rprime]") == ["gprime", "rprime"]
+    assert parse_list("[1.0, 2.5]", float) == [1.0, 2.5]
+    assert parse_list("[]", int) == []
+
+
+def test_read_passages_with_schema():
+    passages = read_passages(MOCK_PASSAGES)
+    _, rows = passage_lines()
+    assert list(passages.columns) == PASSAGE_COLUMNS
+    assert len(passages) == len(rows)
+    assert passages["ID"].iloc[0] == "14158"
+    assert passages["name"].iloc[0] == "GALAXY_1"
+    assert passages["t0 [JD]"].dtype == "float64"
+    assert passages["exposures"].dtype == "int64"
+    assert passages["filter"].iloc[0] == ["gprime", "rprime", "iprime"]
+    assert passages["exp_time"].iloc[0] == [1.0, 1.0, 1.0]
+    assert passages["bin"].iloc[0] == [1, 1, 1]
+
+
+def test_read_passages_without_decoding_lists():
+    passages = read_passages(MOCK_PASSAGES, decode_lists=False)
+    assert passages["filter"].iloc[0] == "[gprime,rprime,iprime]"
+
+
+def test_ids_are_zero_padded(tmp_path):
+    header, rows = passage_lines()
+    path = tmp_path / "passages.txt"
+    path.write_text(header + "\n" + rows[0].replace("14158", "  158", 1) + "\n")
+    assert read_passages(str(path))["ID"].tolist() == ["00158"]
+
+
+def test_tail_reads_the_complete_lines_appended(tmp_path):
+    header, rows = passage_lines()
+    path = tmp_path / "passages.txt"
+    tail = PassageTail(str(path))
+    assert tail.poll() is None
+
+    with open(path, "w") as f:
+        f.write(header + "\n" + rows[0] + "\n" + rows[1][:40])
+    assert len(tail.poll()) == 1
+    assert tail.poll() is None
+    with open(path, "a") as f:
+        f.write(rows[1][40:] + "\n" + rows[2] + "\n")
+    assert len(tail.poll()) == 2
+    pd.testing.assert_frame_equal(tail.passages, read_passages(str(path)))
+
+
+def test_tail_ignores_an_existing_file_until_it_changes(tmp_path):
+    header, rows = passage_lines()
+    path = tmp_path / "passages.txt"
+    path.write_text(header + "\n" + rows[0] + "\n")
+    tail = PassageTail(str(path))
+    assert tail.poll() is None
+
+    # e.g. the planner rewrites the file of a previous run for the same day
+    path.write_text(header + "\n" + rows[1] + "\n" + rows[2] + "\n")
+    assert len(tail.poll()) == 2
+    pd.testing.assert_frame_equal(tail.passages, read_passages(str(path)))
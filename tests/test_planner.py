@@ -0,0 +1,60 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+import planner
+from tle_catalog import TLECatalog
+
+MOCK_TLE = os.path.join(ROOT, "mock_data", "2024_11_15__TLE_Galaxy.txt")
+
+
+def satrec(rev_per_day):
+    """Stand-in for a Satrec with the given mean motion."""
+    return SimpleNamespace(no_kozai=rev_per_day * 2 * np.pi / 1440)
+
+
+def test_tracks_are_separated_by_nan():
+    lon = np.array([[10.0, 20.0, 30.0], [-50.0, -40.0, -30.0]])
+    lat = np.array([[1.0, 2.0, 3.0], [-1.0, -2.0, -3.0]])
+    track_lon, track_lat = planner.track_arrays(lon, lat)
+    assert track_lon.dtype == np.float32 and track_lat.dtype == np.float32
+    np.testing.assert_array_equal(track_lon, [10, 20, 30, np.nan, -50, -40, -30, np.nan])
+    np.testing.assert_array_equal(track_lat, [1, 2, 3, np.nan, -1, -2, -3, np.nan])
+
+
+@pytest.mark.parametrize("lon", [[170.0, 179.0, -179.0, -170.0], [-170.0, -179.0, 179.0, 170.0]])
+def test_tracks_are_broken_at_the_antimeridian(lon):
+    lat = [[0.0, 1.0, 2.0, 3.0]]
+    track_lon, track_lat = planner.track_arrays(np.array([lon]), np.array(lat))
+    np.testing.assert_array_equal(track_lon, [lon[0], lon[1], np.nan, lon[2], lon[3], np.nan])
+    np.testing.assert_array_equal(track_lat, [0, 1, np.nan, 2, 3, np.nan])
+
+
+def test_tracks_near_the_antimeridian_that_dont_cross_it():
+    lon = np.array([[175.0, 179.0, 179.5], [-179.5, -179.0, -175.0]])
+    track_lon, _ = planner.track_arrays(lon, np.zeros_like(lon))
+    # Only the NaN separator lies between the two tracks, on each side of the map
+    assert np.isnan(track_lon).sum() == 2
+
+
+@pytest.mark.parametrize("rev_per_day, orbit_class", [
+    (15.5, "LEO"), # ISS
+    (planner.LEO_MIN_MEAN_MOTION, "LEO"),
+    (2.0, "MEO"), # GPS
+    (1.2, "MEO"),
+    (1.0027, "GEO"),
+    (0.9, "GEO"),
+    (0.5, "Other"),
+])
+def test_orbit_classes_by_mean_motion(rev_per_day, orbit_class):
+    assert planner.orbit_classes([satrec(rev_per_day)]).tolist() == [orbit_class]
+
+
+def test_galaxy_satellites_are_geostationary():
+    catalog = TLECatalog(MOCK_TLE)
+    assert set(planner.orbit_classes(catalog.satrecs())) == {"GEO"}
@@ -0,0 +1,101 @@
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+from passages import read_passages
+from planner_cache import META_NAME, PlannerCache, config_key
+
+MOCK_DATA = os.path.join(os.path.dirname(__file__), "..", "mock_data")
+MOCK_PASSAGES = os.path.join(MOCK_DATA, "2024_11_15__Passage_Galaxy.txt")
+MOCK_TLE = os.path.join(MOCK_DATA, "2024_11_15__TLE_Galaxy.txt")
+
+NOW = 1_700_000_000 # 2023-11-14 22:13:20 UTC
+
+
+def conf(time_start="Now", name="GALAXY"):
+    return {"General": {"TLEFile": "BULK"}, "Criteria": {"TimeStart": time_start, "NameCriteria": name}}
+
+
+def test_relative_start_times_share_a_key_within_the_resolution():
+    assert config_key(conf(), now=NOW) == config_key(conf(), now=NOW + 60)
+    assert config_key(conf(), now=NOW) != config_key(conf(), now=NOW + 900)
+
+
+def test_absolute_start_times_change_key_with_the_tle_refresh():
+    start = conf("2024-06-01 18:00:00")
+    assert config_key(start, now=NOW) == config_key(start, now=NOW + 900)
+    assert config_key(start, now=NOW) != config_key(start, now=NOW + 6 * 3600)
+
+
+def test_key_depends_on_the_configuration():
+    assert config_key(conf(name="GALAXY"), now=NOW) != config_key(conf(name="STARLINK"), now=NOW)
+    reordered = {"Criteria": conf()["Criteria"], "General": conf()["General"]}
+    assert config_key(reordered, now=NOW) == config_key(conf(), now=NOW)
+
+
+def test_put_and_get(tmp_path):
+    cache = PlannerCache(str(tmp_path))
+    assert cache.get("a") is None
+    cache.put("a", MOCK_PASSAGES, MOCK_TLE)
+    entry = cache.get("a")
+    assert open(entry.tle_file).read() == open(MOCK_TLE).read()
+    pd.testing.assert_frame_equal(entry.passages(), read_passages(MOCK_PASSAGES))
+
+
+def test_passages_are_reloaded_from_disk(tmp_path):
+    cache = PlannerCache(str(tmp_path))
+    cache.put("a", MOCK_PASSAGES, MOCK_TLE)
+    # A new process, with nothing in memory
+    entry = PlannerCache(str(tmp_path)).get("a")
+    pd.testing.assert_frame_equal(entry.passages(), read_passages(MOCK_PASSAGES))
+    assert not any(name.endswith(".pkl") for name in os.listdir(entry.path))
+
+
+def test_expired_entries_are_removed(tmp_path):
+    cache = PlannerCache(str(tmp_path), ttl=3600)
+    entry = cache.put("a", MOCK_PASSAGES, MOCK_TLE)
+    meta_path = os.path.join(entry.path, META_NAME)
+    with open(meta_path) as f:
+        meta = json.load(f)
+    meta["created"] = time.time() - 7200
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+    assert cache.get("a") is None
+    assert not os.path.exists(entry.path)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = PlannerCache(str(tmp_path))
+    entry = cache.put("a", MOCK_PASSAGES, MOCK_TLE)
+    size = sum(os.path.getsize(os.path.join(entry.path, name)) for name in os.listdir(entry.path))
+    cache.max_bytes = int(2.5 * size)
+    cache.put("b", MOCK_PASSAGES, MOCK_TLE)
+    time.sleep(0.01)
+    assert cache.get("a") is not None
+    cache.put("c", MOCK_PASSAGES, MOCK_TLE)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+
+def test_parsed_passages_kept_in_memory_are_bounded(tmp_path):
+    cache = PlannerCache(str(tmp_path), max_in_memory=2)
+    for key in "abc":
+        cache.put(key, MOCK_PASSAGES, MOCK_TLE)
+    assert list(cache._memory) == ["b", "c"]
+    cache.get("a").passages()
+    assert list(cache._memory) == ["c", "a"]
+
+
+def test_each_caller_gets_its_own_passages(tmp_path):
+    cache = PlannerCache(str(tmp_path))
+    entry = cache.put("a", MOCK_PASSAGES, MOCK_TLE)
+    passages = entry.passages()
+    # e.g. filtered and extended for scheduling by one session
+    passages.drop(index=passages.index[1:], inplace=True)
+    passages["telescope"] = "RAPTORS"
+    pd.testing.assert_frame_equal(cache.get("a").passages(), read_passages(MOCK_PASSAGES))
@@ -0,0 +1,91 @@
+import os
+import sys
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+import prescreen
+import propagation
+from synthetic import write_tle_file
+from tle_catalog import TLECatalog
+
+JD_START = 2460550.0 # 2024-08-27 12:00 UTC, 05:00 in Tucson
+HOURS = 3
+MIN_ELEVATION = 30.0
+
+
+def elevations(satrecs, jd):
+    e, r = propagation.propagate(satrecs, jd)
+    _, elevation = propagation.look_angles(r, jd[None, :], prescreen.SITE_LAT, prescreen.SITE_LON,
+                                           prescreen.SITE_ALT_KM)
+    elevation[e != 0] = -90.0
+    return elevation
+
+
+def max_elevations(catalog, jd_start, jd_end, step_s=10):
+    """Highest elevation of each object over a window, on a fine grid."""
+    return elevations(catalog.satrecs(), np.arange(jd_start, jd_end, step_s / 86400)).max(axis=1)
+
+
+def screened_catalog(tmp_path, n_objects=300):
+    write_tle_file(tmp_path / "tle.txt", n_objects, seed=1)
+    catalog = TLECatalog(tmp_path / "tle.txt")
+    return catalog, prescreen.prescreen(catalog, JD_START, JD_START + HOURS / 24, MIN_ELEVATION)
+
+
+def test_search_window_is_local_time():
+    jd_start, jd_end = prescreen.search_window({"TimeStart": "2024-08-27 05:00:00", "SearchTime": "03;00"})
+    assert jd_start == JD_START
+    assert np.isclose(jd_end - jd_start, HOURS / 24)
+
+
+def test_min_pass_elevation():
+    assert prescreen.min_pass_elevation({"PassMinimumAltitude": 20, "PassStartAltitude": 30.5}) == 30.5
+    assert prescreen.min_pass_elevation({"PassMinimumAltitude": "high"}) == 0.0
+
+
+def test_no_object_above_the_threshold_is_missed(tmp_path):
+    catalog, screen = screened_catalog(tmp_path)
+    highest = max_elevations(catalog, JD_START, JD_START + HOURS / 24)
+    assert screen.n_candidates == len(catalog)
+    visible = set(catalog.ids[highest >= MIN_ELEVATION])
+    assert visible
+    assert visible <= set(screen.ids)
+    # The survivors are at most ELEVATION_MARGIN below the threshold, in the window
+    # or in the steps sampled beyond its ends
+    margin = 2 * prescreen.SLOW_STEP_S / 86400
+    highest = max_elevations(catalog, JD_START - margin, JD_START + HOURS / 24 + margin)
+    survivors = np.isin(catalog.ids, screen.ids)
+    assert (highest[survivors] >= MIN_ELEVATION - prescreen.ELEVATION_MARGIN - 0.5).all()
+
+
+def test_approximate_passes_reach_the_threshold(tmp_path):
+    catalog, screen = screened_catalog(tmp_path)
+    passes = screen.passes
+    assert len(passes)
+    assert set(passes["ID"]) <= set(screen.ids)
+    assert (passes["el1 [deg]"] >= MIN_ELEVATION).all()
+    assert ((passes["t0 [JD]"] <= passes["t1 [JD]"]) & (passes["t1 [JD]"] <= passes["t2 [JD]"])).all()
+    assert passes["t0 [JD]"].is_monotonic_increasing
+
+
+def test_approximate_peaks_match_a_fine_grid(tmp_path):
+    catalog, screen = screened_catalog(tmp_path)
+    # The passes cut by the ends of the window peak at its edges
+    inside = screen.passes[(screen.passes["t1 [JD]"] > JD_START + 0.01) &
+                           (screen.passes["t1 [JD]"] < JD_START + HOURS / 24 - 0.01)]
+    assert len(inside)
+    for _, passage in inside.iterrows():
+        jd = passage["t1 [JD]"] + np.arange(-900, 900, 5) / 86400
+        highest = elevations([catalog.satrec(passage["ID"])], jd).max()
+        assert abs(passage["el1 [deg]"] - highest) < 1.0
+
+
+def test_name_criteria_restrict_the_candidates(tmp_path):
+    catalog, _ = screened_catalog(tmp_path, n_objects=20)
+    norad_id = catalog.ids[3]
+    assert prescreen.name_candidates(catalog, f"{int(norad_id)}").tolist() == [norad_id]
+    assert norad_id in prescreen.name_candidates(catalog, f"sat_{int(norad_id)}")
+    assert len(prescreen.name_candidates(catalog, "")) == 20
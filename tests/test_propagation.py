@@ -0,0 +1,38 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import prescreen
+import propagation
+
+MOCK_DATA = os.path.join(os.path.dirname(__file__), "..", "mock_data")
+
+
+def mock_passes():
+    passes = pd.read_csv(os.path.join(MOCK_DATA, "2024_11_15__Passage_Galaxy.txt"), sep=r"\s+", skiprows=1,
+                         header=None, usecols=range(6), names=["ID", "name", "epoch", "t0", "az0", "el0"])
+    with open(os.path.join(MOCK_DATA, "2024_11_15__TLE_Galaxy.txt")) as f:
+        lines = f.read().splitlines()
+    tles = {int(line1[2:7]): (line1, line2) for line1, line2 in zip(lines[1::3], lines[2::3])}
+    return passes, propagation.satrecs_from_tles(tles[sat_id] for sat_id in passes["ID"])
+
+
+def test_predictor_times_are_utc():
+    # The epoch column of the predictor is the TLE epoch, which sgp4 gives in UTC
+    passes, satrecs = mock_passes()
+    epochs = np.array([sat.jdsatepoch + sat.jdsatepochF for sat in satrecs])
+    np.testing.assert_allclose(passes["epoch"], epochs, rtol=0, atol=1e-8)
+
+
+def test_look_angles_match_the_predictor():
+    passes, satrecs = mock_passes()
+    jd = passes["t0"].to_numpy()
+    e, r = propagation.propagate_each(satrecs, jd)
+    azimuth, elevation = propagation.look_angles(r[:, 0], jd, prescreen.SITE_LAT, prescreen.SITE_LON,
+                                                 prescreen.SITE_ALT_KM)
+    assert (e == 0).all()
+    assert np.abs(azimuth - passes["az0"]).max() < 0.25
+    assert np.abs(elevation - passes["el0"]).max() < 0.1
@@ -0,0 +1,56 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import utils
+
+
+def passages(n):
+    return pd.DataFrame({"ID": [f"{i:05d}" for i in range(n)],
+                         "max_el": [float(i) for i in range(n)],
+                         "exposures": [i % 3 for i in range(n)]})
+
+
+def test_short_tables_are_serialized_in_full():
+    df = passages(5)
+    assert utils.summarize_dataframe(df, max_rows=5) == df.to_markdown()
+
+
+def test_long_tables_keep_their_first_and_last_rows():
+    df = passages(50)
+    summary = utils.summarize_dataframe(df, max_rows=10)
+    assert summary.startswith("Table with 50 rows and 3 columns. First and last 5 rows:")
+    assert df.head(5).to_markdown() in summary
+    assert df.tail(5).to_markdown() in summary
+    assert "00005" not in summary and "00044" not in summary
+
+
+def test_long_tables_summarize_their_numeric_columns():
+    summary = utils.summarize_dataframe(passages(50), max_rows=10)
+    stats = summary.split("Statistics of the numeric columns:\n")[1]
+    assert stats == passages(50)[["max_el", "exposures"]].agg(["min", "mean", "max"]).to_markdown()
+    assert "24.5" in stats # mean elevation
+
+
+def test_long_tables_without_numeric_columns():
+    summary = utils.summarize_dataframe(passages(50)[["ID"]], max_rows=10)
+    assert "Statistics" not in summary
+
+
+def test_summary_size_does_not_grow_with_the_table():
+    sizes = [len(utils.summarize_dataframe(passages(n), max_rows=10)) for n in (100, 100000)]
+    assert sizes[1] < sizes[0] + 50 # only the numbers get longer
+
+
+def test_at_least_one_row_is_shown():
+    summary = utils.summarize_dataframe(passages(3), max_rows=1)
+    assert passages(3).head(1).to_markdown() in summary
+
+
+def test_dataframes_are_summarized_and_text_truncated_in_the_context():
+    df = passages(utils.MAX_TABLE_ROWS + 1)
+    assert utils.serialize_content(df, "table") == utils.summarize_dataframe(df)
+    text = "x" * (utils.MAX_CONTENT_CHARS + 100)
+    assert len(utils.serialize_content(text, "text")) < len(text)
@@ -0,0 +1,39 @@
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import utils
+
+
+def test_output_is_streamed_per_line():
+    def talk(n):
+        for i in range(n):
+            print(f"line {i}")
+
+    assert list(utils.stream_function_output(talk, n=3)) == ["line 0\n", "line 1\n", "line 2\n"]
+
+
+def test_queued_function_can_be_cancelled():
+    release = threading.Event()
+    ran = []
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        busy = utils.stream_function_output(release.wait, executor=pool)
+        queued = utils.stream_function_output(lambda: ran.append(True), executor=pool)
+        assert queued.cancel()
+        assert not busy.cancel()
+        release.set()
+        assert list(busy) == []
+        assert list(queued) == []
+    assert ran == []
+
+
+def test_done_callback_waits_for_the_running_function():
+    release = threading.Event()
+    done = threading.Event()
+    output = utils.stream_function_output(release.wait)
+    output.add_done_callback(done.set)
+    assert not done.is_set()
+    release.set()
+    assert done.wait(5)
@@ -0,0 +1,112 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+import tle_catalog
+from synthetic import write_tle_file
+from tle_catalog import TLECatalog
+
+MOCK_TLE = os.path.join(ROOT, "mock_data", "2024_11_15__TLE_Galaxy.txt")
+
+GALAXY_1 = ("1 14158U 83065A   24240.32592521 -.00000068  00000-0  00000-0 0  9997",
+            "2 14158  14.0733 346.5601 0003757 189.5494 167.3844  1.00105678 40023")
+GALAXY_1R = ("1 23016U 94013A   24240.41993731 -.00000085  00000-0  00000-0 0  9992",
+             "2 23016  12.1054  26.9766 0002338 162.8003 209.8112  0.99219544 39658")
+
+
+def write_tle(path, lines, mtime_ns=None):
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return str(path)
+
+
+def test_catalog_is_indexed_by_norad_id():
+    catalog = TLECatalog(MOCK_TLE)
+    assert len(catalog) > 0
+    assert catalog["14158"] == GALAXY_1
+    assert catalog.name("14158") == "0000 GALAXY 1"
+    assert catalog.line0("14158") == "GALAXY 1"
+    assert "99999" not in catalog
+    assert list(catalog)[:2] == ["14158", "23016"]
+
+
+def test_catalog_without_name_lines(tmp_path):
+    catalog = TLECatalog(write_tle(tmp_path / "tle.txt", [*GALAXY_1, *GALAXY_1R]))
+    assert dict(catalog) == {"14158": GALAXY_1, "23016": GALAXY_1R}
+    assert catalog.name("23016") == ""
+    assert catalog.line0("23016") == ""
+
+
+def test_satrecs_are_built_once(tmp_path):
+    catalog = TLECatalog(write_tle(tmp_path / "tle.txt", ["GALAXY 1", *GALAXY_1]))
+    satrec = catalog.satrec("14158")
+    assert satrec.satnum == 14158
+    assert catalog.satrecs(["14158"]) == [satrec]
+
+
+def test_load_reuses_the_catalog_until_the_file_changes(tmp_path):
+    path = write_tle(tmp_path / "tle.txt", ["GALAXY 1", *GALAXY_1], mtime_ns=1_000_000_000)
+    catalog = TLECatalog.load(path)
+    assert TLECatalog.load(path) is catalog
+
+    # Same size, later modification time
+    write_tle(path, ["GALAXY 9", *GALAXY_1], mtime_ns=2_000_000_000)
+    reloaded = TLECatalog.load(path)
+    assert reloaded is not catalog
+    assert reloaded.name("14158") == "GALAXY 9"
+
+
+def test_load_drops_deleted_and_least_recently_used_catalogs(tmp_path, monkeypatch):
+    monkeypatch.setattr(TLECatalog, "_cache", type(TLECatalog._cache)())
+    monkeypatch.setattr(tle_catalog, "MAX_CACHED_CATALOGS", 2)
+    paths = [write_tle(tmp_path / f"tle_{i}.txt", list(GALAXY_1)) for i in range(3)]
+    for path in paths:
+        TLECatalog.load(path)
+    assert list(TLECatalog._cache) == [os.path.abspath(path) for path in paths[1:]]
+
+    os.remove(paths[1])
+    TLECatalog.load(paths[2])
+    assert list(TLECatalog._cache) == [os.path.abspath(paths[2])]
+
+
+@pytest.fixture(scope="module")
+def bulk_catalog(tmp_path_factory):
+    """A BULK-sized catalog: 30000 objects, several MB."""
+    path = tmp_path_factory.mktemp("bulk") / "bulk.txt"
+    ids = write_tle_file(path, 30000, seed=2)
+    return str(path), ids
+
+
+def test_lookup_finds_one_object_without_a_full_parse(bulk_catalog, monkeypatch):
+    path, ids = bulk_catalog
+    assert os.path.getsize(path) > 4 * 1024**2
+    parsed = TLECatalog(path)
+
+    def full_parse(*args, **kwargs):
+        raise AssertionError("lookup parsed the whole catalog")
+
+    monkeypatch.setattr(TLECatalog, "_parse", full_parse)
+    monkeypatch.setattr(TLECatalog, "load", full_parse)
+    for norad_id in (ids[0], ids[len(ids) // 2], ids[-1]):
+        key = f"{norad_id:05d}"
+        assert TLECatalog.lookup(path, norad_id) == (parsed.name(key), *parsed[key])
+        assert TLECatalog.lookup(path, key) == TLECatalog.lookup(path, norad_id)
+
+
+def test_lookup_of_a_missing_object(bulk_catalog, tmp_path):
+    path, ids = bulk_catalog
+    missing = next(norad_id for norad_id in range(1, 99999) if norad_id not in set(ids))
+    assert TLECatalog.lookup(path, missing) is None
+    assert TLECatalog.lookup(write_tle(tmp_path / "empty.txt", []), 14158) is None
+
+
+def test_lookup_without_name_lines(tmp_path):
+    path = write_tle(tmp_path / "tle.txt", [*GALAXY_1, *GALAXY_1R])
+    assert TLECatalog.lookup(path, 14158) == ("", *GALAXY_1)
+    assert TLECatalog.lookup(path, "23016") == ("", *GALAXY_1R)
@@ -0,0 +1,53 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import tracing
+
+
+@tracing.traced()
+def parse():
+    with tracing.span("read", rows=3):
+        pass
+
+
+def test_spans_nest_and_are_exported_with_their_trace(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    tracing.configure(str(path))
+    try:
+        with tracing.span("rerun") as root:
+            parse()
+            parse()
+    finally:
+        tracing.configure(None)
+    spans = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [s["name"] for s in spans] == ["read", "parse", "read", "parse", "rerun"]
+    assert {s["trace_id"] for s in spans} == {root.trace_id}
+    by_id = {s["span_id"]: s for s in spans}
+    assert by_id[spans[0]["parent_id"]]["name"] == "parse"
+    assert spans[0]["attributes"] == {"rows": 3}
+    assert set(tracing.totals(root)) == {"read", "parse", "rerun"}
+    assert [row["span"] for row in tracing.breakdown(root)] == \
+        ["rerun", "  parse", "    read", "  parse", "    read"]
+
+
+def test_errors_are_recorded():
+    with pytest.raises(ValueError):
+        with tracing.span("rerun") as root:
+            with tracing.span("plot"):
+                raise ValueError("bad passages")
+    assert [(s.name, s.attributes.get("error")) for s in root.spans] == \
+        [("plot", "ValueError"), ("rerun", "ValueError")]
+
+
+def test_span_started_without_becoming_current():
+    with tracing.span("rerun") as root:
+        stream = tracing.start_span("stream")
+        with tracing.span("render") as render:
+            pass
+        stream.end()
+    assert render.parent_id == root.span_id
+    assert [s.name for s in root.spans] == ["render", "stream", "rerun"]